@@ -1,4 +1,5 @@
 import pool from '../config/dbConn.js'; // Import the database connection pool
+import recommendationService from '../services/recommendationService.js'; // Import the recommendation service
 
 // Function to handle submission of answers
 export const handleAnswers = async (req, res) => {
@@ -20,6 +21,7 @@ export const handleAnswers = async (req, res) => {
     });
 
     await Promise.all(queries); // Execute all queries concurrently
+    recommendationService.invalidateUser(userId); // Drop recommendations computed from the old preferences
     res.status(201).json({ message: 'Answers submitted successfully.' }); // Return success response
   } catch (error) {
     res.status(500).json({ message: 'Failed to save answers.' }); // Return error response if queries fail
@@ -1,5 +1,6 @@
 import axios from "axios"; // Import axios for making HTTP requests
 import pool from "../config/dbConn.js"; // Import the database connection pool
+import recommendationService from "../services/recommendationService.js"; // Import the recommendation service
 import {
   getUserPreferences, // Utility function to fetch user preferences
   extractYear, // Utility function to extract year from movie title
@@ -649,6 +650,8 @@ export const rateMovies = async (req, res) => {
     }
 
     await pool.query("COMMIT"); // Commit transaction
+    recommendationService.updateUserRatings(userId, ratings); // Apply the new ratings to the stored user vector
+    recommendationService.invalidateUser(userId); // Drop recommendations computed from the old ratings
     res.status(200).json({ message: "Ratings successfully saved." }); // Return success response
   } catch (error) {
     await pool.query("ROLLBACK"); // Rollback transaction on error
@@ -21,7 +21,8 @@ export const getRecommendations = async (req, res) => {
     if (
       !recommendations ||
       (!recommendations.ncf_recommendations?.length &&
-        !recommendations.cf_recommendations?.length)
+        !recommendations.cf_recommendations?.length &&
+        !recommendations.icf_recommendations?.length)
     ) {
       return res.status(404).json({ success: false, message: "No recommendations available" });
     }
@@ -29,7 +30,8 @@ export const getRecommendations = async (req, res) => {
     // Extract movie IDs from both recommendation sets
     const ncfMovieIds = recommendations.ncf_recommendations?.map((rec) => rec.itemID) || [];
     const cfMovieIds = recommendations.cf_recommendations?.map((rec) => rec.itemID) || [];
-    const allMovieIds = [...new Set([...ncfMovieIds, ...cfMovieIds])]; // Combine and deduplicate movie IDs
+    const icfMovieIds = recommendations.icf_recommendations?.map((rec) => rec.itemID) || [];
+    const allMovieIds = [...new Set([...ncfMovieIds, ...cfMovieIds, ...icfMovieIds])]; // Combine and deduplicate movie IDs
 
     if (allMovieIds.length === 0) {
       return res.status(404).json({
@@ -92,14 +94,39 @@ export const getRecommendations = async (req, res) => {
         source: "user_cf", // Source of recommendation
       })) || [];
 
+    const enrichedIcfRecommendations =
+      recommendations.icf_recommendations?.map((rec) => ({
+        itemID: rec.itemID,
+        prediction: rec.prediction,
+        title: movieDetails[rec.itemID]?.title || "Unknown Movie",
+        genres: movieDetails[rec.itemID]?.genres || "",
+        isLiked: likedMovieIds.has(rec.itemID), // Check if the movie is liked
+        source: "item_cf", // Source of recommendation
+      })) || [];
+
+    // Final ranking fused from the lists above; sources names the recommenders that ranked each movie
+    const enrichedFusedRecommendations =
+      recommendations.fused_recommendations?.map((rec) => ({
+        itemID: rec.itemID,
+        prediction: rec.prediction,
+        title: movieDetails[rec.itemID]?.title || "Unknown Movie",
+        genres: movieDetails[rec.itemID]?.genres || "",
+        isLiked: likedMovieIds.has(rec.itemID), // Check if the movie is liked
+        source: "fused", // Source of recommendation
+        sources: rec.sources || [],
+      })) || [];
+
     // Return the enriched recommendations
     res.json({
       ncf_recommendations: enrichedNcfRecommendations,
       cf_recommendations: enrichedCfRecommendations,
+      icf_recommendations: enrichedIcfRecommendations, // Empty unless RECOMMENDATION_SOURCES includes icf
+      fused_recommendations: enrichedFusedRecommendations,
+      partial: recommendations.partial === true, // One of the recommenders failed or timed out
     });
   } catch (error) {
     console.error("Error getting recommendations:", error); // Log error for debugging
-    res.status(500).json({
+    res.status(error.code === "overloaded" ? 503 : 500).json({ // 503 when the workers shed load
       success: false,
       message: "Failed to get recommendations",
       error: error.message,
@@ -0,0 +1,268 @@
+import json
+import sys
+import os
+import argparse
+import platform
+import resource
+import time
+import tracemalloc
+import numpy as np
+
+##############################################################################
+# INITIALIZATION
+##############################################################################
+
+# Defaults for a benchmark run
+DEFAULT_REQUESTS = 20
+DEFAULT_WARMUP = 2
+DEFAULT_TOLERANCE = 0.2  # Allowed relative slowdown before a stage counts as a regression
+MIN_REGRESSION_MS = 1.0  # Differences below this are treated as noise
+
+# Year ranges offered by the survey (see recommendationService.js)
+DECADE_CHOICES = [
+    list(range(1920, 1990)),
+    list(range(1990, 2000)),
+    list(range(2000, 2010)),
+    list(range(2010, 2024)),
+]
+
+##############################################################################
+# MEASUREMENT
+##############################################################################
+
+def summarize(durations):
+    """
+    Latency statistics of a stage.
+    Args:
+        durations: Durations in seconds.
+    Returns:
+        Dictionary with run count and mean/p50/p95/min/max in milliseconds.
+    """
+    ms = np.asarray(durations, dtype=np.float64) * 1000
+    return {
+        "runs": len(ms),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "min_ms": float(ms.min()),
+        "max_ms": float(ms.max()),
+    }
+
+def measure_once(fn):
+    """
+    Time a single call.
+    Returns:
+        Tuple of (result, seconds).
+    """
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+def peak_allocation(fn):
+    """
+    Peak Python/NumPy allocation of a call, traced separately from the timed runs.
+    Returns:
+        Peak traced memory in MB.
+    """
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 2**20
+
+def max_rss_mb():
+    """Peak resident set size of this process in MB."""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage / 2**20 if sys.platform == 'darwin' else usage / 2**10
+
+def synthetic_requests(store, movie_index, n, seed=42):
+    """
+    Cold-start requests shaped like survey submissions.
+    Args:
+        store: RatingsStore used to pick popular movies.
+        movie_index: MovieIndex providing the genre vocabulary.
+        n: Number of requests.
+        seed: Random seed.
+    Returns:
+        List of (ratings, genres, decades) tuples.
+    """
+    rng = np.random.default_rng(seed)
+    popularity = np.bincount(store.indices, minlength=store.n_items).astype(np.float64)
+    popularity /= popularity.sum()
+
+    requests = []
+    for _ in range(n):
+        rated = rng.choice(store.item_ids, int(rng.integers(10, 26)), replace=False, p=popularity)
+        ratings = {int(item): float(rng.integers(1, 6)) for item in rated}
+        genres = rng.choice(movie_index.genre_names, int(rng.integers(1, 4)), replace=False).tolist()
+        decades = DECADE_CHOICES[int(rng.integers(len(DECADE_CHOICES)))]
+        requests.append((ratings, genres, decades))
+    return requests
+
+def run_benchmark(n_requests=DEFAULT_REQUESTS, warmup=DEFAULT_WARMUP, seed=42):
+    """
+    Time the load steps once and every serving stage over synthetic requests.
+
+    Paths come from config, so point MODEL_PATH/TRAIN_FILE/MOVIES_FILE/
+    RATINGS_STORE_DIR at the dataset before calling this.
+    Args:
+        n_requests: Timed requests per stage.
+        warmup: Untimed requests run first.
+        seed: Seed of the request generator.
+    Returns:
+        Result dictionary (see write-up in main).
+    """
+    import recommendations as rec
+
+    stages = {}
+    store, seconds = measure_once(rec.get_ratings_store)
+    stages["load_ratings_store"] = summarize([seconds])
+    model, seconds = measure_once(rec.load_model)
+    stages["load_model"] = summarize([seconds])
+    movie_index, seconds = measure_once(rec.get_movie_index)
+    stages["load_movie_index"] = summarize([seconds])
+    _, seconds = measure_once(rec.get_ubcf_index)
+    stages["load_ubcf_index"] = summarize([seconds])
+
+    requests = synthetic_requests(store, movie_index, n_requests + warmup, seed)
+    embeddings = {}
+    candidates = {}
+
+    steps = [
+        ("create_user_embedding", lambda i, r: rec.create_user_embedding_from_items(model, r[0])),
+        ("retrieve_candidates_ncf", lambda i, r: rec.retrieve_candidates_ncf(r[1], r[2], k=5000, exploration_ratio=0.1)),
+        ("retrieve_candidates", lambda i, r: rec.retrieve_candidates(model, embeddings[i][0], r[1], r[2])),
+        ("batch_predict_with_embeddings", lambda i, r: rec.batch_predict_with_embeddings(model, embeddings[i][0], embeddings[i][1], candidates[i])),
+        ("get_recommendations_ubcf", lambda i, r: rec.get_recommendations_ubcf(None, r[0], r[1], r[2])),
+        ("get_recommendations", lambda i, r: rec.get_recommendations(None, r[0], r[1], r[2], model=model)),
+    ]
+
+    for name, step in steps:
+        durations = []
+        for i, request in enumerate(requests):
+            result, seconds = measure_once(lambda: step(i, request))
+            if name == "create_user_embedding":
+                embeddings[i] = result
+            elif name == "retrieve_candidates":
+                candidates[i] = result
+            if i >= warmup:
+                durations.append(seconds)
+        stages[name] = summarize(durations)
+        stages[name]["peak_alloc_mb"] = peak_allocation(lambda: step(warmup, requests[warmup]))
+        print(f"{name}: p50 {stages[name]['p50_ms']:.2f} ms, p95 {stages[name]['p95_ms']:.2f} ms", file=sys.stderr)
+
+    return {
+        "created_at": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "dataset": {
+            "train_file": rec.TRAIN_FILE,
+            "users": int(store.n_users),
+            "items": int(store.n_items),
+            "ratings": int(store.nnz),
+        },
+        "settings": {
+            "requests": n_requests,
+            "warmup": warmup,
+            "seed": seed,
+            "ncf_retrieval": rec.NCF_RETRIEVAL,
+            "ubcf_neighbour_search": rec.UBCF_NEIGHBOUR_SEARCH,
+        },
+        "stages": stages,
+        "max_rss_mb": max_rss_mb(),
+    }
+
+##############################################################################
+# REGRESSION CHECK
+##############################################################################
+
+def compare(result, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compare p50 latency and peak allocation of every stage against a baseline.
+    Args:
+        result: Result of run_benchmark().
+        baseline: Earlier result loaded from JSON.
+        tolerance: Allowed relative increase.
+    Returns:
+        List of per-stage comparison dictionaries; "regression" marks the failures.
+    """
+    rows = []
+    for name, current in result["stages"].items():
+        previous = baseline.get("stages", {}).get(name)
+        if previous is None:
+            continue
+        ratio = current["p50_ms"] / previous["p50_ms"] if previous["p50_ms"] > 0 else float('inf')
+        slower = ratio > 1 + tolerance and current["p50_ms"] - previous["p50_ms"] > MIN_REGRESSION_MS
+        memory_ratio = None
+        heavier = False
+        if previous.get("peak_alloc_mb") and "peak_alloc_mb" in current:
+            memory_ratio = current["peak_alloc_mb"] / previous["peak_alloc_mb"]
+            heavier = memory_ratio > 1 + tolerance and current["peak_alloc_mb"] - previous["peak_alloc_mb"] > 1.0
+        rows.append({
+            "stage": name,
+            "baseline_p50_ms": previous["p50_ms"],
+            "p50_ms": current["p50_ms"],
+            "ratio": ratio,
+            "memory_ratio": memory_ratio,
+            "regression": slower or heavier,
+        })
+    return rows
+
+def print_comparison(rows):
+    """Write the comparison as a table to stderr."""
+    print(f"{'stage':32} {'baseline':>10} {'current':>10} {'ratio':>7} {'mem':>7}", file=sys.stderr)
+    for row in rows:
+        memory = f"{row['memory_ratio']:.2f}" if row['memory_ratio'] is not None else '-'
+        flag = '  REGRESSION' if row['regression'] else ''
+        print(f"{row['stage']:32} {row['baseline_p50_ms']:>9.2f}ms {row['p50_ms']:>8.2f}ms {row['ratio']:>7.2f} {memory:>7}{flag}", file=sys.stderr)
+
+###############################################################################
+# MAIN EXEC
+###############################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the recommendation pipeline stage by stage')
+    parser.add_argument('--data_dir', type=str, help='Dataset from synthetic_data.py (train.csv, movies.csv, ncf_neuMF/)')
+    parser.add_argument('--requests', type=int, default=DEFAULT_REQUESTS, help='Timed requests per stage')
+    parser.add_argument('--warmup', type=int, default=DEFAULT_WARMUP, help='Untimed requests per stage')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the request generator')
+    parser.add_argument('--output', type=str, help='Write the result JSON here (default: stdout)')
+    parser.add_argument('--baseline', type=str, help='Earlier result JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='Allowed relative slowdown')
+
+    args = parser.parse_args()
+
+    if args.data_dir:
+        # config reads these when recommendations is imported
+        os.environ['TRAIN_FILE'] = os.path.join(args.data_dir, 'train.csv')
+        os.environ['MOVIES_FILE'] = os.path.join(args.data_dir, 'movies.csv')
+        os.environ['MODEL_PATH'] = os.path.join(args.data_dir, 'ncf_neuMF/')
+        os.environ['RATINGS_STORE_DIR'] = os.path.join(args.data_dir, 'ratings_store/')
+    # Measure the computation itself, without cached results or app user fold-in
+    os.environ['RECOMMENDATION_CACHE_SIZE'] = '0'
+    os.environ['UBCF_DELTA_MERGE_THRESHOLD'] = '0'
+
+    # Keep stdout for the result JSON
+    result_out = sys.stdout
+    sys.stdout = sys.stderr
+
+    result = run_benchmark(args.requests, args.warmup, args.seed)
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            rows = compare(result, json.load(f), args.tolerance)
+        print_comparison(rows)
+        result["comparison"] = {"baseline": args.baseline, "tolerance": args.tolerance, "stages": rows}
+        if any(row["regression"] for row in rows):
+            exit_code = 1
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    else:
+        result_out.write(json.dumps(result, indent=2) + "\n")
+    sys.exit(exit_code)
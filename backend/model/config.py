@@ -0,0 +1,91 @@
+import os
+
+##############################################################################
+# PATHS
+##############################################################################
+
+# Paths for project directories and files
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, '../..'))
+
+# Paths for model and data files, overridable through the environment (e.g. for benchmarks)
+MODEL_PATH = os.environ.get('MODEL_PATH', os.path.join(PROJECT_ROOT, "model_training/ncf_neuMF/"))
+TRAIN_FILE = os.environ.get('TRAIN_FILE', os.path.join(PROJECT_ROOT, "model_training/ml-32m/train.csv"))
+MOVIES_FILE = os.environ.get('MOVIES_FILE', os.path.join(PROJECT_ROOT, "model_training/ml-32m/movies.csv"))
+
+# Compiled artifacts built from the files above
+RATINGS_STORE_DIR = os.environ.get('RATINGS_STORE_DIR', os.path.join(os.path.dirname(TRAIN_FILE), "ratings_store/"))
+# One MIPS index per serving precision of the item tables, {precision} is filled in
+MIPS_INDEX_FILE = os.path.join(MODEL_PATH, "mips_index_{precision}.npz")
+WEIGHTS_BUNDLE_DIR = os.path.join(MODEL_PATH, "weights_bundle/")
+MOVIE_INDEX_FILE = os.path.join(os.path.dirname(MOVIES_FILE), "movie_index.npz")
+ITEM_STATS_FILE = os.path.join(os.path.dirname(MOVIES_FILE), "item_stats.npz")
+
+##############################################################################
+# SERVING OPTIONS
+##############################################################################
+
+# UBCF neighbour search: "exact" scans every user, "ann" uses the prebuilt
+# approximate index (python ubcf_ann.py build) and falls back to exact without it
+UBCF_NEIGHBOUR_SEARCH = os.environ.get('UBCF_NEIGHBOUR_SEARCH', 'exact')
+
+# NCF candidate retrieval: "heuristic" samples by genre/decade, "mips" takes the
+# items with the highest GMF inner product with the user vector (python mips_index.py),
+# "hybrid" merges a smaller heuristic pool with the MIPS results, "exhaustive"
+# scores every movie matching the preferences in parallel shards
+NCF_RETRIEVAL = os.environ.get('NCF_RETRIEVAL', 'heuristic')
+
+# Precision of the NeuMF item tables while serving: "float32", "float16" or
+# "int8" (per-row scales); store them in the bundle with python ncf_scoring.py --precision
+NCF_WEIGHTS_PRECISION = os.environ.get('NCF_WEIGHTS_PRECISION', 'float32')
+
+# Result cache of the resident workers: entries kept in memory (0 disables the
+# cache), their lifetime in seconds and an optional SQLite file shared by workers
+RECOMMENDATION_CACHE_SIZE = int(os.environ.get('RECOMMENDATION_CACHE_SIZE', '1024'))
+RECOMMENDATION_CACHE_TTL = float(os.environ.get('RECOMMENDATION_CACHE_TTL', '3600'))
+RECOMMENDATION_CACHE_DB = os.environ.get('RECOMMENDATION_CACHE_DB') or None
+
+# Optional SQLite file with the cold-start vectors of app users, updated per
+# rating (op "update_ratings") instead of recomputed from all ratings per request
+USER_EMBEDDINGS_DB = os.environ.get('USER_EMBEDDINGS_DB') or None
+
+# App users collected in the UBCF delta segment before a background merge
+# writes a new ratings store version (0 merges only via python ratings_delta.py merge)
+UBCF_DELTA_MERGE_THRESHOLD = int(os.environ.get('UBCF_DELTA_MERGE_THRESHOLD', '1000'))
+
+# Instrumentation of the resident workers: trace Python allocations per request
+# (adds overhead), dump cProfile profiles of requests slower than the given
+# milliseconds (0 disables it) and write Prometheus metrics into a directory
+# read by the node_exporter textfile collector (unset disables it)
+RECOMMENDATION_TRACE_MEMORY = os.environ.get('RECOMMENDATION_TRACE_MEMORY', '0') == '1'
+RECOMMENDATION_PROFILE_SLOW_MS = float(os.environ.get('RECOMMENDATION_PROFILE_SLOW_MS', '0'))
+RECOMMENDATION_PROFILE_DIR = os.environ.get('RECOMMENDATION_PROFILE_DIR', os.path.join(PROJECT_ROOT, "model_training/profiles/"))
+RECOMMENDATION_METRICS_DIR = os.environ.get('RECOMMENDATION_METRICS_DIR') or None
+
+# Recommenders whose lists are returned: "ncf", "ubcf" and "icf" (item-based CF
+# over the table built by python icf.py), comma separated
+RECOMMENDATION_SOURCES = [s.strip() for s in os.environ.get('RECOMMENDATION_SOURCES', 'ncf,ubcf').split(',') if s.strip()]
+
+# The recommenders run concurrently; a branch that does not finish within its
+# timeout (seconds) is left out and the response is marked as partial
+NCF_BRANCH_TIMEOUT = float(os.environ.get('NCF_BRANCH_TIMEOUT', '30'))
+UBCF_BRANCH_TIMEOUT = float(os.environ.get('UBCF_BRANCH_TIMEOUT', '30'))
+ICF_BRANCH_TIMEOUT = float(os.environ.get('ICF_BRANCH_TIMEOUT', '30'))
+
+# Scheduler of the resident workers: recommend requests arriving within a window
+# (ms) are served together, up to a batch size, with the NCF scores of all their
+# users computed in one pass. Beyond the queue limit requests are rejected, and
+# requests still queued after their deadline (ms, or "deadline_ms" sent with the
+# request) fail without being computed
+RECOMMENDATION_BATCH_WINDOW_MS = float(os.environ.get('RECOMMENDATION_BATCH_WINDOW_MS', '10'))
+RECOMMENDATION_BATCH_SIZE = int(os.environ.get('RECOMMENDATION_BATCH_SIZE', '32'))
+RECOMMENDATION_QUEUE_LIMIT = int(os.environ.get('RECOMMENDATION_QUEUE_LIMIT', '256'))
+RECOMMENDATION_DEADLINE_MS = float(os.environ.get('RECOMMENDATION_DEADLINE_MS', '60000'))
+
+# Row blocks the exact UBCF similarity scan is split into, scored on separate threads
+UBCF_SIMILARITY_SHARDS = int(os.environ.get('UBCF_SIMILARITY_SHARDS', str(min(os.cpu_count() or 1, 8))))
+
+# Item blocks exhaustive NCF scoring (and very large candidate lists) is split
+# into, scored on separate threads; BLAS is then limited to one thread per
+# process when threadpoolctl is installed
+NCF_SCORING_SHARDS = int(os.environ.get('NCF_SCORING_SHARDS', str(min(os.cpu_count() or 1, 8))))
@@ -0,0 +1,395 @@
+import json
+import sys
+import os
+import argparse
+import platform
+import time
+import numpy as np
+from benchmark import summarize, peak_allocation, max_rss_mb
+
+##############################################################################
+# INITIALIZATION
+##############################################################################
+
+# Defaults for an evaluation run
+DEFAULT_USERS = 200
+DEFAULT_SEED_RATINGS = 5
+MIN_USER_RATINGS = 20  # Held-out users need ratings left after the seed ones
+RELEVANCE_THRESHOLD = 4.0  # Held-out ratings from this value count as relevant
+CUTOFF = 10  # Metrics are computed @10, the size of every recommendation list
+PREFERRED_GENRES = 3  # Survey genres derived from the seed ratings
+
+# Serving settings of recommendations.py a configuration may override
+TUNABLE_SETTINGS = {
+    "NCF_RETRIEVAL": str,
+    "UBCF_NEIGHBOUR_SEARCH": str,
+    "NCF_WEIGHTS_PRECISION": str,
+    "CANDIDATE_BUDGET": int,
+    "MIPS_CANDIDATES": int,
+    "HYBRID_HEURISTIC_K": int,
+    "NCF_SCORING_SHARDS": int,
+}
+
+# Configurations evaluated when none are given: exact serving, then one approximation each
+DEFAULT_CONFIGS = [
+    "exact",
+    "ubcf_ann:UBCF_NEIGHBOUR_SEARCH=ann",
+    "budget_1000:CANDIDATE_BUDGET=1000",
+    "mips:NCF_RETRIEVAL=mips",
+    "exhaustive:NCF_RETRIEVAL=exhaustive",
+    "float16:NCF_WEIGHTS_PRECISION=float16",
+    "int8:NCF_WEIGHTS_PRECISION=int8",
+]
+
+# Recommendation lists scored per configuration, by recommender
+LISTS = ["ncf", "ubcf", "icf", "fused"]
+
+def parse_config(spec):
+    """
+    Parse a configuration given as "name:SETTING=value,SETTING=value".
+    Args:
+        spec: Configuration string; a bare name keeps the defaults.
+    Returns:
+        Tuple of (name, dictionary of setting overrides).
+    """
+    name, _, assignments = spec.partition(':')
+    overrides = {}
+    for assignment in filter(None, assignments.split(',')):
+        setting, _, value = assignment.partition('=')
+        setting = setting.strip()
+        if setting not in TUNABLE_SETTINGS:
+            raise ValueError(f"Unknown setting in configuration {name}: {setting} (known: {', '.join(TUNABLE_SETTINGS)})")
+        overrides[setting] = TUNABLE_SETTINGS[setting](value.strip())
+    return name, overrides
+
+##############################################################################
+# HOLDOUT
+##############################################################################
+
+def holdout_users(store, movie_index, n_users, n_seed, seed=42):
+    """
+    Turn training users into simulated cold-start users.
+
+    Every selected user keeps n_seed random ratings as the survey ratings of
+    the request; their other ratings from RELEVANCE_THRESHOLD up are the
+    relevant items. Survey genres are the most frequent genres of the liked
+    seed movies. The users' rows are hidden from UBCF neighbour search, but
+    the NCF item embeddings and the ICF table were trained with them, which
+    makes those scores slightly optimistic.
+    Args:
+        store: RatingsStore of the training data.
+        movie_index: MovieIndex providing genres.
+        n_users: Number of users to hold out.
+        n_seed: Seed ratings per user.
+        seed: Random seed.
+    Returns:
+        List of dictionaries with the user's row, seed ratings, genres and relevant item IDs.
+    """
+    rng = np.random.default_rng(seed)
+    counts = np.diff(np.asarray(store.indptr[:store.n_trained_users + 1]))
+    eligible = np.flatnonzero(counts >= max(MIN_USER_RATINGS, n_seed + 1))
+    rows = np.sort(rng.choice(eligible, min(n_users, len(eligible)), replace=False))
+
+    movie_rows = {int(movie_id): row for row, movie_id in enumerate(movie_index.movie_ids)}
+    users = []
+    for row in rows:
+        lo, hi = int(store.indptr[row]), int(store.indptr[row + 1])
+        items = np.asarray(store.item_ids)[np.asarray(store.indices[lo:hi])]
+        ratings = np.asarray(store.data[lo:hi], dtype=np.float64)
+        order = rng.permutation(len(items))
+        seed_positions, held_out = order[:n_seed], order[n_seed:]
+
+        relevant = set(items[held_out][ratings[held_out] >= RELEVANCE_THRESHOLD].tolist())
+        if not relevant:
+            continue
+        seed_ratings = {int(items[i]): float(ratings[i]) for i in seed_positions}
+
+        # The genres a user would pick in the survey: those of the seed movies they liked
+        liked = [item for item, rating in seed_ratings.items() if rating >= RELEVANCE_THRESHOLD] or list(seed_ratings)
+        genre_counts = np.zeros(len(movie_index.genre_names), dtype=np.int64)
+        for item in liked:
+            if item in movie_rows:
+                bits = int(movie_index.genre_bits[movie_rows[item]])
+                genre_counts += [(bits >> bit) & 1 for bit in range(len(genre_counts))]
+        top = np.argsort(-genre_counts, kind='stable')[:PREFERRED_GENRES]
+        genres = [movie_index.genre_names[bit] for bit in top if genre_counts[bit] > 0]
+
+        users.append({"row": int(row), "ratings": seed_ratings, "genres": genres or None, "relevant": relevant})
+    return users
+
+##############################################################################
+# METRICS
+##############################################################################
+
+def ranking_metrics(recommended, relevant, k=CUTOFF):
+    """
+    Precision, recall and NDCG of a ranked list with binary relevance.
+    Args:
+        recommended: Recommended item IDs, best first.
+        relevant: Set of relevant item IDs.
+        k: Cutoff.
+    Returns:
+        Tuple of (precision, recall, ndcg).
+    """
+    hits = np.array([item in relevant for item in recommended[:k]], dtype=np.float64)
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    ideal = discounts[:min(len(relevant), k)].sum()
+    dcg = (hits * discounts[:len(hits)]).sum()
+    return hits.sum() / k, hits.sum() / len(relevant), dcg / ideal if ideal > 0 else 0.0
+
+##############################################################################
+# EVALUATION
+##############################################################################
+
+def recommend(rec, model, user, sources, exclude_rows):
+    """
+    Produce every recommendation list for one held-out user, timing each stage.
+    Returns:
+        Tuple of (dictionary of item ID lists, dictionary of stage durations in seconds).
+    """
+    ratings, genres = user["ratings"], user["genres"]
+    lists, durations = {}, {}
+
+    start = time.perf_counter()
+    candidates = rec.retrieve_request_candidates(genres, None)
+    durations["retrieval"] = time.perf_counter() - start
+
+    results = {}
+    if "ncf" in sources:
+        start = time.perf_counter()
+        results["ncf"] = rec.get_recommendations_ncf(model, ratings, genres, None, candidates)
+        durations["ncf"] = time.perf_counter() - start
+    if "ubcf" in sources:
+        start = time.perf_counter()
+        results["ubcf"] = rec.get_recommendations_ubcf(None, ratings, genres, None, candidates, exclude_rows=exclude_rows)
+        durations["ubcf"] = time.perf_counter() - start
+    if "icf" in sources:
+        start = time.perf_counter()
+        results["icf"] = rec.get_recommendations_icf(ratings, genres, None)
+        durations["icf"] = time.perf_counter() - start
+
+    results["fused"] = rec.fuse_recommendations(results)
+    durations["total"] = sum(durations.values())
+    for name, recommendations in results.items():
+        lists[name] = [int(r["itemID"]) for r in recommendations]
+    return lists, durations
+
+def apply_settings(rec, model, base_engine, overrides):
+    """
+    Switch recommendations.py to a configuration.
+    Args:
+        rec: recommendations module.
+        model: Loaded model; its scoring engine is replaced for other precisions.
+        base_engine: float32 scoring engine loaded at start.
+        overrides: Setting overrides of the configuration.
+    Returns:
+        Dictionary with the previous values, for restore_settings().
+    """
+    previous = {setting: getattr(rec, setting) for setting in overrides}
+    for setting, value in overrides.items():
+        setattr(rec, setting, value)
+
+    precision = overrides.get("NCF_WEIGHTS_PRECISION", "float32")
+    engine = base_engine if precision == "float32" else base_engine.quantized(precision)
+    if engine is not model.scoring_engine:
+        model.scoring_engine = engine
+        rec._mips_index = None  # Built on the tables of the engine
+    return previous
+
+def restore_settings(rec, previous):
+    """Undo apply_settings()."""
+    for setting, value in previous.items():
+        setattr(rec, setting, value)
+
+def evaluate_config(rec, model, base_engine, users, name, overrides, sources):
+    """
+    Accuracy, coverage, latency and memory of one configuration.
+    Args:
+        rec: recommendations module.
+        model: Loaded model.
+        base_engine: float32 scoring engine.
+        users: Result of holdout_users().
+        name: Configuration name.
+        overrides: Setting overrides.
+        sources: Recommenders to run ("ncf", "ubcf", "icf").
+    Returns:
+        Result dictionary of the configuration.
+    """
+    previous = apply_settings(rec, model, base_engine, overrides)
+    try:
+        exclude_rows = np.array([user["row"] for user in users], dtype=np.int64)
+        store = rec.get_ratings_store()
+
+        # Untimed first request loads the indexes this configuration needs
+        recommend(rec, model, users[0], sources, exclude_rows)
+
+        metrics = {}
+        recommended = {}
+        durations = {}
+        failures = 0
+        for user in users:
+            try:
+                lists, timings = recommend(rec, model, user, sources, exclude_rows)
+            except Exception as e:
+                failures += 1
+                print(f"Evaluation request failed: {str(e)}", file=sys.stderr)
+                continue
+            for stage_name, seconds in timings.items():
+                durations.setdefault(stage_name, []).append(seconds)
+            for list_name, items in lists.items():
+                metrics.setdefault(list_name, []).append(ranking_metrics(items, user["relevant"]))
+                recommended.setdefault(list_name, set()).update(items)
+
+        lists = {}
+        for list_name in LISTS:
+            if list_name not in metrics:
+                continue
+            precision, recall, ndcg = np.mean(metrics[list_name], axis=0)
+            lists[list_name] = {
+                f"precision@{CUTOFF}": float(precision),
+                f"recall@{CUTOFF}": float(recall),
+                f"ndcg@{CUTOFF}": float(ndcg),
+                "coverage": len(recommended[list_name]) / store.n_items,
+            }
+
+        result = {
+            "name": name,
+            "settings": {setting: getattr(rec, setting) for setting in TUNABLE_SETTINGS},
+            "users": len(users) - failures,
+            "failures": failures,
+            "lists": lists,
+            "latency": {stage_name: summarize(seconds) for stage_name, seconds in durations.items()},
+            "peak_alloc_mb": peak_allocation(lambda: recommend(rec, model, users[0], sources, exclude_rows)),
+            "max_rss_mb": max_rss_mb(),
+        }
+    finally:
+        restore_settings(rec, previous)
+
+    summary = ", ".join(f"{list_name} ndcg {values[f'ndcg@{CUTOFF}']:.4f}" for list_name, values in result["lists"].items())
+    print(f"{name}: {summary}, total p50 {result['latency']['total']['p50_ms']:.1f} ms", file=sys.stderr)
+    return result
+
+def run_evaluation(configs, n_users=DEFAULT_USERS, n_seed=DEFAULT_SEED_RATINGS, sources=None, seed=42):
+    """
+    Evaluate serving configurations on the same held-out users.
+
+    Paths come from config, so point MODEL_PATH/TRAIN_FILE/MOVIES_FILE/
+    RATINGS_STORE_DIR at the dataset before calling this.
+    Args:
+        configs: List of (name, overrides) tuples.
+        n_users: Users to hold out.
+        n_seed: Seed ratings per user.
+        sources: Recommenders to run, RECOMMENDATION_SOURCES by default.
+        seed: Seed of the holdout.
+    Returns:
+        Result dictionary with one entry per configuration.
+    """
+    import recommendations as rec
+
+    # Every configuration derives its precision from the float32 tables
+    rec.NCF_WEIGHTS_PRECISION = "float32"
+    store = rec.get_ratings_store()
+    model = rec.load_model()
+    base_engine = rec.get_scoring_engine(model)
+    sources = list(sources or rec.RECOMMENDATION_SOURCES)
+    if "icf" in sources and rec.get_icf_index() is None:
+        # Without the table ICF returns nothing and would score as an all-zero recommender
+        print("Leaving icf out of the evaluation, its item neighbour table is not built (python icf.py)", file=sys.stderr)
+        sources.remove("icf")
+    if not sources:
+        raise ValueError("No recommender left to evaluate")
+
+    users = holdout_users(store, rec.get_movie_index(), n_users, n_seed, seed)
+    if not users:
+        raise ValueError(f"No user has {MIN_USER_RATINGS} ratings with relevant ones left after {n_seed} seed ratings")
+    print(f"Evaluating {len(configs)} configurations on {len(users)} held-out users", file=sys.stderr)
+
+    return {
+        "created_at": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "dataset": {
+            "train_file": rec.TRAIN_FILE,
+            "users": int(store.n_users),
+            "items": int(store.n_items),
+            "ratings": int(store.nnz),
+        },
+        "settings": {
+            "held_out_users": len(users),
+            "seed_ratings": n_seed,
+            "relevance_threshold": RELEVANCE_THRESHOLD,
+            "cutoff": CUTOFF,
+            "sources": sources,
+            "seed": seed,
+        },
+        "configs": [
+            evaluate_config(rec, model, base_engine, users, name, overrides, sources)
+            for name, overrides in configs
+        ],
+    }
+
+def print_table(result, out=sys.stderr):
+    """Write accuracy and latency of every configuration and list as a table."""
+    print(f"{'config':16} {'list':6} {'P@10':>7} {'R@10':>7} {'NDCG@10':>8} {'cover':>7} {'p50':>9} {'p95':>9} {'peak':>8}", file=out)
+    for config in result["configs"]:
+        total = config["latency"]["total"]
+        for list_name, values in config["lists"].items():
+            print(
+                f"{config['name']:16} {list_name:6} {values['precision@10']:>7.4f} {values['recall@10']:>7.4f} "
+                f"{values['ndcg@10']:>8.4f} {values['coverage']:>7.4f} {total['p50_ms']:>7.1f}ms {total['p95_ms']:>7.1f}ms "
+                f"{config['peak_alloc_mb']:>6.1f}MB",
+                file=out
+            )
+
+###############################################################################
+# MAIN EXEC
+###############################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure accuracy against latency of serving configurations on held-out users')
+    parser.add_argument('--data_dir', type=str, help='Dataset from synthetic_data.py (train.csv, movies.csv, ncf_neuMF/)')
+    parser.add_argument('--config', action='append', help=f'name:SETTING=value,... (repeatable); settings: {", ".join(TUNABLE_SETTINGS)}')
+    parser.add_argument('--users', type=int, default=DEFAULT_USERS, help='Users to hold out')
+    parser.add_argument('--seed_ratings', type=int, default=DEFAULT_SEED_RATINGS, help='Survey ratings kept per held-out user')
+    parser.add_argument('--sources', type=str, help='Recommenders to evaluate, e.g. ncf,ubcf,icf (default: RECOMMENDATION_SOURCES)')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the holdout')
+    parser.add_argument('--output', type=str, help='Write the result here (default: stdout)')
+
+    args = parser.parse_args()
+
+    try:
+        configs = [parse_config(spec) for spec in (args.config or DEFAULT_CONFIGS)]
+    except ValueError as e:
+        print(f"Error: {str(e)}", file=sys.stderr)
+        sys.exit(2)
+
+    if args.data_dir:
+        # config reads these when recommendations is imported
+        os.environ['TRAIN_FILE'] = os.path.join(args.data_dir, 'train.csv')
+        os.environ['MOVIES_FILE'] = os.path.join(args.data_dir, 'movies.csv')
+        os.environ['MODEL_PATH'] = os.path.join(args.data_dir, 'ncf_neuMF/')
+        os.environ['RATINGS_STORE_DIR'] = os.path.join(args.data_dir, 'ratings_store/')
+    # Evaluate the computation itself, without cached results or app user fold-in
+    os.environ['RECOMMENDATION_CACHE_SIZE'] = '0'
+    os.environ['UBCF_DELTA_MERGE_THRESHOLD'] = '0'
+    os.environ.pop('USER_EMBEDDINGS_DB', None)
+
+    # Keep stdout for the result
+    result_out = sys.stdout
+    sys.stdout = sys.stderr
+
+    sources = [source.strip() for source in args.sources.split(',')] if args.sources else None
+    try:
+        result = run_evaluation(configs, args.users, args.seed_ratings, sources, args.seed)
+    except ValueError as e:
+        print(f"Error: {str(e)}", file=sys.stderr)
+        sys.exit(1)
+    print_table(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"Result written to {args.output}", file=sys.stderr)
+    else:
+        result_out.write(json.dumps(result, indent=2) + "\n")
@@ -0,0 +1,222 @@
+import sys
+import os
+import argparse
+import time
+import numpy as np
+from scipy import sparse
+from ratings_store import open_npz
+
+##############################################################################
+# INITIALIZATION
+##############################################################################
+
+# File name of the table inside a ratings store version directory
+ICF_INDEX_FILE = 'icf_neighbours.npz'
+
+# Neighbours kept per item
+DEFAULT_NEIGHBOURS = 50
+
+# Shrinkage of item similarities towards 0 for items with few common raters
+ICF_SHRINKAGE_LAMBDA = 100
+
+# Memory budget of one block of item-item similarities during the build
+BLOCK_BYTES = 256 << 20
+
+# Peak bytes per item pair of a block: the sparse product (values and indices)
+# while it becomes dense, the dense float32 similarities and the float32
+# overlaps or denominators next to them
+BLOCK_PAIR_BYTES = 20
+
+# Rows of a block ranked at once; their int64 partition indices are the only other per-pair cost
+TOP_ROWS = 64
+
+# Ratings centered per step while preparing the build
+DEFAULT_CHUNK_RATINGS = 1 << 22
+
+##############################################################################
+# ITEM NEIGHBOUR TABLE
+##############################################################################
+
+class ItemNeighbourIndex:
+    """
+    Top-N item-item neighbour table for item-based CF.
+
+    Similarities are adjusted cosine (ratings centered by each user's mean)
+    shrunk by the number of common raters, as in UBCF. Row i holds the most
+    similar items of item i (-1 pads rows with fewer positive neighbours), so
+    a request only reads the rows of the items the user rated.
+    """
+
+    def __init__(self, neighbours, similarities, store_version=None):
+        """
+        Args:
+            neighbours: int32 array (n_items x N) of neighbour item codes, -1 for padding.
+            similarities: float32 array (n_items x N) aligned with neighbours.
+            store_version: Version of the ratings store the table belongs to.
+        """
+        self.neighbours = neighbours
+        self.similarities = similarities
+        self.store_version = store_version
+        self.n_items = neighbours.shape[0]
+
+    @classmethod
+    def build(cls, ubcf_index, n_neighbours=DEFAULT_NEIGHBOURS, shrinkage=ICF_SHRINKAGE_LAMBDA,
+              block_bytes=BLOCK_BYTES, chunk_ratings=DEFAULT_CHUNK_RATINGS, store_version=None):
+        """
+        Compute the table from the ratings CSR, one block of items at a time.
+        Args:
+            ubcf_index: UBCFIndex with the ratings matrix and user means.
+            n_neighbours: Neighbours kept per item.
+            shrinkage: Shrinkage constant.
+            block_bytes: Memory budget of one block of similarities.
+            chunk_ratings: Ratings centered at once.
+            store_version: Version of the ratings store the table belongs to.
+        Returns:
+            ItemNeighbourIndex instance.
+        """
+        matrix = ubcf_index.matrix
+        n_items = ubcf_index.n_items
+        shape = (ubcf_index.n_users, n_items)
+
+        # Only the centered ratings, one transposed copy and a shared array of ones are held:
+        # the matrices reuse the memory-mapped indices, and temporaries are built per chunk
+        centered = np.empty(matrix.nnz, dtype=np.float32)
+        squares = np.zeros(n_items)
+        user_chunk = max(1, chunk_ratings // max(int(ubcf_index.counts.max(initial=0)), 1))
+        for lo in range(0, ubcf_index.n_users, user_chunk):
+            hi = min(lo + user_chunk, ubcf_index.n_users)
+            start, end = int(matrix.indptr[lo]), int(matrix.indptr[hi])
+            means = np.repeat(ubcf_index.means[lo:hi], ubcf_index.counts[lo:hi])
+            centered[start:end] = np.asarray(matrix.data[start:end]) - means
+            values = centered[start:end].astype(np.float64)
+            squares += np.bincount(np.asarray(matrix.indices[start:end]), weights=values * values, minlength=n_items)
+            del means, values
+        norms = np.sqrt(squares)
+
+        users_items = sparse.csr_matrix((centered, matrix.indices, matrix.indptr), shape=shape, copy=False)
+        items_users = users_items.T.tocsr()
+        ones = np.ones(matrix.nnz, dtype=np.float32)
+        raters = sparse.csr_matrix((ones, matrix.indices, matrix.indptr), shape=shape, copy=False)
+        items_raters = sparse.csr_matrix((ones, items_users.indices, items_users.indptr), shape=shape[::-1], copy=False)
+
+        n_neighbours = min(n_neighbours, max(n_items - 1, 1))
+        neighbours = np.full((n_items, n_neighbours), -1, dtype=np.int32)
+        similarities = np.zeros((n_items, n_neighbours), dtype=np.float32)
+
+        block = max(1, block_bytes // (BLOCK_PAIR_BYTES * n_items))
+        rows = np.arange(block)
+        norms = norms.astype(np.float32)
+        for lo in range(0, n_items, block):
+            hi = min(lo + block, n_items)
+
+            # Similarities are computed in place in the dense dot products
+            sims = (items_users[lo:hi] @ users_items).toarray()
+            denominators = norms[lo:hi, None] * norms[None, :]
+            denominators[denominators == 0] = 1  # Items without centered ratings have zero dot products
+            sims /= denominators
+            del denominators
+            overlaps = (items_raters[lo:hi] @ raters).toarray()
+            overlaps /= overlaps + np.float32(shrinkage)
+            sims *= overlaps
+            del overlaps
+            sims[rows[:hi - lo], rows[:hi - lo] + lo] = 0
+
+            # Ranked in small row groups, so the partition indices stay small next to the block
+            np.negative(sims, out=sims)
+            for start in range(0, hi - lo, TOP_ROWS):
+                end = min(start + TOP_ROWS, hi - lo)
+                top = np.argpartition(sims[start:end], n_neighbours - 1, axis=1)[:, :n_neighbours]
+                top_sims = -np.take_along_axis(sims[start:end], top, axis=1)
+                order = np.argsort(-top_sims, axis=1, kind='stable')
+                top = np.take_along_axis(top, order, axis=1)
+                top_sims = np.take_along_axis(top_sims, order, axis=1)
+
+                positive = top_sims > 0
+                neighbours[lo + start:lo + end] = np.where(positive, top, -1)
+                similarities[lo + start:lo + end] = np.where(positive, top_sims, 0)
+            del sims
+            print(f"Computed item neighbours for {hi}/{n_items} items", file=sys.stderr)
+
+        return cls(neighbours, similarities, store_version)
+
+    def save(self, path):
+        """
+        Atomically write the table as an uncompressed .npz file.
+        Args:
+            path: Destination file.
+        """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                neighbours=self.neighbours,
+                similarities=self.similarities,
+                store_version=np.array(self.store_version or '')
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Memory-map a table written by save().
+        Args:
+            path: Table file.
+        Returns:
+            ItemNeighbourIndex instance.
+        """
+        f = open_npz(path)
+        return cls(f['neighbours'], f['similarities'], str(f['store_version']) or None)
+
+    def prediction_terms(self, user):
+        """
+        Accumulate the neighbour lists of the user's rated items.
+        Args:
+            user: FoldedUser instance (ratings centered by the user's mean).
+        Returns:
+            Tuple of (numerators, denominators, support) with one entry per item:
+            sum of similarity * centered rating, sum of absolute similarities and
+            the number of rated items that list the item as a neighbour.
+        """
+        neighbours = self.neighbours[user.item_codes]
+        similarities = self.similarities[user.item_codes]
+        valid = neighbours >= 0
+
+        items = neighbours[valid]
+        weights = similarities[valid].astype(np.float64)
+        deviations = np.repeat(user.centered, valid.sum(axis=1))
+
+        numerators = np.bincount(items, weights=weights * deviations, minlength=self.n_items)
+        denominators = np.bincount(items, weights=np.abs(weights), minlength=self.n_items)
+        support = np.bincount(items, minlength=self.n_items)
+        return numerators, denominators, support
+
+def icf_index_path(store):
+    """Location of the item neighbour table of a ratings store version."""
+    return os.path.join(store.path, ICF_INDEX_FILE)
+
+###############################################################################
+# MAIN EXEC
+###############################################################################
+
+if __name__ == "__main__":
+    from config import TRAIN_FILE, RATINGS_STORE_DIR
+    from ratings_store import load_ratings_store
+    from ubcf import UBCFIndex
+
+    parser = argparse.ArgumentParser(description='Build the item-item neighbour table for item-based CF')
+    parser.add_argument('--neighbours', type=int, default=DEFAULT_NEIGHBOURS, help='Neighbours kept per item')
+    parser.add_argument('--shrinkage', type=float, default=ICF_SHRINKAGE_LAMBDA, help='Similarity shrinkage constant')
+    parser.add_argument('--block_mb', type=int, default=BLOCK_BYTES >> 20, help='Memory budget of one similarity block')
+
+    args = parser.parse_args()
+
+    store = load_ratings_store(TRAIN_FILE, RATINGS_STORE_DIR)
+    path = icf_index_path(store)
+
+    start = time.time()
+    index = ItemNeighbourIndex.build(
+        UBCFIndex(store.csr()), n_neighbours=args.neighbours, shrinkage=args.shrinkage,
+        block_bytes=args.block_mb << 20, store_version=store.version
+    )
+    index.save(path)
+    print(f"Built item neighbour table for {index.n_items} items in {time.time() - start:.1f}s: {path}", file=sys.stderr)
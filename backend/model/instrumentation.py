@@ -0,0 +1,346 @@
+import os
+import sys
+import time
+import cProfile
+import pstats
+import contextvars
+import resource
+import tracemalloc
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+##############################################################################
+# INITIALIZATION
+##############################################################################
+
+# Upper bounds (seconds) of the stage latency histograms
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Minimum interval between two writes of the Prometheus text file
+METRICS_WRITE_INTERVAL = 10.0
+
+# Timings of the request handled by the current thread/context, None outside a request
+_current = contextvars.ContextVar('request_timings', default=None)
+
+# Profiles of other threads collected for the slow-request profile of the current context
+_profiles = contextvars.ContextVar('request_profiles', default=None)
+
+##############################################################################
+# MEMORY
+##############################################################################
+
+def current_rss_mb():
+    """
+    Resident set size of this process in MB.
+    Falls back to the peak RSS where /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, IndexError):
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage / 2**20 if sys.platform == 'darwin' else usage / 2**10
+
+def anonymous_rss_mb():
+    """
+    Anonymous resident memory of this process in MB (heap and NumPy arrays),
+    i.e. without the memory-mapped artifacts shared with other workers
+    through the page cache. None where /proc is not available.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('RssAnon:'):
+                    return int(line.split()[1]) / 2**10
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+##############################################################################
+# REQUEST TIMINGS
+##############################################################################
+
+class RequestTimings:
+    """
+    Wall time per stage and counters of a single request.
+
+    Stages entered several times (e.g. once per recommender) are summed.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.stages = {}
+        self.counts = {}
+        # Peak allocation is only known when tracemalloc runs (RECOMMENDATION_TRACE_MEMORY)
+        self.trace_memory = tracemalloc.is_tracing()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        """Add a duration measured elsewhere, e.g. a step shared by a whole batch."""
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name, value):
+        self.counts[name] = value
+
+    @property
+    def total(self):
+        return time.perf_counter() - self.started_at
+
+    def as_dict(self):
+        """
+        Machine-readable summary.
+        Returns:
+            Dictionary with total_ms, stages (ms), counts, rss_mb and, when traced, peak_alloc_mb.
+        """
+        summary = {
+            "total_ms": round(self.total * 1000, 3),
+            "stages": {name: round(seconds * 1000, 3) for name, seconds in self.stages.items()},
+            "counts": dict(self.counts),
+            "rss_mb": round(current_rss_mb(), 1),
+        }
+        if self.trace_memory:
+            summary["peak_alloc_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 3)
+        return summary
+
+@contextmanager
+def request_timings(timings=None):
+    """
+    Collect the stages and counters recorded while the block runs.
+    Args:
+        timings: RequestTimings to record into, e.g. when a request is handled in
+            several steps; a new one is started when omitted.
+    Yields:
+        RequestTimings of the request.
+    """
+    if timings is None:
+        timings = RequestTimings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+@contextmanager
+def stage(name):
+    """
+    Time a stage of the current request; does nothing outside request_timings().
+    Args:
+        name: Stage name, e.g. "retrieval".
+    """
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    with timings.stage(name):
+        yield
+
+def count(name, value):
+    """
+    Record a counter (e.g. the number of candidates) of the current request.
+    Args:
+        name: Counter name.
+        value: Integer value.
+    """
+    timings = _current.get()
+    if timings is not None:
+        timings.count(name, int(value))
+
+##############################################################################
+# PROMETHEUS METRICS
+##############################################################################
+
+class StageHistograms:
+    """
+    Cumulative per-stage latency histograms of a resident worker, rendered in
+    the Prometheus text exposition format.
+    """
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.histograms = {}  # stage -> [bucket counts..., +Inf count, sum]
+        self.requests = 0
+        self._written_at = 0.0
+
+    def _observe(self, name, seconds):
+        histogram = self.histograms.setdefault(name, [0] * (len(self.buckets) + 1) + [0.0])
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                histogram[i] += 1
+        histogram[len(self.buckets)] += 1
+        histogram[-1] += seconds
+
+    def observe(self, timings):
+        """
+        Add a finished request.
+        Args:
+            timings: RequestTimings of the request.
+        """
+        self.requests += 1
+        for name, seconds in timings.stages.items():
+            self._observe(name, seconds)
+        self._observe("total", timings.total)
+
+    def render(self, labels=None, gauges=None):
+        """
+        Args:
+            labels: Extra labels added to every sample, e.g. {"pid": "123"}.
+            gauges: Further (name, type, help, value) samples, e.g. queue depths.
+        Returns:
+            Metrics in the Prometheus text format.
+        """
+        extra = "".join(f',{key}="{value}"' for key, value in (labels or {}).items())
+        plain = "{" + extra[1:] + "}" if extra else ""
+        lines = [
+            "# HELP recommendation_stage_seconds Wall time of recommendation request stages.",
+            "# TYPE recommendation_stage_seconds histogram",
+        ]
+        for name in sorted(self.histograms):
+            histogram = self.histograms[name]
+            for bound, value in zip(self.buckets, histogram):
+                lines.append(f'recommendation_stage_seconds_bucket{{stage="{name}",le="{bound}"{extra}}} {value}')
+            lines.append(f'recommendation_stage_seconds_bucket{{stage="{name}",le="+Inf"{extra}}} {histogram[len(self.buckets)]}')
+            lines.append(f'recommendation_stage_seconds_sum{{stage="{name}"{extra}}} {histogram[-1]:.6f}')
+            lines.append(f'recommendation_stage_seconds_count{{stage="{name}"{extra}}} {histogram[len(self.buckets)]}')
+        lines += [
+            "# HELP recommendation_requests_total Recommendation requests served.",
+            "# TYPE recommendation_requests_total counter",
+            f"recommendation_requests_total{plain} {self.requests}",
+            "# HELP recommendation_resident_memory_bytes Resident set size of the worker.",
+            "# TYPE recommendation_resident_memory_bytes gauge",
+            f"recommendation_resident_memory_bytes{plain} {int(current_rss_mb() * 2**20)}",
+        ]
+        for name, kind, help_text, value in gauges or ():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name}{plain} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def write(self, directory, labels=None, force=False, gauges=None):
+        """
+        Atomically write the metrics to <directory>/recommendations_<pid>.prom,
+        e.g. for the node_exporter textfile collector. Writes are throttled to
+        one per METRICS_WRITE_INTERVAL seconds unless forced.
+        Args:
+            directory: Output directory.
+            labels: Extra labels, see render().
+            force: Write even if the last write was recent.
+            gauges: Further samples, see render().
+        """
+        now = time.time()
+        if not force and now - self._written_at < METRICS_WRITE_INTERVAL:
+            return
+        self._written_at = now
+        try:
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"recommendations_{os.getpid()}.prom")
+            with open(path + ".tmp", 'w') as f:
+                f.write(self.render(labels, gauges))
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"Error writing metrics: {str(e)}", file=sys.stderr)
+
+##############################################################################
+# PROFILING
+##############################################################################
+
+class SlowRequestProfiler:
+    """
+    Profiles requests with cProfile and keeps the profile of those slower
+    than a threshold as <directory>/<time>-<pid>-<label>.prof (readable with
+    pstats or snakeviz). For sampling a live worker instead, py-spy can attach
+    to the pid reported by the health request.
+    """
+
+    def __init__(self, threshold_ms, directory):
+        """
+        Args:
+            threshold_ms: Requests slower than this are dumped, 0 disables profiling.
+            directory: Output directory.
+        """
+        self.threshold = threshold_ms / 1000
+        self.directory = directory
+        self.dumped = 0
+
+    @property
+    def enabled(self):
+        return self.threshold > 0
+
+    @contextmanager
+    def profile(self, label):
+        """
+        Profile the block and dump it when it ran longer than the threshold.
+        Args:
+            label: Request label used in the file name.
+        """
+        if not self.enabled:
+            yield
+            return
+        profiler = cProfile.Profile()
+        profiles = []
+        token = _profiles.set(profiles)
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            _profiles.reset(token)
+            elapsed = time.perf_counter() - start
+            if elapsed > self.threshold:
+                self._dump([profiler] + list(profiles), label, elapsed)
+
+    def _dump(self, profilers, label, elapsed):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{label}.prof")
+            stats = pstats.Stats(profilers[0], stream=sys.stderr)
+            for profiler in profilers[1:]:
+                stats.add(profiler)
+            stats.dump_stats(path)
+            self.dumped += 1
+            print(f"Slow request {label} took {elapsed * 1000:.0f} ms, profile written to {path}", file=sys.stderr)
+        except OSError as e:
+            print(f"Error writing profile: {str(e)}", file=sys.stderr)
+
+def profiled(function, *args, **kwargs):
+    """
+    Call a function, profiling it when the calling context is inside
+    SlowRequestProfiler.profile(). cProfile only sees the thread that enabled
+    it, so work handed to other threads profiles itself and its profile is
+    merged into the request's dump.
+    Args:
+        function: Callable to run.
+        *args, **kwargs: Its arguments.
+    Returns:
+        The function's result.
+    """
+    profiles = _profiles.get()
+    if profiles is None:
+        return function(*args, **kwargs)
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Python 3.12+ allows one active profiler per process, and it already sees every thread
+        return function(*args, **kwargs)
+    try:
+        return function(*args, **kwargs)
+    finally:
+        profiler.disable()
+        profiles.append(profiler)
+
+class ProfiledThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    Thread pool whose tasks run in a copy of the submitting context, so they
+    record into the request's timings and join its slow-request profile.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, profiled, fn, *args, **kwargs)
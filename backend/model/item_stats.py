@@ -0,0 +1,212 @@
+import sys
+import os
+import argparse
+import time
+import zipfile
+import numpy as np
+from ratings_store import IdMap, open_npz, DEFAULT_CHUNKSIZE
+
+##############################################################################
+# INITIALIZATION
+##############################################################################
+
+# Pseudo-ratings at the global mean added to every item's average, so items
+# with a handful of ratings do not outrank well-established ones
+BAYESIAN_PRIOR_RATINGS = 25
+
+# Age after which a rating counts half as much towards popularity
+POPULARITY_HALF_LIFE_DAYS = 365
+
+##############################################################################
+# ITEM STATISTICS
+##############################################################################
+
+class ItemStats:
+    """
+    Per-movie rating statistics aligned with the rows of the movie index.
+    Attributes:
+        movie_ids: movieId of every row (same order as MovieIndex.movie_ids).
+        counts: Number of training ratings.
+        means: Mean rating, 0 for unrated movies.
+        scores: Bayesian average, the mean shrunk towards the global mean.
+        popularity: Ratings weighted by their age relative to the newest rating
+            (the plain count when the ratings have no timestamps).
+        source: Fingerprint of the training file the statistics were computed from.
+    """
+
+    def __init__(self, movie_ids, counts, means, scores, popularity, source=None):
+        self.movie_ids = movie_ids
+        self.counts = counts
+        self.means = means
+        self.scores = scores
+        self.popularity = popularity
+        self.source = source
+        self._movie2row = None
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    @classmethod
+    def compute(cls, store, movie_ids, prior=BAYESIAN_PRIOR_RATINGS,
+                half_life_days=POPULARITY_HALF_LIFE_DAYS, chunksize=DEFAULT_CHUNKSIZE):
+        """
+        Accumulate the statistics over the training ratings of a store in one chunked pass.
+        Args:
+            store: RatingsStore instance.
+            movie_ids: movieId of every movie index row.
+            prior: Number of pseudo-ratings of the Bayesian average.
+            half_life_days: Half-life of a rating's weight in the popularity.
+            chunksize: Ratings processed at once.
+        Returns:
+            ItemStats instance.
+        """
+        n_items = store.n_items
+        counts = np.zeros(n_items, dtype=np.int64)
+        sums = np.zeros(n_items)
+        recency = np.zeros(n_items)
+
+        timestamps = store.timestamps
+        newest = float(timestamps.max()) if timestamps is not None and len(timestamps) else 0.0
+        half_life = half_life_days * 86400.0
+
+        for lo in range(0, len(store.item_codes), chunksize):
+            hi = min(lo + chunksize, len(store.item_codes))
+            codes = np.asarray(store.item_codes[lo:hi])
+            counts += np.bincount(codes, minlength=n_items)
+            sums += np.bincount(codes, weights=np.asarray(store.ratings[lo:hi], dtype=np.float64), minlength=n_items)
+            if timestamps is not None:
+                ages = newest - np.asarray(timestamps[lo:hi], dtype=np.float64)
+                recency += np.bincount(codes, weights=np.exp2(-ages / half_life), minlength=n_items)
+
+        global_mean = sums.sum() / counts.sum() if counts.sum() else 0.0
+        item_means = np.divide(sums, counts, out=np.zeros(n_items), where=counts > 0)
+        item_scores = (prior * global_mean + sums) / (prior + counts) if prior > 0 else item_means
+        item_popularity = recency if timestamps is not None else counts.astype(np.float64)
+
+        # Scatter from item codes to movie index rows; movies nobody rated keep zeros
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        codes = IdMap(store.item_ids).codes(movie_ids)
+        known = codes >= 0
+
+        def per_row(values, dtype, fill=0):
+            out = np.full(len(movie_ids), fill, dtype=dtype)
+            out[known] = values[codes[known]]
+            return out
+
+        return cls(
+            movie_ids,
+            per_row(counts, np.int32),
+            per_row(item_means, np.float32),
+            per_row(item_scores, np.float32, fill=global_mean),
+            per_row(item_popularity, np.float32),
+            store.manifest['source']['fingerprint']
+        )
+
+    def save(self, path):
+        """
+        Atomically write the statistics as an uncompressed .npz file.
+        Args:
+            path: Destination file.
+        """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                movie_ids=self.movie_ids,
+                counts=self.counts,
+                means=self.means,
+                scores=self.scores,
+                popularity=self.popularity,
+                source=np.array(self.source or '')
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Memory-map statistics written by save().
+        Args:
+            path: Statistics file.
+        Returns:
+            ItemStats instance.
+        """
+        f = open_npz(path)
+        return cls(f['movie_ids'], f['counts'], f['means'], f['scores'], f['popularity'], str(f['source']) or None)
+
+    def lookup(self, item_ids, values=None):
+        """
+        Statistic of arbitrary movie IDs.
+        Args:
+            item_ids: Array-like of movieIds.
+            values: Row-aligned statistic to read, popularity by default.
+        Returns:
+            float64 array aligned with item_ids, 0 for movies missing from the index.
+        """
+        if self._movie2row is None:
+            self._movie2row = IdMap(self.movie_ids)
+        values = self.popularity if values is None else values
+        rows = self._movie2row.codes(item_ids)
+        return np.where(rows >= 0, np.asarray(values, dtype=np.float64)[np.maximum(rows, 0)], 0.0)
+
+    def top_rows(self, rows, n):
+        """
+        The n most popular of the given movie index rows.
+        Args:
+            rows: Array of row positions.
+            n: Number of rows to keep.
+        Returns:
+            Row positions, most popular first (ties by Bayesian score, then row order).
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        order = np.lexsort((rows, -self.scores[rows], -self.popularity[rows]))
+        return rows[order[:n]]
+
+def load_item_stats(stats_file, store, movie_index):
+    """
+    Open the precomputed item statistics, recomputing them when the training
+    file or the movie index changed.
+    Args:
+        stats_file: Statistics file next to the movie index.
+        store: RatingsStore the statistics are computed from.
+        movie_index: MovieIndex the statistics are aligned with.
+    Returns:
+        ItemStats instance.
+    """
+    source = store.manifest['source']['fingerprint']
+    try:
+        stats = ItemStats.load(stats_file)
+        if stats.source == source and np.array_equal(stats.movie_ids, movie_index.movie_ids):
+            return stats
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        pass
+
+    stats = ItemStats.compute(store, movie_index.movie_ids)
+    try:
+        stats.save(stats_file)
+    except OSError as e:
+        print(f"Error saving item statistics: {str(e)}", file=sys.stderr)
+    return stats
+
+###############################################################################
+# MAIN EXEC
+###############################################################################
+
+if __name__ == "__main__":
+    from config import TRAIN_FILE, MOVIES_FILE, RATINGS_STORE_DIR, MOVIE_INDEX_FILE, ITEM_STATS_FILE
+    from ratings_store import load_ratings_store
+    from movie_index import load_movie_index
+
+    parser = argparse.ArgumentParser(description='Compute item popularity statistics from the training ratings')
+    parser.add_argument('--prior', type=float, default=BAYESIAN_PRIOR_RATINGS, help='Pseudo-ratings of the Bayesian average')
+    parser.add_argument('--half_life_days', type=float, default=POPULARITY_HALF_LIFE_DAYS, help='Half-life of a rating in the popularity')
+
+    args = parser.parse_args()
+
+    store = load_ratings_store(TRAIN_FILE, RATINGS_STORE_DIR)
+    movie_index = load_movie_index(MOVIES_FILE, MOVIE_INDEX_FILE)
+
+    start = time.time()
+    stats = ItemStats.compute(store, movie_index.movie_ids, prior=args.prior, half_life_days=args.half_life_days)
+    stats.save(ITEM_STATS_FILE)
+    print(f"Computed statistics of {int((stats.counts > 0).sum())}/{len(stats)} movies "
+          f"in {time.time() - start:.1f}s: {ITEM_STATS_FILE}", file=sys.stderr)
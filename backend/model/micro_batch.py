@@ -0,0 +1,154 @@
+import asyncio
+import time
+from collections import deque
+
+##############################################################################
+# INITIALIZATION
+##############################################################################
+
+class QueueFullError(RuntimeError):
+    """Raised when a request arrives while the scheduler queue is full."""
+
+##############################################################################
+# MICRO-BATCHING
+##############################################################################
+
+class MicroBatcher:
+    """
+    Collects requests arriving within a short window into batches processed
+    by a single call, and fans the results back out to the callers.
+
+    One batch runs at a time on an executor thread while the event loop keeps
+    accepting requests, so under load the next batch fills up by itself.
+    Requests are rejected once max_queue of them are waiting (back-pressure),
+    and requests whose deadline passed while queued fail without being processed.
+    """
+
+    def __init__(self, process_batch, window_ms, max_batch, max_queue, executor=None):
+        """
+        Args:
+            process_batch: Function taking a list of items and returning one result,
+                or exception instance, per item. Runs on the executor.
+            window_ms: Time to wait for more requests after the first one arrives.
+            max_batch: Largest number of items processed together.
+            max_queue: Largest number of waiting items.
+            executor: Executor running process_batch (the loop's default when None).
+        """
+        self.process_batch = process_batch
+        self.window = window_ms / 1000
+        self.max_batch = max(1, max_batch)
+        self.max_queue = max_queue
+        self.executor = executor
+
+        self.queue = deque()  # (item, deadline, future, arrival time)
+        self._arrived = asyncio.Event()
+        self._full = asyncio.Event()
+        self._stopping = False
+
+        self.max_queue_depth = 0
+        self.batches = 0
+        self.batched_requests = 0
+        self.rejected = 0
+        self.expired = 0
+
+    def submit(self, item, deadline=None):
+        """
+        Queue an item for the next batch.
+        Args:
+            item: Item passed to process_batch.
+            deadline: time.monotonic() after which the item is no longer processed.
+        Returns:
+            asyncio.Future resolved with the item's result.
+        Raises:
+            QueueFullError: When max_queue items are already waiting.
+        """
+        if self._stopping:
+            raise QueueFullError("Worker is shutting down")
+        if len(self.queue) >= self.max_queue:
+            self.rejected += 1
+            raise QueueFullError(f"Worker queue is full ({self.max_queue} requests waiting)")
+        future = asyncio.get_running_loop().create_future()
+        self.queue.append((item, deadline, future, time.monotonic()))
+        self.max_queue_depth = max(self.max_queue_depth, len(self.queue))
+        self._arrived.set()
+        if len(self.queue) >= self.max_batch:
+            self._full.set()
+        return future
+
+    def _next_batch(self):
+        """Take up to max_batch live items from the queue, failing the expired ones."""
+        batch = []
+        now = time.monotonic()
+        while self.queue and len(batch) < self.max_batch:
+            item, deadline, future, _ = self.queue.popleft()
+            if future.done():
+                continue  # The caller stopped waiting
+            if deadline is not None and now > deadline:
+                self.expired += 1
+                future.set_exception(TimeoutError("Request deadline passed while it was queued"))
+                continue
+            batch.append((item, future))
+        if len(self.queue) < self.max_batch:
+            self._full.clear()
+        return batch
+
+    async def run(self):
+        """Process batches until stop() is called and the queue is drained."""
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self.queue:
+                if self._stopping:
+                    return
+                self._arrived.clear()
+                await self._arrived.wait()
+                continue
+
+            # Give concurrent requests a moment to join, unless the batch is already
+            # full or its oldest request has waited a whole window (e.g. behind a batch)
+            wait = self.queue[0][3] + self.window - time.monotonic()
+            if len(self.queue) < self.max_batch and wait > 0 and not self._stopping:
+                try:
+                    await asyncio.wait_for(self._full.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = self._next_batch()
+            if not batch:
+                continue
+            self.batches += 1
+            self.batched_requests += len(batch)
+
+            try:
+                results = await loop.run_in_executor(self.executor, self.process_batch, [item for item, _ in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def stop(self):
+        """Stop accepting items; run() returns once the queued ones are processed."""
+        self._stopping = True
+        self._arrived.set()
+        self._full.set()
+
+    def stats(self):
+        """
+        Queue and batch counters.
+        Returns:
+            Dictionary with the current and maximum queue depth, batch counts and rejections.
+        """
+        return {
+            "queue_depth": len(self.queue),
+            "max_queue_depth": self.max_queue_depth,
+            "batches": self.batches,
+            "batched_requests": self.batched_requests,
+            "mean_batch_size": self.batched_requests / self.batches if self.batches else 0.0,
+            "rejected": self.rejected,
+            "expired": self.expired,
+        }
@@ -0,0 +1,212 @@
+import sys
+import os
+import argparse
+import hashlib
+import time
+import numpy as np
+from ratings_store import open_npz
+
+##############################################################################
+# INITIALIZATION
+##############################################################################
+
+# Defaults for the clustered maximum-inner-product index
+DEFAULT_CLUSTERS = 256
+KMEANS_ITERATIONS = 10
+DEFAULT_CANDIDATES = 1000  # Items returned per query
+
+##############################################################################
+# MIPS INDEX
+##############################################################################
+
+def weights_fingerprint(item_vectors):
+    """
+    Identify an embedding table so an index built for other weights is not reused.
+    Args:
+        item_vectors: Item embedding table.
+    Returns:
+        Short hex digest.
+    """
+    digest = hashlib.sha1(str(item_vectors.shape).encode('utf-8'))
+    digest.update(np.ascontiguousarray(item_vectors).tobytes())
+    return digest.hexdigest()[:12]
+
+def kmeans(vectors, n_clusters, n_iter=KMEANS_ITERATIONS, seed=42):
+    """
+    Plain Lloyd k-means on dense vectors.
+    Args:
+        vectors: float32 array (n x dims).
+        n_clusters: Number of clusters.
+        n_iter: Number of iterations.
+        seed: Random seed for initialization.
+    Returns:
+        Tuple of (centroids, assignment).
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    squared_norms = np.einsum('ij,ij->i', vectors, vectors)
+    for _ in range(n_iter + 1):
+        # argmin ||x - c||^2 = argmin ||c||^2 - 2 x.c
+        distances = np.einsum('ij,ij->i', centroids, centroids)[None, :] - 2 * (vectors @ centroids.T)
+        assignment = np.argmin(distances, axis=1)
+        counts = np.bincount(assignment, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Restart empty clusters from the points farthest from their centroid
+        if empty.any():
+            error = squared_norms + distances[np.arange(len(vectors)), assignment]
+            centroids[empty] = vectors[np.argsort(-error)[:int(empty.sum())]]
+    return centroids, assignment
+
+class MIPSIndex:
+    """
+    Clustered index for exact or budgeted maximum-inner-product search.
+
+    Items are grouped by k-means and stored contiguously per cluster. Every
+    cluster keeps its centroid and radius, so q.x <= q.c + |q| * r bounds the
+    score of all its items. A query visits clusters by decreasing bound and
+    stops once no remaining cluster can beat the current top-N.
+    """
+
+    def __init__(self, centroids, radii, offsets, item_codes, vectors, fingerprint=None):
+        self.centroids = centroids
+        self.radii = radii
+        self.offsets = offsets
+        self.item_codes = item_codes
+        self.vectors = vectors
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def build(cls, item_vectors, n_clusters=DEFAULT_CLUSTERS, seed=42, fingerprint=None):
+        """
+        Cluster an item embedding table.
+        Args:
+            item_vectors: Item embeddings (n_items x dims), row i belongs to item code i.
+            n_clusters: Number of clusters.
+            seed: Random seed.
+            fingerprint: Identity recorded for load(), weights_fingerprint() of item_vectors by default.
+        Returns:
+            MIPSIndex instance.
+        """
+        item_vectors = np.asarray(item_vectors, dtype=np.float32)
+        n_clusters = min(n_clusters, len(item_vectors))
+        centroids, assignment = kmeans(item_vectors, n_clusters, seed=seed)
+
+        order = np.argsort(assignment, kind='stable')
+        offsets = np.zeros(n_clusters + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=n_clusters), out=offsets[1:])
+
+        vectors = item_vectors[order]
+        distances = np.linalg.norm(vectors - centroids[assignment[order]], axis=1)
+        radii = np.zeros(n_clusters, dtype=np.float32)
+        np.maximum.at(radii, assignment[order], distances)
+
+        return cls(centroids, radii, offsets, order.astype(np.int32), vectors, fingerprint or weights_fingerprint(item_vectors))
+
+    def save(self, path):
+        """
+        Atomically write the index as an uncompressed .npz file. The vectors are
+        stored in cluster order so that workers map them instead of each gathering a copy.
+        Args:
+            path: Destination file.
+        """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                radii=self.radii,
+                offsets=self.offsets,
+                item_codes=self.item_codes,
+                vectors=self.vectors,
+                fingerprint=np.array(self.fingerprint or '')
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, item_vectors, fingerprint=None):
+        """
+        Load an index written by save() for the given embedding table.
+        Args:
+            path: Index file.
+            item_vectors: Item embeddings the index was built from.
+            fingerprint: Known weights_fingerprint() of item_vectors, computed when omitted.
+        Returns:
+            MIPSIndex instance.
+        """
+        f = open_npz(path)
+        fingerprint = fingerprint or weights_fingerprint(np.asarray(item_vectors, dtype=np.float32))
+        if str(f['fingerprint']) != fingerprint:
+            raise ValueError(f"MIPS index {path} was built for different embeddings")
+        item_codes = f['item_codes']
+        # Indexes saved without vectors gather them from the embedding table
+        vectors = f['vectors'] if 'vectors' in f else np.asarray(item_vectors, dtype=np.float32)[item_codes]
+        return cls(f['centroids'], f['radii'], f['offsets'], item_codes, vectors, fingerprint)
+
+    def search(self, query, n=DEFAULT_CANDIDATES, allowed=None, max_clusters=None):
+        """
+        Items with the largest inner product with the query.
+        Args:
+            query: Query vector (dims,).
+            n: Number of items to return.
+            allowed: Optional boolean mask over item codes; other items are skipped.
+            max_clusters: Optional cap on visited clusters (approximate search).
+        Returns:
+            Tuple of (item codes, scores) sorted by decreasing score.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        bounds = self.centroids @ query + np.linalg.norm(query) * self.radii
+        visit = np.argsort(-bounds)
+        if max_clusters is not None:
+            visit = visit[:max_clusters]
+
+        best_codes = np.zeros(0, dtype=np.int64)
+        best_scores = np.zeros(0, dtype=np.float32)
+        threshold = -np.inf
+        for cluster in visit:
+            if bounds[cluster] <= threshold:
+                break
+            lo, hi = self.offsets[cluster], self.offsets[cluster + 1]
+            codes = self.item_codes[lo:hi]
+            scores = self.vectors[lo:hi] @ query
+            if allowed is not None:
+                keep = allowed[codes]
+                codes, scores = codes[keep], scores[keep]
+            keep = scores > threshold
+            if not keep.any():
+                continue
+
+            best_codes = np.concatenate([best_codes, codes[keep]])
+            best_scores = np.concatenate([best_scores, scores[keep]])
+            if len(best_scores) >= n:
+                # Keep only the current top-n, its lowest score is the pruning threshold
+                top = np.argpartition(-best_scores, n - 1)[:n]
+                best_codes, best_scores = best_codes[top], best_scores[top]
+                threshold = best_scores.min()
+
+        order = np.argsort(-best_scores, kind='stable')
+        return best_codes[order], best_scores[order]
+
+###############################################################################
+# MAIN EXEC
+###############################################################################
+
+if __name__ == "__main__":
+    from config import MIPS_INDEX_FILE
+    from recommendations import load_model, get_scoring_engine, mips_index_key
+
+    parser = argparse.ArgumentParser(description='Build the MIPS index over the NeuMF GMF item embeddings')
+    parser.add_argument('--clusters', type=int, default=DEFAULT_CLUSTERS, help='Number of k-means clusters')
+    parser.add_argument('--output', type=str, help='Index file to write (default: the file of the serving precision)')
+
+    args = parser.parse_args()
+
+    start = time.time()
+    engine = get_scoring_engine(load_model())
+    args.output = args.output or MIPS_INDEX_FILE.format(precision=engine.precision)
+    index = MIPSIndex.build(engine.item_gmf, n_clusters=args.clusters, fingerprint=mips_index_key(engine))
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    index.save(args.output)
+    print(f"Built MIPS index with {len(index.centroids)} clusters in {time.time() - start:.1f}s: {args.output}", file=sys.stderr)
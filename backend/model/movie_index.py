@@ -0,0 +1,239 @@
+import sys
+import os
+import zipfile
+import numpy as np
+from ratings_store import open_npz, _source_fingerprint
+
+##############################################################################
+# INITIALIZATION
+##############################################################################
+
+# Seed used by every sampling step, identical to the random_state=42 of the DataFrame version
+SAMPLE_SEED = 42
+
+# Bit counts for every byte value, used to popcount genre masks
+_BYTE_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def _popcount(bits):
+    """
+    Count set bits of an unsigned integer array.
+    Args:
+        bits: uint32 array.
+    Returns:
+        uint8 array of bit counts.
+    """
+    bits = np.asarray(bits, dtype=np.uint32)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(bits)
+    as_bytes = bits.view(np.uint8).reshape(-1, 4)
+    return _BYTE_POPCOUNT[as_bytes].sum(axis=1, dtype=np.uint8)
+
+def sample_rows(rows, n):
+    """
+    Sample n entries without replacement exactly like DataFrame.sample(n, random_state=42).
+    Args:
+        rows: Array of row positions, in frame order.
+        n: Number of entries to keep.
+    Returns:
+        Sampled row positions.
+    """
+    return rows[np.random.RandomState(SAMPLE_SEED).permutation(len(rows))[:n]]
+
+##############################################################################
+# MOVIE INDEX
+##############################################################################
+
+class MovieIndex:
+    """
+    Movie metadata compiled into flat arrays for vectorized filtering.
+    Attributes:
+        movie_ids: movieId of every row (file order).
+        years: Release year per row as int16, 0 when the title has no year.
+        genre_bits: Bitmask of genres per row (bit i set for genre_names[i]).
+        genre_names: Genre vocabulary.
+        genre_rows: Inverted index genre -> row positions.
+    """
+
+    def __init__(self, movie_ids, years, genre_bits, genre_names):
+        self.movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        self.years = np.asarray(years, dtype=np.int16)
+        self.genre_bits = np.asarray(genre_bits, dtype=np.uint32)
+        self.genre_names = list(genre_names)
+        self.genre_to_bit = {genre: i for i, genre in enumerate(self.genre_names)}
+        self.genre_counts = _popcount(self.genre_bits)
+        self.genre_rows = {
+            genre: np.flatnonzero(self.genre_bits & np.uint32(1 << bit))
+            for genre, bit in self.genre_to_bit.items()
+        }
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    @classmethod
+    def from_csv(cls, movies_file):
+        """
+        Parse movies.csv once into an index.
+        Args:
+            movies_file: Path to the MovieLens movies.csv.
+        Returns:
+            MovieIndex instance.
+        """
+        # pandas is only needed for parsing, not for serving
+        import pandas as pd
+
+        movies = pd.read_csv(movies_file)
+        if 'genres' not in movies.columns:
+            raise ValueError("Movies metadata must contain a 'genres' column")
+
+        years = movies['title'].str.extract(r'\((\d{4})\)')[0].fillna(0).astype(np.int16).to_numpy()
+        genre_lists = movies['genres'].fillna('').str.split('|')
+
+        genre_names = sorted({genre for genres in genre_lists for genre in genres if genre})
+        if len(genre_names) > 32:
+            raise ValueError(f"Too many genres for a 32-bit mask: {len(genre_names)}")
+        genre_to_bit = {genre: i for i, genre in enumerate(genre_names)}
+        genre_bits = np.array([
+            sum(1 << genre_to_bit[genre] for genre in set(genres) if genre)
+            for genres in genre_lists
+        ], dtype=np.uint32)
+
+        return cls(movies['movieId'].to_numpy(), years, genre_bits, genre_names)
+
+    def save(self, path, source=None):
+        """
+        Atomically write the compiled index as an uncompressed .npz file.
+        Args:
+            path: Destination file.
+            source: Fingerprint of the movies.csv the index was parsed from.
+        """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                movie_ids=self.movie_ids,
+                years=self.years,
+                genre_bits=self.genre_bits,
+                genre_names=np.array(self.genre_names, dtype=str),
+                source=np.array(source or '')
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Memory-map an index written by save().
+        Args:
+            path: Index file.
+        Returns:
+            Tuple of (MovieIndex instance, source fingerprint).
+        """
+        f = open_npz(path)
+        index = cls(f['movie_ids'], f['years'], f['genre_bits'], f['genre_names'].tolist())
+        return index, str(f['source'])
+
+    def genre_mask(self, genres):
+        """
+        Bitmask of the known genres in a preference list.
+        Args:
+            genres: Iterable of genre names.
+        Returns:
+            Tuple of (uint32 mask, number of distinct genres missing from the vocabulary).
+        """
+        mask, unknown = 0, 0
+        for genre in set(genres):
+            if genre in self.genre_to_bit:
+                mask |= 1 << self.genre_to_bit[genre]
+            else:
+                unknown += 1
+        return np.uint32(mask), unknown
+
+    def decade_rows(self, decade_preferences=None):
+        """
+        Boolean row mask of movies released in one of the preferred years.
+        Args:
+            decade_preferences: List of preferred years, or None for all movies.
+        Returns:
+            Boolean array over all rows.
+        """
+        if not decade_preferences:
+            return np.ones(len(self), dtype=bool)
+        # Lookup table over every int16 year value
+        allowed = np.zeros(1 << 15, dtype=bool)
+        years = np.asarray(decade_preferences, dtype=np.int64)
+        allowed[years[(years > 0) & (years < 1 << 15)]] = True
+        return allowed[self.years]
+
+    def any_genre_rows(self, genre_preferences):
+        """
+        Boolean row mask of movies having at least one of the genres.
+        Args:
+            genre_preferences: List of genre names.
+        Returns:
+            Boolean array over all rows.
+        """
+        mask, _ = self.genre_mask(genre_preferences)
+        return (self.genre_bits & mask) != 0
+
+    def all_genre_rows(self, genre_preferences):
+        """
+        Boolean row mask of movies having every one of the genres.
+        Args:
+            genre_preferences: List of genre names.
+        Returns:
+            Boolean array over all rows.
+        """
+        mask, unknown = self.genre_mask(genre_preferences)
+        if unknown:
+            return np.zeros(len(self), dtype=bool)
+        return (self.genre_bits & mask) == mask
+
+    def jaccard(self, genre_preferences):
+        """
+        Jaccard similarity between each movie's genres and the preferred genres.
+        Args:
+            genre_preferences: List of genre names.
+        Returns:
+            float64 array over all rows.
+        """
+        mask, unknown = self.genre_mask(genre_preferences)
+        intersection = _popcount(self.genre_bits & mask).astype(np.float64)
+        union = self.genre_counts + (float(_popcount(np.full(1, mask))[0]) + unknown) - intersection
+        return np.divide(intersection, union, out=np.zeros(len(self)), where=union > 0)
+
+    def filter_rows(self, genre_preferences=None, decade_preferences=None):
+        """
+        Row mask of movies matching any preferred genre and a preferred year.
+        Args:
+            genre_preferences: List of genre names, or None.
+            decade_preferences: List of preferred years, or None.
+        Returns:
+            Boolean array over all rows.
+        """
+        rows = self.decade_rows(decade_preferences)
+        if genre_preferences:
+            rows &= self.any_genre_rows(genre_preferences)
+        return rows
+
+def load_movie_index(movies_file, index_file):
+    """
+    Open the compiled movie index, re-parsing movies.csv when it is missing or stale.
+    Args:
+        movies_file: Path to the MovieLens movies.csv.
+        index_file: Compiled index written next to it.
+    Returns:
+        MovieIndex instance.
+    """
+    source = _source_fingerprint(movies_file) if os.path.exists(movies_file) else None
+    try:
+        index, index_source = MovieIndex.load(index_file)
+        if source is None or index_source == source:
+            return index
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        pass
+
+    index = MovieIndex.from_csv(movies_file)
+    try:
+        index.save(index_file, source)
+    except OSError as e:
+        print(f"Error saving movie index: {str(e)}", file=sys.stderr)
+    return index
@@ -0,0 +1,593 @@
+import json
+import sys
+import os
+import argparse
+import hashlib
+import time
+import threading
+from contextlib import contextmanager
+import numpy as np
+from ratings_store import write_array, open_array
+from mips_index import weights_fingerprint
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:  # Optional: without it BLAS keeps its default thread count
+    threadpool_limits = None
+
+##############################################################################
+# INITIALIZATION
+##############################################################################
+
+# Number of (user, item) pairs pushed through the MLP tower at once
+DEFAULT_CHUNK_PAIRS = 65536
+
+# Smallest item block scored as a separate shard by top_k()
+MIN_SHARD_ITEMS = 8192
+
+# Shard scorings currently holding the BLAS thread limit, and the limit they share
+_blas_limit_lock = threading.Lock()
+_blas_limit_holders = 0
+_blas_limit = None
+
+# Exported weight bundle: raw arrays memory-mapped at load, described by a manifest
+BUNDLE_FORMAT_VERSION = 1
+BUNDLE_MANIFEST_FILE = 'manifest.json'
+
+# Serving precisions of the item tables; scoring itself always runs in float32
+PRECISIONS = ('float32', 'float16', 'int8')
+QUANTIZED_TABLES = ('item_gmf', 'item_mlp', 'item_hidden')
+
+# Sample used to compare a reduced precision with float32 scoring
+CHECK_USERS = 50
+CHECK_ITEMS = 5000
+
+##############################################################################
+# SCORING ENGINE
+##############################################################################
+
+def checkpoint_fingerprint(model_dir):
+    """
+    Identify the TensorFlow checkpoint in a model directory by its files' sizes and modification times.
+    Args:
+        model_dir: NeuMF model directory.
+    Returns:
+        Short hex digest, or None when the directory holds no checkpoint.
+    """
+    try:
+        names = sorted(
+            name for name in os.listdir(model_dir)
+            if name == 'checkpoint' or name.startswith('model.ckpt')
+        )
+    except OSError:
+        return None
+    if not names:
+        return None
+    digest = hashlib.sha1()
+    for name in names:
+        stat = os.stat(os.path.join(model_dir, name))
+        digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode('utf-8'))
+    return digest.hexdigest()[:12]
+
+def read_bundle_manifest(bundle_dir):
+    """
+    Read and check the manifest of an exported weight bundle.
+    Args:
+        bundle_dir: Bundle directory.
+    Returns:
+        Manifest dictionary.
+    """
+    with open(os.path.join(bundle_dir, BUNDLE_MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    if manifest.get('format_version') != BUNDLE_FORMAT_VERSION:
+        raise ValueError(f"Weight bundle {bundle_dir} has format {manifest.get('format_version')}, expected {BUNDLE_FORMAT_VERSION}")
+    return manifest
+
+class QuantizedTable:
+    """
+    Item table stored as float16, or as int8 with a float32 scale per row.
+
+    Indexing gathers the requested rows and returns them in float32, so the
+    scoring code reads a half or a quarter of the bytes and computes as before.
+    """
+
+    def __init__(self, values, scales=None):
+        """
+        Args:
+            values: float16 or int8 table (n_rows x dim), may be memory-mapped.
+            scales: Per-row float32 scales of an int8 table.
+        """
+        self.values = values
+        self.scales = scales
+        self.shape = values.shape
+        self.precision = 'int8' if scales is not None else np.dtype(values.dtype).name
+
+    @classmethod
+    def quantize(cls, table, precision):
+        """
+        Args:
+            table: float32 table.
+            precision: "float16" or "int8".
+        Returns:
+            QuantizedTable instance.
+        """
+        table = np.asarray(table, dtype=np.float32)
+        if precision == 'float16':
+            return cls(table.astype(np.float16))
+        if precision == 'int8':
+            # Symmetric per-row scale so every row uses the full int8 range
+            scales = np.abs(table).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            values = np.clip(np.rint(table / scales[:, None]), -127, 127).astype(np.int8)
+            return cls(values, scales.astype(np.float32))
+        raise ValueError(f"Unsupported precision: {precision}")
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, rows):
+        values = np.asarray(self.values[rows], dtype=np.float32)
+        if self.scales is not None:
+            values *= np.asarray(self.scales[rows], dtype=np.float32)[..., None]
+        return values
+
+    def __array__(self, dtype=None, copy=None):
+        values = self[:]
+        return values if dtype is None else values.astype(dtype)
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+def _round_weights(weights, precision):
+    """Dense layer weights after a float16 or int8 (per output unit) round trip."""
+    weights = np.asarray(weights, dtype=np.float32)
+    if precision == 'float16':
+        return weights.astype(np.float16).astype(np.float32)
+    scales = np.abs(weights).max(axis=0) / 127.0
+    scales[scales == 0] = 1.0
+    return np.clip(np.rint(weights / scales), -127, 127) * scales
+
+def _relu(x):
+    return np.maximum(x, 0, out=x)
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+def _partial_top_k(codes, scores, k):
+    """Entries with one of the k highest scores (ties with the k-th included), unordered."""
+    if len(scores) <= k:
+        return codes, scores
+    kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+    keep = scores >= kth
+    return codes[keep], scores[keep]
+
+class NCFScoringEngine:
+    """
+    Vectorized NeuMF scorer working on weights extracted from the model once.
+
+    The MLP input is concat(user, item), so its first layer splits into a user
+    half and an item half. The item half is precomputed for the whole catalogue,
+    which turns scoring into a gather, a couple of small matrix products and a
+    sigmoid. Predictions match the item-by-item NumPy path within float tolerance.
+    """
+
+    def __init__(self, item_gmf, item_mlp, mlp_weights, mlp_biases, final_weights, item_hidden=None, fingerprint=None):
+        """
+        Args:
+            item_gmf: GMF item embedding table (n_items x n_factors).
+            item_mlp: MLP item embedding table (n_items x mlp_dim).
+            mlp_weights: List of MLP layer weight matrices, first layer takes concat(user, item).
+            mlp_biases: List of MLP layer bias vectors.
+            final_weights: NeuMF output weights (n_factors + last layer size x 1).
+            item_hidden: Precomputed item half of the first MLP layer (from a bundle).
+            fingerprint: Known weights_fingerprint() of item_gmf (from a bundle).
+        """
+        self.item_gmf = item_gmf if isinstance(item_gmf, QuantizedTable) else np.asarray(item_gmf, dtype=np.float32)
+        self.item_mlp = item_mlp if isinstance(item_mlp, QuantizedTable) else np.asarray(item_mlp, dtype=np.float32)
+        self.n_items, self.n_factors = self.item_gmf.shape
+        mlp_dim = self.item_mlp.shape[1]
+        self.precision = getattr(self.item_gmf, 'precision', 'float32')
+
+        first_weights = np.asarray(mlp_weights[0], dtype=np.float32)
+        self.user_weights = first_weights[:mlp_dim]
+        self.item_weights = first_weights[mlp_dim:]
+        self.first_bias = np.asarray(mlp_biases[0], dtype=np.float32)
+        self.hidden_layers = [
+            (np.asarray(w, dtype=np.float32), np.asarray(b, dtype=np.float32))
+            for w, b in zip(mlp_weights[1:], mlp_biases[1:])
+        ]
+
+        final_weights = np.asarray(final_weights, dtype=np.float32).reshape(-1)
+        self.final_gmf = final_weights[:self.n_factors]
+        self.final_mlp = final_weights[self.n_factors:]
+
+        # Item half of the first MLP layer for every item in the catalogue
+        self.item_hidden = np.asarray(self.item_mlp) @ self.item_weights if item_hidden is None else item_hidden
+        self._fingerprint = fingerprint
+
+    @property
+    def table_bytes(self):
+        """Size of the item tables used while serving."""
+        return sum(getattr(self, name).nbytes for name in QUANTIZED_TABLES)
+
+    def quantized(self, precision, tables=None):
+        """
+        Copy of the engine serving its item tables and MLP weights in a reduced precision.
+        Args:
+            precision: One of PRECISIONS.
+            tables: Already quantized item tables by name (e.g. from a bundle), quantized here otherwise.
+        Returns:
+            NCFScoringEngine instance (self for float32).
+        """
+        if precision == 'float32':
+            return self
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unsupported precision: {precision}")
+        tables = tables or {name: QuantizedTable.quantize(getattr(self, name), precision) for name in QUANTIZED_TABLES}
+
+        first_weights = np.concatenate([self.user_weights, self.item_weights])
+        weights = [first_weights] + [weights for weights, _ in self.hidden_layers]
+        biases = [self.first_bias] + [biases for _, biases in self.hidden_layers]
+        return NCFScoringEngine(
+            tables['item_gmf'],
+            tables['item_mlp'],
+            [_round_weights(w, precision) for w in weights],
+            biases,
+            np.concatenate([self.final_gmf, self.final_mlp]),
+            item_hidden=tables['item_hidden'],
+            # Identifies the trained weights; the data version adds the precision
+            fingerprint=self.fingerprint,
+        )
+
+    @property
+    def fingerprint(self):
+        """Identity of the GMF item table, see mips_index.weights_fingerprint()."""
+        if self._fingerprint is None:
+            self._fingerprint = weights_fingerprint(self.item_gmf)
+        return self._fingerprint
+
+    @classmethod
+    def from_model(cls, model):
+        """
+        Extract embeddings and dense layer weights from a loaded TensorFlow NCF model.
+        Args:
+            model: NCF model with restored NeuMF weights.
+        Returns:
+            NCFScoringEngine instance.
+        """
+        import tensorflow as tf
+
+        variables = {v.name.split(':')[0]: v for v in tf.compat.v1.global_variables()}
+        layer_names = ["mlp/fully_connected"]
+        while f"mlp/fully_connected_{len(layer_names)}/weights" in variables:
+            layer_names.append(f"mlp/fully_connected_{len(layer_names)}")
+
+        fetches = {
+            "item_gmf": model.embedding_gmf_Q,
+            "item_mlp": model.embedding_mlp_Q,
+            "mlp_weights": [variables[f"{name}/weights"] for name in layer_names],
+            "mlp_biases": [variables[f"{name}/biases"] for name in layer_names],
+            "final_weights": variables["ncf/fully_connected/weights"],
+        }
+        return cls(**model.sess.run(fetches))
+
+    def save(self, bundle_dir, source=None, precisions=(), quality=None):
+        """
+        Export the weights as a bundle that load() memory-maps without TensorFlow.
+        Args:
+            bundle_dir: Destination directory.
+            source: Fingerprint of the checkpoint the weights come from.
+            precisions: Reduced precisions whose item tables are stored as well.
+            quality: Optional compare_precision() reports recorded in the manifest.
+        """
+        os.makedirs(bundle_dir, exist_ok=True)
+        manifest = {
+            'format_version': BUNDLE_FORMAT_VERSION,
+            'created_at': time.time(),
+            'source': source,
+            'n_items': int(self.n_items),
+            'n_factors': int(self.n_factors),
+            'n_hidden_layers': len(self.hidden_layers),
+            'fingerprint': self.fingerprint,
+            'precisions': ['float32'] + [p for p in precisions if p != 'float32'],
+            'quality': quality or {},
+            'arrays': {},
+        }
+        first_weights = np.concatenate([self.user_weights, self.item_weights])
+        arrays = {
+            'item_gmf': self.item_gmf,
+            'item_mlp': self.item_mlp,
+            'item_hidden': self.item_hidden,
+            'final_weights': np.concatenate([self.final_gmf, self.final_mlp]),
+            'mlp_weights_0': first_weights,
+            'mlp_biases_0': self.first_bias,
+        }
+        for i, (weights, biases) in enumerate(self.hidden_layers, start=1):
+            arrays[f'mlp_weights_{i}'] = weights
+            arrays[f'mlp_biases_{i}'] = biases
+        for name, array in arrays.items():
+            write_array(bundle_dir, manifest, name, np.asarray(array, dtype=np.float32))
+        for precision in manifest['precisions'][1:]:
+            for name in QUANTIZED_TABLES:
+                table = QuantizedTable.quantize(arrays[name], precision)
+                write_array(bundle_dir, manifest, f"{name}_{precision}", table.values)
+                if table.scales is not None:
+                    write_array(bundle_dir, manifest, f"{name}_{precision}_scales", table.scales)
+
+        # The manifest goes last, a bundle without one is incomplete
+        with open(os.path.join(bundle_dir, BUNDLE_MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+    @classmethod
+    def load(cls, bundle_dir, precision='float32'):
+        """
+        Memory-map an exported bundle.
+        Args:
+            bundle_dir: Directory written by save().
+            precision: Serving precision; tables missing from the bundle are quantized in memory.
+        Returns:
+            NCFScoringEngine instance.
+        """
+        manifest = read_bundle_manifest(bundle_dir)
+        arrays = {name: open_array(bundle_dir, name, spec) for name, spec in manifest['arrays'].items()}
+        layers = range(manifest['n_hidden_layers'] + 1)
+        engine = cls(
+            arrays['item_gmf'],
+            arrays['item_mlp'],
+            [np.array(arrays[f'mlp_weights_{i}']) for i in layers],
+            [np.array(arrays[f'mlp_biases_{i}']) for i in layers],
+            np.array(arrays['final_weights']),
+            item_hidden=arrays['item_hidden'],
+            fingerprint=manifest['fingerprint'],
+        )
+        if precision == 'float32':
+            return engine
+
+        tables = None
+        if precision in manifest.get('precisions', []):
+            tables = {
+                name: QuantizedTable(arrays[f"{name}_{precision}"], arrays.get(f"{name}_{precision}_scales"))
+                for name in QUANTIZED_TABLES
+            }
+        else:
+            print(f"Weight bundle has no {precision} tables, quantizing in memory", file=sys.stderr)
+        return engine.quantized(precision, tables)
+
+    def user_hidden(self, mlp_embed):
+        """
+        User half of the first MLP layer, including the bias.
+        Args:
+            mlp_embed: MLP embedding (mlp_dim,) or stacked embeddings (n_users x mlp_dim).
+        Returns:
+            Array of shape (..., first layer size).
+        """
+        return np.asarray(mlp_embed, dtype=np.float32) @ self.user_weights + self.first_bias
+
+    def _mlp_output(self, hidden):
+        hidden = _relu(hidden)
+        for weights, biases in self.hidden_layers:
+            hidden = _relu(hidden @ weights + biases)
+        return hidden
+
+    def score(self, gmf_embed, mlp_embed, item_codes=None):
+        """
+        Score items for a single user.
+        Args:
+            gmf_embed: GMF embedding of the user.
+            mlp_embed: MLP embedding of the user.
+            item_codes: Internal item codes to score. Scores the whole catalogue when None.
+        Returns:
+            float32 array of predictions aligned with item_codes.
+        """
+        scores = self.score_many(
+            np.asarray(gmf_embed, dtype=np.float32)[None, :],
+            np.asarray(mlp_embed, dtype=np.float32)[None, :],
+            item_codes
+        )
+        return scores[0]
+
+    def score_many(self, gmf_embeds, mlp_embeds, item_codes=None, chunk_pairs=DEFAULT_CHUNK_PAIRS):
+        """
+        Score the same items for several users at once.
+        Args:
+            gmf_embeds: Stacked GMF user embeddings (n_users x n_factors).
+            mlp_embeds: Stacked MLP user embeddings (n_users x mlp_dim).
+            item_codes: Internal item codes to score. Scores the whole catalogue when None.
+            chunk_pairs: Upper bound on user-item pairs materialized at once.
+        Returns:
+            float32 array of predictions (n_users x n_items_scored).
+        """
+        gmf_embeds = np.asarray(gmf_embeds, dtype=np.float32)
+        n_users = gmf_embeds.shape[0]
+        if item_codes is None:
+            item_codes = np.arange(self.n_items)
+        item_codes = np.asarray(item_codes, dtype=np.int64)
+
+        # GMF contribution for all users in one product: items x users
+        gmf_queries = gmf_embeds * self.final_gmf
+        user_hidden = self.user_hidden(mlp_embeds)
+
+        scores = np.empty((n_users, len(item_codes)), dtype=np.float32)
+        chunk = max(1, chunk_pairs // max(n_users, 1))
+        for lo in range(0, len(item_codes), chunk):
+            codes = item_codes[lo:lo + chunk]
+            logits = (self.item_gmf[codes] @ gmf_queries.T).T
+            hidden = self.item_hidden[codes][None, :, :] + user_hidden[:, None, :]
+            logits += self._mlp_output(hidden) @ self.final_mlp
+            scores[:, lo:lo + chunk] = _sigmoid(logits)
+        return scores
+
+    def top_k(self, gmf_embeds, mlp_embeds, k, item_codes=None, executor=None, n_shards=1):
+        """
+        Best scored items of several users without sorting all their scores.
+
+        The items are split into contiguous shards scored on the executor; each
+        shard keeps only its partial top k and the partial results are merged.
+        Items tied with the k-th score are kept, so callers can break ties as
+        they would on the full score array.
+        Args:
+            gmf_embeds: Stacked GMF user embeddings (n_users x n_factors).
+            mlp_embeds: Stacked MLP user embeddings (n_users x mlp_dim).
+            k: Number of items per user.
+            item_codes: Internal item codes to consider. The whole catalogue when None.
+            executor: Executor scoring the shards, the calling thread when None.
+            n_shards: Number of shards, reduced so none is smaller than MIN_SHARD_ITEMS.
+        Returns:
+            List with an (item_codes, scores) tuple per user, best first.
+        """
+        gmf_embeds = np.asarray(gmf_embeds, dtype=np.float32)
+        mlp_embeds = np.asarray(mlp_embeds, dtype=np.float32)
+        if item_codes is None:
+            item_codes = np.arange(self.n_items)
+        item_codes = np.asarray(item_codes, dtype=np.int64)
+
+        n_shards = max(1, min(n_shards, len(item_codes) // MIN_SHARD_ITEMS))
+        bounds = np.linspace(0, len(item_codes), n_shards + 1).astype(np.int64)
+
+        def score_shard(lo, hi):
+            codes = item_codes[lo:hi]
+            scores = self.score_many(gmf_embeds, mlp_embeds, codes)
+            return [_partial_top_k(codes, user_scores, k) for user_scores in scores]
+
+        if executor is None or n_shards == 1:
+            shards = [score_shard(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:])]
+        else:
+            # The shards supply the parallelism, BLAS must not fan out to every core in each of them
+            with limit_blas_threads(1):
+                shards = list(executor.map(score_shard, bounds[:-1], bounds[1:]))
+
+        results = []
+        for user in range(len(gmf_embeds)):
+            codes, scores = _partial_top_k(
+                np.concatenate([shard[user][0] for shard in shards]),
+                np.concatenate([shard[user][1] for shard in shards]),
+                k
+            )
+            order = np.lexsort((codes, -scores))
+            results.append((codes[order], scores[order]))
+        return results
+
+@contextmanager
+def limit_blas_threads(n_threads):
+    """
+    Cap the BLAS thread pools while the block runs, so threads scoring shards
+    in parallel do not each fan out to every core. BLAS libraries only have a
+    process-wide setting, so overlapping blocks share one limit and the
+    original thread counts come back when the last of them ends.
+    Args:
+        n_threads: BLAS threads allowed.
+    Yields:
+        True when the limit is applied (threadpoolctl is installed).
+    """
+    global _blas_limit_holders, _blas_limit
+    if threadpool_limits is None:
+        yield False
+        return
+    with _blas_limit_lock:
+        if _blas_limit_holders == 0:
+            _blas_limit = threadpool_limits(limits=n_threads, user_api='blas')
+        _blas_limit_holders += 1
+    try:
+        yield True
+    finally:
+        with _blas_limit_lock:
+            _blas_limit_holders -= 1
+            if _blas_limit_holders == 0:
+                _blas_limit.restore_original_limits()
+                _blas_limit = None
+
+def compare_precision(reference, candidate, n_users=CHECK_USERS, n_items=CHECK_ITEMS, k=10, seed=42):
+    """
+    Compare scoring with reduced-precision weights against float32.
+
+    Cold-start-like users (averages of random item embeddings) score the same
+    random item sample with both engines.
+    Args:
+        reference: float32 NCFScoringEngine.
+        candidate: Reduced-precision NCFScoringEngine.
+        n_users: Number of simulated users.
+        n_items: Items scored per user.
+        k: Cut-off of the top-k overlap.
+        seed: Random seed.
+    Returns:
+        Dictionary with mean/min Spearman rank correlation, mean/min top-k overlap and table sizes.
+    """
+    rng = np.random.default_rng(seed)
+    item_codes = np.sort(rng.choice(reference.n_items, min(n_items, reference.n_items), replace=False))
+
+    gmf_embeds, mlp_embeds = [], []
+    for _ in range(n_users):
+        rated = rng.choice(reference.n_items, min(20, reference.n_items), replace=False)
+        gmf_embeds.append(reference.item_gmf[rated].mean(axis=0))
+        mlp_embeds.append(reference.item_mlp[rated].mean(axis=0))
+    expected = reference.score_many(np.stack(gmf_embeds), np.stack(mlp_embeds), item_codes)
+    actual = candidate.score_many(np.stack(gmf_embeds), np.stack(mlp_embeds), item_codes)
+
+    correlations, overlaps = [], []
+    for a, b in zip(expected, actual):
+        ranks_a = np.argsort(np.argsort(a)).astype(np.float64)
+        ranks_b = np.argsort(np.argsort(b)).astype(np.float64)
+        correlations.append(np.corrcoef(ranks_a, ranks_b)[0, 1])
+        top_a, top_b = np.argsort(-a)[:k], np.argsort(-b)[:k]
+        overlaps.append(len(np.intersect1d(top_a, top_b)) / k)
+
+    return {
+        "precision": candidate.precision,
+        "users": n_users,
+        "items": len(item_codes),
+        "spearman_mean": float(np.mean(correlations)),
+        "spearman_min": float(np.min(correlations)),
+        f"top{k}_overlap_mean": float(np.mean(overlaps)),
+        f"top{k}_overlap_min": float(np.min(overlaps)),
+        "max_abs_error": float(np.abs(expected - actual).max()),
+        "table_mb": candidate.table_bytes / 2**20,
+        "float32_table_mb": reference.table_bytes / 2**20,
+    }
+
+class ExportedModel:
+    """
+    Serving stand-in for the TensorFlow NCF model, backed by an exported bundle.
+
+    Carries the same attributes the recommenders read from the NCF model
+    (scoring_engine and the id maps attached by load_model).
+    """
+
+    def __init__(self, scoring_engine, n_users):
+        self.scoring_engine = scoring_engine
+        self.n_users = n_users
+        self.n_items = scoring_engine.n_items
+
+###############################################################################
+# MAIN EXEC
+###############################################################################
+
+if __name__ == "__main__":
+    from config import MODEL_PATH, WEIGHTS_BUNDLE_DIR
+
+    parser = argparse.ArgumentParser(description='Export the NeuMF checkpoint into a weight bundle served without TensorFlow')
+    parser.add_argument('--output', type=str, default=WEIGHTS_BUNDLE_DIR, help='Bundle directory to write')
+    parser.add_argument('--precision', nargs='*', choices=PRECISIONS[1:], default=[],
+                        help='Also store float16 and/or int8 item tables (NCF_WEIGHTS_PRECISION)')
+    parser.add_argument('--check', action='store_true',
+                        help='Only compare the given precisions with float32 on the existing bundle')
+
+    args = parser.parse_args()
+
+    start = time.time()
+    if args.check:
+        engine = NCFScoringEngine.load(args.output)
+        for precision in args.precision:
+            print(json.dumps(compare_precision(engine, NCFScoringEngine.load(args.output, precision))))
+        sys.exit(0)
+
+    from recommendations import restore_checkpoint, get_ratings_store
+
+    engine = restore_checkpoint(get_ratings_store()).scoring_engine
+    quality = {}
+    for precision in args.precision:
+        quality[precision] = compare_precision(engine, engine.quantized(precision))
+        print(json.dumps(quality[precision]))
+    engine.save(args.output, source=checkpoint_fingerprint(MODEL_PATH), precisions=args.precision, quality=quality)
+    print(f"Exported {engine.n_items} items and {len(engine.hidden_layers) + 1} MLP layers "
+          f"in {time.time() - start:.1f}s: {args.output}", file=sys.stderr)
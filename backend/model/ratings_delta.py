@@ -0,0 +1,379 @@
+import json
+import sys
+import os
+import argparse
+import shutil
+import tempfile
+import threading
+import time
+import numpy as np
+from scipy import sparse
+from ratings_store import write_array, _write_manifest, _set_current
+from ubcf import UBCFIndex
+
+##############################################################################
+# INITIALIZATION
+##############################################################################
+
+# Files kept in the store root next to the version directories
+DELTA_LOG_FILE = 'delta.log'
+MERGE_LOCK_FILE = 'merge.lock'
+
+# App users collected in the delta before it is merged into a new base version
+DEFAULT_MERGE_THRESHOLD = 1000
+
+# A merge lock older than this is considered abandoned
+MERGE_LOCK_TIMEOUT = 3600
+
+# Arrays that only describe the training ratings and are shared between versions
+TRAINING_ARRAYS = ['user_codes', 'item_codes', 'ratings', 'timestamps', 'item_ids']
+
+##############################################################################
+# DELTA SEGMENT
+##############################################################################
+
+class RatingsDelta:
+    """
+    Ratings of app users kept next to an immutable ratings store version.
+
+    Every change is one JSON line appended to a log shared by all workers:
+    {"user": key, "ratings": {item_id: rating} | null, "time": ...}. A line
+    replaces the user's ratings, null removes the user. The log is replayed
+    from the offset recorded by the base version, so users merged into that
+    version are not applied twice; a later line for a merged user hides
+    (tombstones) its base row.
+
+    The branch threads of a worker share one instance, so every method reads
+    and changes the users under one reentrant lock.
+    """
+
+    def __init__(self, store, store_dir):
+        """
+        Args:
+            store: RatingsStore the delta applies to.
+            store_dir: Store root directory holding the log.
+        """
+        self.store = store
+        self.store_dir = store_dir
+        self.log_path = os.path.join(store_dir, DELTA_LOG_FILE)
+        self.offset = store.manifest.get('delta_offset', 0)
+        self.users = {}  # user key -> (item codes, ratings) or None when removed
+
+        n_trained = store.manifest.get('n_trained_users', store.n_users)
+        self.base_rows = {key: n_trained + i for i, key in enumerate(store.manifest.get('app_users', []))}
+
+        self._index = None
+        self._lock = threading.RLock()
+        self.refresh()
+
+    def __len__(self):
+        with self._lock:
+            return sum(1 for state in self.users.values() if state is not None)
+
+    def _encode(self, ratings):
+        """Known items of a rating dictionary as sorted (item codes, ratings) arrays."""
+        item2id = self.store.item2id
+        pairs = sorted(
+            (item2id[int(item)], float(rating))
+            for item, rating in ratings.items()
+            if int(item) in item2id
+        )
+        codes = np.array([code for code, _ in pairs], dtype=np.int32)
+        values = np.array([rating for _, rating in pairs], dtype=np.float32)
+        return codes, values
+
+    def _apply(self, event):
+        key = str(event['user'])
+        self.users[key] = None if event.get('ratings') is None else self._encode(event['ratings'])
+
+    def refresh(self):
+        """
+        Apply log lines written since the last call, by this or another process.
+        Returns:
+            True when the delta changed.
+        """
+        if not os.path.exists(self.log_path):
+            return False
+        changed = False
+        with self._lock, open(self.log_path, 'rb') as f:
+            f.seek(self.offset)
+            for line in f:
+                # A line without its newline is still being written
+                if not line.endswith(b"\n"):
+                    break
+                self.offset += len(line)
+                try:
+                    self._apply(json.loads(line))
+                    changed = True
+                except (ValueError, KeyError, TypeError) as e:
+                    print(f"Skipping invalid delta entry: {str(e)}", file=sys.stderr)
+            if changed:
+                self._index = None
+        return changed
+
+    def _append(self, event):
+        line = (json.dumps(event) + "\n").encode('utf-8')
+        with self._lock:
+            fd = os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+            self.refresh()
+
+    def upsert(self, user_key, ratings):
+        """
+        Record the current ratings of an app user, in O(number of ratings).
+        Args:
+            user_key: App user ID.
+            ratings: Dictionary of {item_id: rating}.
+        Returns:
+            True when the log was appended to, False when nothing changed.
+        """
+        user_key = str(user_key)
+        event = {"user": user_key, "ratings": {str(int(k)): float(v) for k, v in ratings.items()}, "time": time.time()}
+
+        with self._lock:
+            self.refresh()
+            current = self.users.get(user_key)
+            if current is not None:
+                codes, values = self._encode(event['ratings'])
+                if np.array_equal(current[0], codes) and np.array_equal(current[1], values):
+                    return False
+            self._append(event)
+        return True
+
+    def remove(self, user_key):
+        """
+        Remove an app user from the neighbourhood graph.
+        Args:
+            user_key: App user ID.
+        """
+        self._append({"user": str(user_key), "ratings": None, "time": time.time()})
+
+    def hidden_base_rows(self, exclude_user=None):
+        """
+        Base rows replaced or removed by the delta, plus the row of an excluded user.
+        Args:
+            exclude_user: App user ID whose own row must not be a neighbour.
+        Returns:
+            int64 array of base row codes.
+        """
+        with self._lock:
+            rows = [self.base_rows[key] for key in self.users if key in self.base_rows]
+        if exclude_user is not None and str(exclude_user) in self.base_rows:
+            rows.append(self.base_rows[str(exclude_user)])
+        return np.unique(np.array(rows, dtype=np.int64))
+
+    def segment(self):
+        """
+        Current delta users as a small UBCF index over the store's item codes.
+        Returns:
+            Tuple of (list of user keys, UBCFIndex with one row per key); a
+            snapshot that later changes to the delta do not modify.
+        """
+        with self._lock:
+            if self._index is None:
+                states = [(key, state) for key, state in self.users.items() if state is not None]
+                keys = [key for key, _ in states]
+                indptr = np.zeros(len(keys) + 1, dtype=np.int64)
+                np.cumsum([len(state[0]) for _, state in states], out=indptr[1:])
+                if keys:
+                    indices = np.concatenate([state[0] for _, state in states])
+                    data = np.concatenate([state[1] for _, state in states])
+                else:
+                    indices, data = np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+                matrix = sparse.csr_matrix((data, indices, indptr), shape=(len(keys), self.store.n_items))
+                self._index = (keys, UBCFIndex(matrix))
+            return self._index
+
+##############################################################################
+# MERGE
+##############################################################################
+
+def _copy_prefix(src_path, dst, n_bytes, block=64 << 20):
+    with open(src_path, 'rb') as src:
+        while n_bytes > 0:
+            chunk = src.read(min(block, n_bytes))
+            if not chunk:
+                break
+            dst.write(chunk)
+            n_bytes -= len(chunk)
+
+def merge_delta(delta):
+    """
+    Write a new store version with the delta users appended as regular rows.
+
+    Training rows are copied unchanged, so their codes (and the model and ANN
+    index built on them) stay valid. App rows that were merged before are
+    rebuilt from their latest state. The new version records the log offset
+    it contains and becomes CURRENT. Workers map the files of live versions,
+    so the version is written into a temporary directory and renamed into
+    place; an existing version directory is never written to.
+    Args:
+        delta: RatingsDelta of the current version.
+    Returns:
+        Name of the new version, or of the current one when there is nothing to merge.
+    """
+    start = time.time()
+    store = delta.store
+    n_trained = store.manifest.get('n_trained_users', store.n_users)
+    trained_nnz = int(store.indptr[n_trained])
+
+    # Snapshot of the delta; branch threads keep appending while the version is written
+    with delta._lock:
+        delta.refresh()
+        users = dict(delta.users)
+        offset = delta.offset
+    if offset == store.manifest.get('delta_offset', 0):
+        print(f"Ratings store {store.version} already contains the delta", file=sys.stderr)
+        return store.version
+
+    base_version = store.manifest.get('base_version', store.version)
+    version = f"{base_version}-d{offset}"
+    version_dir = os.path.join(delta.store_dir, version)
+    if os.path.exists(version_dir):
+        # Another worker merged the same log offset first
+        print(f"Ratings store {version} already exists", file=sys.stderr)
+        return version
+
+    # Latest state of every app user: merged rows not touched by the delta, then the delta
+    app_users = []
+    for key, row in delta.base_rows.items():
+        if key not in users:
+            lo, hi = int(store.indptr[row]), int(store.indptr[row + 1])
+            app_users.append((key, np.asarray(store.indices[lo:hi]), np.asarray(store.data[lo:hi])))
+    for key, state in users.items():
+        if state is not None:
+            app_users.append((key, state[0], state[1]))
+
+    tmp_dir = tempfile.mkdtemp(prefix=f".{version}.", dir=delta.store_dir)
+    os.chmod(tmp_dir, 0o755)
+    try:
+        _write_merged_version(store, tmp_dir, version, base_version, n_trained, trained_nnz, app_users, offset)
+        os.rename(tmp_dir, version_dir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if os.path.exists(version_dir):
+            # Lost the race to a concurrent merge of the same offset
+            return version
+        raise
+
+    _set_current(delta.store_dir, version)
+    print(f"Merged {len(app_users)} app users into ratings store {version} in {time.time() - start:.1f}s", file=sys.stderr)
+    return version
+
+def _write_merged_version(store, version_dir, version, base_version, n_trained, trained_nnz, app_users, offset):
+    """
+    Write the arrays and manifest of a merged version into an empty directory.
+    Args:
+        store: RatingsStore the version is derived from.
+        version_dir: Empty directory receiving the files.
+        version: Name of the new version.
+        base_version: Version built from the training file.
+        n_trained: Number of training users.
+        trained_nnz: Number of training ratings.
+        app_users: List of (key, item codes, ratings) of every app user.
+        offset: Delta log offset the version contains.
+    """
+    manifest = {key: value for key, value in store.manifest.items() if key != 'arrays'}
+    manifest.update({
+        'version': version,
+        'base_version': base_version,
+        'n_trained_users': n_trained,
+        'n_users': n_trained + len(app_users),
+        'nnz': trained_nnz + sum(len(codes) for _, codes, _ in app_users),
+        'app_users': [key for key, _, _ in app_users],
+        'delta_offset': offset,
+        'arrays': {},
+    })
+
+    # Training-only arrays are identical, link them instead of copying
+    for name in TRAINING_ARRAYS:
+        if name not in store.manifest['arrays']:
+            continue
+        src = os.path.join(store.path, name + '.bin')
+        dst = os.path.join(version_dir, name + '.bin')
+        if os.path.exists(src) and not os.path.exists(dst):
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copyfile(src, dst)
+        manifest['arrays'][name] = store.manifest['arrays'][name]
+
+    # App users get negative IDs so they never collide with MovieLens users
+    user_ids = np.concatenate([
+        np.asarray(store.user_ids[:n_trained]),
+        -np.arange(1, len(app_users) + 1, dtype=np.int64)
+    ])
+    write_array(version_dir, manifest, 'user_ids', user_ids)
+
+    app_lengths = np.array([len(codes) for _, codes, _ in app_users], dtype=np.int64)
+    indptr = np.concatenate([np.asarray(store.indptr[:n_trained + 1]), trained_nnz + np.cumsum(app_lengths)])
+    write_array(version_dir, manifest, 'indptr', indptr)
+
+    for name, dtype, part in [('indices', np.int32, 1), ('data', np.float32, 2)]:
+        with open(os.path.join(version_dir, name + '.bin'), 'wb') as f:
+            _copy_prefix(os.path.join(store.path, name + '.bin'), f, trained_nnz * np.dtype(dtype).itemsize)
+            for user in app_users:
+                np.asarray(user[part], dtype=dtype).tofile(f)
+        manifest['arrays'][name] = {'dtype': np.dtype(dtype).str, 'shape': [manifest['nnz']]}
+
+    _write_manifest(version_dir, manifest)
+
+def try_merge_delta(delta):
+    """
+    Merge the delta unless another process is already doing it.
+    Args:
+        delta: RatingsDelta of the current version.
+    Returns:
+        Name of the new version, or None when the merge was skipped or failed.
+    """
+    lock_path = os.path.join(delta.store_dir, MERGE_LOCK_FILE)
+    try:
+        if time.time() - os.path.getmtime(lock_path) > MERGE_LOCK_TIMEOUT:
+            os.remove(lock_path)
+    except OSError:
+        pass
+
+    try:
+        fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return None
+    try:
+        os.write(fd, str(os.getpid()).encode('utf-8'))
+        return merge_delta(delta)
+    except Exception as e:
+        print(f"Error merging ratings delta: {str(e)}", file=sys.stderr)
+        return None
+    finally:
+        os.close(fd)
+        os.remove(lock_path)
+
+###############################################################################
+# MAIN EXEC
+###############################################################################
+
+if __name__ == "__main__":
+    from config import TRAIN_FILE, RATINGS_STORE_DIR
+    from ratings_store import load_ratings_store
+
+    parser = argparse.ArgumentParser(description='Inspect or merge the app user ratings delta')
+    parser.add_argument('command', choices=['status', 'merge'], help='Show the delta size or merge it into a new version')
+
+    args = parser.parse_args()
+
+    store = load_ratings_store(TRAIN_FILE, RATINGS_STORE_DIR)
+    delta = RatingsDelta(store, RATINGS_STORE_DIR)
+    if args.command == 'merge':
+        version = try_merge_delta(delta)
+        if version is None:
+            print("Merge skipped: another merge is running or it failed", file=sys.stderr)
+            sys.exit(1)
+    else:
+        print(json.dumps({
+            "version": store.version,
+            "delta_users": len(delta),
+            "merged_app_users": len(delta.base_rows),
+            "log_offset": delta.offset,
+        }))
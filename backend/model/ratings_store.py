@@ -0,0 +1,451 @@
+import json
+import sys
+import os
+import argparse
+import hashlib
+import struct
+import time
+import zipfile
+from collections.abc import Mapping
+import numpy as np
+from scipy import sparse
+from config import TRAIN_FILE, RATINGS_STORE_DIR
+
+##############################################################################
+# INITIALIZATION
+##############################################################################
+
+# Bump when the on-disk layout changes so stale artifacts get rebuilt
+FORMAT_VERSION = 1
+
+# Rows read from the CSV at once while building the store
+DEFAULT_CHUNKSIZE = 2_000_000
+
+# Column names used by the training file (recommenders defaults)
+COL_USER = 'userID'
+COL_ITEM = 'itemID'
+COL_RATING = 'rating'
+COL_TIMESTAMP = 'timestamp'
+
+# Name of the file in the store root pointing at the active version
+CURRENT_FILE = 'CURRENT'
+MANIFEST_FILE = 'manifest.json'
+
+##############################################################################
+# ID MAPS
+##############################################################################
+
+class IdMap(Mapping):
+    """
+    Read-only mapping of original IDs to codes over a (memory-mapped) array of IDs.
+
+    Lookups binary-search a sorted permutation of the IDs, so a worker holds
+    two small arrays instead of a Python dict with an entry per user or item.
+    """
+
+    def __init__(self, ids):
+        """
+        Args:
+            ids: Original ID of every code.
+        """
+        self.ids = ids
+        self.order = np.argsort(ids, kind='stable')
+        self.sorted_ids = np.asarray(ids)[self.order]
+
+    def codes(self, keys):
+        """
+        Vectorized lookup.
+        Args:
+            keys: Array-like of original IDs.
+        Returns:
+            int64 array of codes, -1 for unknown IDs.
+        """
+        keys = np.asarray(keys, dtype=self.sorted_ids.dtype)
+        if not len(self.sorted_ids):
+            return np.full(keys.shape, -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.sorted_ids, keys), len(self.sorted_ids) - 1)
+        found = self.sorted_ids[positions] == keys
+        return np.where(found, self.order[positions], -1).astype(np.int64)
+
+    def __getitem__(self, key):
+        try:
+            code = int(self.codes([key])[0])
+        except (TypeError, ValueError, OverflowError):
+            raise KeyError(key)
+        if code < 0:
+            raise KeyError(key)
+        return code
+
+    def __contains__(self, key):
+        try:
+            return int(self.codes([key])[0]) >= 0
+        except (TypeError, ValueError, OverflowError):
+            return False
+
+    def __iter__(self):
+        return iter(np.asarray(self.ids).tolist())
+
+    def __len__(self):
+        return len(self.ids)
+
+##############################################################################
+# RATINGS STORE
+##############################################################################
+
+class RatingsStore:
+    """
+    Read-only view of a compiled ratings artifact.
+
+    All arrays are memory-mapped, so several processes loading the same
+    version share one copy of the data through the page cache.
+    Arrays:
+        user_codes, item_codes, ratings: COO triplets in training file order.
+        timestamps: Rating timestamps in file order (only if the CSV had them).
+        indptr, indices, data: CSR matrix of users x items sorted by item code.
+        user_ids, item_ids: Original IDs for each user/item code.
+    Rows from n_trained_users on are app users merged from the ratings delta.
+    """
+
+    def __init__(self, path, manifest, arrays):
+        self.path = path
+        self.manifest = manifest
+        self.version = manifest['version']
+        self.n_users = manifest['n_users']
+        self.n_items = manifest['n_items']
+        self.nnz = manifest['nnz']
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        if 'timestamps' not in arrays:
+            self.timestamps = None
+
+        self._user2id = None
+        self._item2id = None
+        self._csr = None
+
+    @property
+    def user2id(self):
+        """Mapping of original user IDs to user codes."""
+        if self._user2id is None:
+            self._user2id = IdMap(self.user_ids)
+        return self._user2id
+
+    @property
+    def item2id(self):
+        """Mapping of original item IDs to item codes."""
+        if self._item2id is None:
+            self._item2id = IdMap(self.item_ids)
+        return self._item2id
+
+    @property
+    def id2user(self):
+        """Original user ID of every user code (indexable by code)."""
+        return self.user_ids
+
+    @property
+    def id2item(self):
+        """Original item ID of every item code (indexable by code)."""
+        return self.item_ids
+
+    @property
+    def n_trained_users(self):
+        """Number of users from the training file; app users merged later follow them."""
+        return self.manifest.get('n_trained_users', self.n_users)
+
+    @property
+    def next_user_id(self):
+        """Original ID that is free for a newly created user."""
+        return int(self.user_ids.max()) + 1 if self.n_users else 1
+
+    def csr(self):
+        """
+        Build a SciPy CSR matrix on top of the mapped arrays without copying them.
+        Returns:
+            scipy.sparse.csr_matrix of shape (n_users, n_items).
+        """
+        if self._csr is None:
+            self._csr = sparse.csr_matrix(
+                (self.data, self.indices, self.indptr),
+                shape=(self.n_users, self.n_items),
+                copy=False
+            )
+        return self._csr
+
+def _source_fingerprint(train_file):
+    """
+    Identify a training file by its size and modification time.
+    Args:
+        train_file: Path to the ratings CSV.
+    Returns:
+        Short hex digest.
+    """
+    stat = os.stat(train_file)
+    key = f"{os.path.abspath(train_file)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+
+def _write_manifest(version_dir, manifest):
+    with open(os.path.join(version_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+def _set_current(store_dir, version):
+    """
+    Atomically point the store root at a version directory.
+    Args:
+        store_dir: Store root directory.
+        version: Name of the version directory.
+    """
+    tmp_path = os.path.join(store_dir, CURRENT_FILE + '.tmp')
+    with open(tmp_path, 'w') as f:
+        f.write(version + '\n')
+    os.replace(tmp_path, os.path.join(store_dir, CURRENT_FILE))
+
+def _array_spec(array):
+    return {'dtype': np.dtype(array.dtype).str, 'shape': list(array.shape)}
+
+def write_array(version_dir, manifest, name, array):
+    """
+    Write an array as a raw binary file and register it in the manifest.
+    Args:
+        version_dir: Version directory of the store.
+        manifest: Manifest dictionary updated in place.
+        name: Array name.
+        array: NumPy array to write.
+    """
+    array = np.ascontiguousarray(array)
+    array.tofile(os.path.join(version_dir, name + '.bin'))
+    manifest['arrays'][name] = _array_spec(array)
+
+def open_array(version_dir, name, spec, mode='r'):
+    """
+    Memory-map an array described by a manifest entry.
+    Args:
+        version_dir: Version directory of the store.
+        name: Array name.
+        spec: Manifest entry with dtype and shape.
+        mode: Memory-map mode.
+    Returns:
+        numpy.memmap (or an empty array for zero-length entries).
+    """
+    shape = tuple(spec['shape'])
+    dtype = np.dtype(spec['dtype'])
+    if int(np.prod(shape)) == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(os.path.join(version_dir, name + '.bin'), dtype=dtype, mode=mode, shape=shape)
+
+def open_npz(path):
+    """
+    Memory-map the arrays of an uncompressed .npz file written by np.savez.
+
+    Each member of such an archive is a stored .npy file, so its data can be
+    mapped in place and processes loading the same file share its pages.
+    Compressed, empty and scalar members are read into memory instead.
+    Args:
+        path: .npz file.
+    Returns:
+        Dictionary mapping member names to arrays.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+            if info.compress_type == zipfile.ZIP_STORED:
+                # Local file header: 30 fixed bytes, then the file name and the extra field
+                f.seek(info.header_offset + 26)
+                name_length, extra_length = struct.unpack('<HH', f.read(4))
+                f.seek(info.header_offset + 30 + name_length + extra_length)
+                version = np.lib.format.read_magic(f)
+                if version in ((1, 0), (2, 0)):
+                    read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+                    shape, fortran_order, dtype = read_header(f)
+                    if shape and int(np.prod(shape)) > 0 and not dtype.hasobject:
+                        arrays[name] = np.memmap(
+                            path, dtype=dtype, mode='r', offset=f.tell(), shape=shape,
+                            order='F' if fortran_order else 'C'
+                        )
+                        continue
+            with archive.open(info) as member:
+                arrays[name] = np.lib.format.read_array(member, allow_pickle=False)
+    return arrays
+
+def _assign_codes(index, values):
+    """
+    Map raw IDs to dense codes, extending the index in first-appearance order.
+    Args:
+        index: pandas Index of already seen IDs.
+        values: Array of raw IDs from the current chunk.
+    Returns:
+        Tuple of (updated index, int32 codes).
+    """
+    import pandas as pd
+
+    uniques = pd.unique(values)
+    unseen = uniques[index.get_indexer(uniques) == -1]
+    if len(unseen):
+        index = index.append(pd.Index(unseen))
+    return index, index.get_indexer(values).astype(np.int32)
+
+def build_ratings_store(train_file, store_dir, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Compile the ratings CSV into a versioned, memory-mappable store.
+
+    The CSV is streamed in chunks. User and item codes are assigned in order
+    of first appearance, which is the same order NCFDataset uses for its
+    user2id/item2id maps, so the codes line up with the NeuMF embeddings.
+    Args:
+        train_file: Path to the ratings CSV.
+        store_dir: Root directory of the store.
+        chunksize: Number of CSV rows processed at once.
+    Returns:
+        Name of the written version.
+    """
+    start = time.time()
+    version = f"v{FORMAT_VERSION}-{_source_fingerprint(train_file)}"
+    version_dir = os.path.join(store_dir, version)
+    os.makedirs(version_dir, exist_ok=True)
+    print(f"Building ratings store {version} from {train_file}", file=sys.stderr)
+
+    # pandas is only needed to compile the store, serving reads the memory-mapped arrays
+    import pandas as pd
+
+    header = pd.read_csv(train_file, nrows=0).columns
+    has_timestamps = COL_TIMESTAMP in header
+    usecols = [COL_USER, COL_ITEM, COL_RATING] + ([COL_TIMESTAMP] if has_timestamps else [])
+
+    # 1. Stream the CSV into COO arrays on disk
+    user_index = pd.Index([], dtype=np.int64)
+    item_index = pd.Index([], dtype=np.int64)
+    coo_names = ['user_codes', 'item_codes', 'ratings'] + (['timestamps'] if has_timestamps else [])
+    coo_files = {name: open(os.path.join(version_dir, name + '.bin'), 'wb') for name in coo_names}
+    nnz = 0
+    try:
+        for chunk in pd.read_csv(train_file, usecols=usecols, chunksize=chunksize):
+            user_index, user_codes = _assign_codes(user_index, chunk[COL_USER].to_numpy(np.int64))
+            item_index, item_codes = _assign_codes(item_index, chunk[COL_ITEM].to_numpy(np.int64))
+            user_codes.tofile(coo_files['user_codes'])
+            item_codes.tofile(coo_files['item_codes'])
+            chunk[COL_RATING].to_numpy(np.float32).tofile(coo_files['ratings'])
+            if has_timestamps:
+                chunk[COL_TIMESTAMP].to_numpy(np.int64).tofile(coo_files['timestamps'])
+            nnz += len(chunk)
+            print(f"Compiled {nnz} ratings", file=sys.stderr)
+    finally:
+        for f in coo_files.values():
+            f.close()
+
+    n_users, n_items = len(user_index), len(item_index)
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'version': version,
+        'source': {'path': os.path.abspath(train_file), 'fingerprint': _source_fingerprint(train_file)},
+        'n_users': n_users,
+        'n_items': n_items,
+        'nnz': nnz,
+        'arrays': {},
+    }
+    coo_dtypes = {'user_codes': np.int32, 'item_codes': np.int32, 'ratings': np.float32, 'timestamps': np.int64}
+    for name in coo_names:
+        manifest['arrays'][name] = {'dtype': np.dtype(coo_dtypes[name]).str, 'shape': [nnz]}
+    write_array(version_dir, manifest, 'user_ids', user_index.to_numpy(np.int64))
+    write_array(version_dir, manifest, 'item_ids', item_index.to_numpy(np.int64))
+
+    # 2. Counting sort of the COO arrays into CSR order, one chunk at a time
+    user_codes = open_array(version_dir, 'user_codes', manifest['arrays']['user_codes'])
+    item_codes = open_array(version_dir, 'item_codes', manifest['arrays']['item_codes'])
+    ratings = open_array(version_dir, 'ratings', manifest['arrays']['ratings'])
+
+    counts = np.zeros(n_users, dtype=np.int64)
+    for lo in range(0, nnz, chunksize):
+        counts += np.bincount(user_codes[lo:lo + chunksize], minlength=n_users)
+    indptr = np.zeros(n_users + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    write_array(version_dir, manifest, 'indptr', indptr)
+
+    manifest['arrays']['indices'] = {'dtype': np.dtype(np.int32).str, 'shape': [nnz]}
+    manifest['arrays']['data'] = {'dtype': np.dtype(np.float32).str, 'shape': [nnz]}
+    indices = open_array(version_dir, 'indices', manifest['arrays']['indices'], mode='w+')
+    data = open_array(version_dir, 'data', manifest['arrays']['data'], mode='w+')
+
+    next_free = indptr[:-1].copy()
+    for lo in range(0, nnz, chunksize):
+        users = np.asarray(user_codes[lo:lo + chunksize])
+        order = np.argsort(users, kind='stable')
+        sorted_users = users[order]
+        # Rank of every entry within its user's run inside this chunk
+        run_starts = np.r_[0, np.flatnonzero(np.diff(sorted_users)) + 1]
+        run_lengths = np.diff(np.r_[run_starts, len(sorted_users)])
+        ranks = np.arange(len(sorted_users)) - np.repeat(run_starts, run_lengths)
+        positions = next_free[sorted_users] + ranks
+        indices[positions] = item_codes[lo:lo + chunksize][order]
+        data[positions] = ratings[lo:lo + chunksize][order]
+        next_free += np.bincount(users, minlength=n_users)
+
+    # 3. Sort item codes inside every row (canonical CSR)
+    matrix = sparse.csr_matrix((data, indices, indptr), shape=(n_users, n_items), copy=False)
+    matrix.sort_indices()
+    if not np.shares_memory(matrix.indices, indices):
+        indices[:] = matrix.indices
+        data[:] = matrix.data
+    indices.flush()
+    data.flush()
+    del matrix, indices, data, user_codes, item_codes, ratings
+
+    _write_manifest(version_dir, manifest)
+    _set_current(store_dir, version)
+    print(f"Built ratings store with {n_users} users, {n_items} items and {nnz} ratings in {time.time() - start:.1f}s", file=sys.stderr)
+    return version
+
+def open_ratings_store(store_dir, version=None):
+    """
+    Memory-map a compiled ratings store.
+    Args:
+        store_dir: Root directory of the store.
+        version: Version to open. Defaults to the one named in CURRENT.
+    Returns:
+        RatingsStore instance.
+    """
+    if version is None:
+        with open(os.path.join(store_dir, CURRENT_FILE)) as f:
+            version = f.read().strip()
+    version_dir = os.path.join(store_dir, version)
+    with open(os.path.join(version_dir, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    if manifest.get('format_version') != FORMAT_VERSION:
+        raise ValueError(f"Ratings store {version} has format {manifest.get('format_version')}, expected {FORMAT_VERSION}")
+
+    arrays = {name: open_array(version_dir, name, spec) for name, spec in manifest['arrays'].items()}
+    return RatingsStore(version_dir, manifest, arrays)
+
+def load_ratings_store(train_file, store_dir, build_if_missing=True):
+    """
+    Open the ratings store for a training file, building it when it is missing or stale.
+    Args:
+        train_file: Path to the ratings CSV the store is compiled from.
+        store_dir: Root directory of the store.
+        build_if_missing: Build the store instead of failing when it is unusable.
+    Returns:
+        RatingsStore instance.
+    """
+    try:
+        store = open_ratings_store(store_dir)
+        if not os.path.exists(train_file) or store.manifest['source']['fingerprint'] == _source_fingerprint(train_file):
+            return store
+        print(f"Ratings store {store.version} is stale", file=sys.stderr)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Ratings store not available: {str(e)}", file=sys.stderr)
+
+    if not build_if_missing:
+        raise FileNotFoundError(f"No usable ratings store in {store_dir}")
+    build_ratings_store(train_file, store_dir)
+    return open_ratings_store(store_dir)
+
+###############################################################################
+# MAIN EXEC
+###############################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compile the ratings CSV into a memory-mappable store')
+    parser.add_argument('--train_file', type=str, default=TRAIN_FILE, help='Ratings CSV to compile')
+    parser.add_argument('--store_dir', type=str, default=RATINGS_STORE_DIR, help='Root directory of the store')
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE, help='CSV rows processed at once')
+
+    args = parser.parse_args()
+    build_ratings_store(args.train_file, args.store_dir, args.chunksize)
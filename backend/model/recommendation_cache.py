@@ -0,0 +1,257 @@
+import json
+import sys
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+##############################################################################
+# INITIALIZATION
+##############################################################################
+
+# Defaults for the result cache
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL_SECONDS = 3600
+
+##############################################################################
+# CACHE KEYS
+##############################################################################
+
+def cache_key(user_id, ratings, genre_preferences, decade_preferences, version):
+    """
+    Canonical hash of everything a recommendation depends on.
+
+    Ratings are sorted by item, decades are a set for the filters and so are
+    sorted too, while the genre order is kept because retrieval samples the
+    genres in the order they are given.
+    Args:
+        user_id: ID of the requesting user, or None.
+        ratings: Dictionary of {item_id: rating}.
+        genre_preferences: List of preferred genres, or None.
+        decade_preferences: List of preferred decades, or None.
+        version: Model and data version string.
+    Returns:
+        Hex digest.
+    """
+    canonical = {
+        "user": None if user_id is None else str(user_id),
+        "ratings": sorted((int(item), float(rating)) for item, rating in (ratings or {}).items()),
+        "genres": list(genre_preferences or []),
+        "decades": sorted(set(int(decade) for decade in (decade_preferences or []))),
+        "version": version,
+    }
+    encoded = json.dumps(canonical, separators=(',', ':'), sort_keys=True)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+##############################################################################
+# RESULT CACHE
+##############################################################################
+
+class RecommendationCache:
+    """
+    Bounded LRU cache of recommendation results with a TTL.
+
+    Entries live in an in-process OrderedDict. An optional SQLite file acts
+    as a second tier that is shared by all workers and survives restarts;
+    memory misses are looked up there and promoted.
+
+    The worker looks results up and stores them on its batch thread while
+    invalidations arrive on the event loop, so every method holds one lock.
+    Invalidating a user also bumps their generation: a result computed from
+    ratings read before the invalidation is not stored afterwards.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS, disk_path=None):
+        """
+        Args:
+            max_entries: Entries kept in memory before the least recently used is evicted.
+            ttl_seconds: Lifetime of an entry in both tiers.
+            disk_path: SQLite file of the disk tier, or None to keep results in memory only.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()  # key -> (stored_at, user_id, result)
+        self.user_keys = {}  # user_id -> set of keys in memory
+        self.counters = {
+            "hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expirations": 0,
+            "invalidations": 0, "stale_puts": 0,
+        }
+        self.user_generations = {}  # user_id -> number of invalidations
+        self.clears = 0
+        self._lock = threading.RLock()
+
+        self.db = None
+        if disk_path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+                self.db = sqlite3.connect(disk_path, timeout=5, isolation_level=None, check_same_thread=False)
+                self.db.execute("PRAGMA journal_mode=WAL")
+                self.db.execute(
+                    "CREATE TABLE IF NOT EXISTS results ("
+                    "key TEXT PRIMARY KEY, user_id TEXT, stored_at REAL NOT NULL, result TEXT NOT NULL)"
+                )
+                self.db.execute("CREATE INDEX IF NOT EXISTS results_user ON results (user_id)")
+            except sqlite3.Error as e:
+                print(f"Disabling disk cache {disk_path}: {str(e)}", file=sys.stderr)
+                self.db = None
+
+    def __len__(self):
+        with self._lock:
+            return len(self.entries)
+
+    def generation(self, user_id=None):
+        """
+        Invalidation state of a user, taken before computing a result for put().
+        Args:
+            user_id: ID of the requesting user, or None.
+        Returns:
+            Opaque value that changes whenever the user's entries are invalidated.
+        """
+        with self._lock:
+            return (self.clears, self.user_generations.get(None if user_id is None else str(user_id), 0))
+
+    def _forget(self, key):
+        _, user_id, _ = self.entries.pop(key)
+        keys = self.user_keys.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.user_keys[user_id]
+
+    def _remember(self, key, user_id, result, stored_at):
+        if key in self.entries:
+            self._forget(key)
+        self.entries[key] = (stored_at, user_id, result)
+        self.user_keys.setdefault(user_id, set()).add(key)
+        while len(self.entries) > self.max_entries:
+            self._forget(next(iter(self.entries)))
+            self.counters["evictions"] += 1
+
+    def get(self, key):
+        """
+        Look up a result.
+        Args:
+            key: Key from cache_key().
+        Returns:
+            Cached result, or None on a miss.
+        """
+        with self._lock:
+            return self._get(key)
+
+    def _get(self, key):
+        now = time.time()
+        entry = self.entries.get(key)
+        if entry is not None:
+            if now - entry[0] <= self.ttl_seconds:
+                self.entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return entry[2]
+            self._forget(key)
+            self.counters["expirations"] += 1
+
+        if self.db is not None:
+            try:
+                row = self.db.execute(
+                    "SELECT user_id, stored_at, result FROM results WHERE key = ? AND stored_at >= ?",
+                    (key, now - self.ttl_seconds)
+                ).fetchone()
+            except sqlite3.Error as e:
+                print(f"Disk cache lookup failed: {str(e)}", file=sys.stderr)
+                row = None
+            if row is not None:
+                user_id, stored_at, result = row
+                result = json.loads(result)
+                self._remember(key, user_id, result, stored_at)
+                self.counters["disk_hits"] += 1
+                return result
+
+        self.counters["misses"] += 1
+        return None
+
+    def put(self, key, result, user_id=None, generation=None):
+        """
+        Store a result in memory and, when enabled, on disk.
+        Args:
+            key: Key from cache_key().
+            result: JSON-serializable result.
+            user_id: Owner of the entry, used for invalidation.
+            generation: generation() taken when the request started; the result
+                is dropped when the user was invalidated since.
+        Returns:
+            True when the result was stored.
+        """
+        with self._lock:
+            if generation is not None and generation != self.generation(user_id):
+                self.counters["stale_puts"] += 1
+                return False
+
+            user_id = None if user_id is None else str(user_id)
+            now = time.time()
+            self._remember(key, user_id, result, now)
+
+            if self.db is not None:
+                try:
+                    self.db.execute(
+                        "INSERT OR REPLACE INTO results (key, user_id, stored_at, result) VALUES (?, ?, ?, ?)",
+                        (key, user_id, now, json.dumps(result))
+                    )
+                    self.db.execute("DELETE FROM results WHERE stored_at < ?", (now - self.ttl_seconds,))
+                except sqlite3.Error as e:
+                    print(f"Disk cache write failed: {str(e)}", file=sys.stderr)
+            return True
+
+    def invalidate_user(self, user_id):
+        """
+        Drop every entry of a user from both tiers.
+        Args:
+            user_id: ID of the user whose ratings or preferences changed.
+        Returns:
+            Number of entries removed from memory.
+        """
+        user_id = str(user_id)
+        with self._lock:
+            self.user_generations[user_id] = self.user_generations.get(user_id, 0) + 1
+            keys = list(self.user_keys.get(user_id, ()))
+            for key in keys:
+                self._forget(key)
+
+            if self.db is not None:
+                try:
+                    self.db.execute("DELETE FROM results WHERE user_id = ?", (user_id,))
+                except sqlite3.Error as e:
+                    print(f"Disk cache invalidation failed: {str(e)}", file=sys.stderr)
+
+            self.counters["invalidations"] += 1
+        return len(keys)
+
+    def clear(self):
+        """Drop every entry from both tiers."""
+        with self._lock:
+            self.clears += 1
+            self.entries.clear()
+            self.user_keys.clear()
+            if self.db is not None:
+                try:
+                    self.db.execute("DELETE FROM results")
+                except sqlite3.Error as e:
+                    print(f"Disk cache clear failed: {str(e)}", file=sys.stderr)
+
+    def stats(self):
+        """
+        Hit/miss counters and sizes.
+        Returns:
+            Dictionary of counters.
+        """
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["disk_hits"] + self.counters["misses"]
+            hits = self.counters["hits"] + self.counters["disk_hits"]
+            return {
+                **self.counters,
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "disk": self.db is not None,
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
@@ -2,16 +2,41 @@ import json
 import sys
 import os
 import argparse
+import time
 import traceback
+import multiprocessing
+import threading
+import faulthandler
+import signal
+import tracemalloc
+import asyncio
+import sqlite3
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import numpy as np
-import pandas as pd
-import tensorflow as tf
-from recommenders.models.ncf.ncf_singlenode import NCF
-from recommenders.models.ncf.dataset import Dataset as NCFDataset
-from scipy import sparse
-from sklearn.metrics.pairwise import cosine_similarity
-
-# Suppress TensorFlow warnings
+from config import SCRIPT_DIR, PROJECT_ROOT, MODEL_PATH, TRAIN_FILE, MOVIES_FILE, RATINGS_STORE_DIR, UBCF_NEIGHBOUR_SEARCH
+from config import MIPS_INDEX_FILE, MOVIE_INDEX_FILE, ITEM_STATS_FILE, NCF_RETRIEVAL, WEIGHTS_BUNDLE_DIR, NCF_WEIGHTS_PRECISION
+from config import RECOMMENDATION_CACHE_SIZE, RECOMMENDATION_CACHE_TTL, RECOMMENDATION_CACHE_DB, USER_EMBEDDINGS_DB
+from config import UBCF_DELTA_MERGE_THRESHOLD, UBCF_SIMILARITY_SHARDS, NCF_SCORING_SHARDS, NCF_BRANCH_TIMEOUT, UBCF_BRANCH_TIMEOUT
+from config import RECOMMENDATION_SOURCES, ICF_BRANCH_TIMEOUT
+from config import RECOMMENDATION_BATCH_WINDOW_MS, RECOMMENDATION_BATCH_SIZE, RECOMMENDATION_QUEUE_LIMIT, RECOMMENDATION_DEADLINE_MS
+from config import RECOMMENDATION_TRACE_MEMORY, RECOMMENDATION_PROFILE_SLOW_MS, RECOMMENDATION_PROFILE_DIR, RECOMMENDATION_METRICS_DIR
+from ratings_store import load_ratings_store, open_ratings_store, CURRENT_FILE
+from ratings_delta import RatingsDelta, try_merge_delta
+from ncf_scoring import NCFScoringEngine, ExportedModel, checkpoint_fingerprint, read_bundle_manifest, threadpool_limits
+from movie_index import load_movie_index, sample_rows
+from item_stats import load_item_stats
+from ubcf import NEIGHBOURS_K, predict_from_terms, open_ubcf_index
+from ubcf_ann import UBCFAnnIndex, ann_index_path, ANN_INDEX_FILE
+from icf import ItemNeighbourIndex, icf_index_path, ICF_INDEX_FILE
+from mips_index import MIPSIndex
+from recommendation_cache import RecommendationCache, cache_key
+from user_embeddings import UserEmbeddingStore
+from instrumentation import request_timings, stage, count, current_rss_mb, anonymous_rss_mb, RequestTimings, StageHistograms, SlowRequestProfiler
+from instrumentation import ProfiledThreadPoolExecutor
+from micro_batch import MicroBatcher, QueueFullError
+
+# Suppress TensorFlow warnings (TensorFlow itself is only imported to restore a checkpoint)
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 
 ##############################################################################
@@ -20,37 +45,127 @@ os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 
 # Constants for recommendation settings
 TOP_K = 10  # Number of top recommendations to return
+CANDIDATE_BUDGET = 5000  # Items in the shared candidate set scored by NCF and UBCF
+MIPS_CANDIDATES = 1000  # Items taken from the MIPS index per request
+HYBRID_HEURISTIC_K = 1000  # Heuristic pool size when merged with MIPS candidates
+SHARDED_SCORING_MIN_ITEMS = 20000  # Candidate lists from this size are scored in shards
+BATCH_CHUNK_SIZE = 64  # Users scored together in batch mode
+BRANCH_WORKERS = 6  # Threads for the NCF/UBCF/ICF branches, leaves room for branches that timed out
+FUSION_RRF_K = 60  # Rank offset of reciprocal rank fusion, damps the weight of the very first ranks
 
-# Paths for project directories and files
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, '../..'))
+# Response key of every recommender in RECOMMENDATION_SOURCES
+SOURCE_KEYS = {"ncf": "ncf_recommendations", "ubcf": "cf_recommendations", "icf": "icf_recommendations"}
+EXPLORATION_POOL_FACTOR = 3  # Exploration items are sampled from this many times as many popular titles
 
 # Debug output for paths
 print(f"SCRIPT_DIR: {SCRIPT_DIR}", file=sys.stderr)
 print(f"PROJECT_ROOT: {PROJECT_ROOT}", file=sys.stderr)
 
-# Paths for model and data files
-MODEL_PATH = os.path.join(PROJECT_ROOT, "model_training/ncf_neuMF/")
-TRAIN_FILE = os.path.join(PROJECT_ROOT, "model_training/ml-32m/train.csv")
-MOVIES_FILE = os.path.join(PROJECT_ROOT, "model_training/ml-32m/movies.csv")
-
 # Debug output for file existence
 print(f"Final MODEL_PATH: {MODEL_PATH}", file=sys.stderr)
 print(f"MODEL_PATH exists: {os.path.exists(MODEL_PATH)}", file=sys.stderr)
 
+# Movie metadata and ratings are loaded once per process and shared by both recommenders
+_movie_index = None
+_item_stats = None
+_ubcf_index = None
+_ubcf_ann_index = None
+_icf_index = None
+_icf_index_missing = False  # No table exists for the loaded store version, checked once
+_ratings_store = None
+_mips_index = None
+_result_cache = None
+_ratings_delta = None
+_user_embeddings = None
+
+# Guards the swap to a new ratings store version done by a background thread
+_store_lock = threading.Lock()
+_store_reload = None
+_delta_merge = None
+
+# Thread pools: NCF/UBCF branches of a request, row blocks of the UBCF similarity scan
+# and item blocks of sharded NCF scoring
+_branch_executor = None
+_shard_executor = None
+_ncf_shard_executor = None
+
+def get_ratings_store():
+    """
+    Memory-map the compiled ratings store, building it from TRAIN_FILE if needed.
+    Returns:
+        RatingsStore instance.
+    """
+    global _ratings_store
+    if _ratings_store is None:
+        _ratings_store = load_ratings_store(TRAIN_FILE, RATINGS_STORE_DIR)
+    return _ratings_store
+
+def get_movie_index():
+    """
+    Open the compiled movie metadata index on first use, parsing MOVIES_FILE when it is stale.
+    Returns:
+        MovieIndex instance.
+    """
+    global _movie_index
+    if _movie_index is None:
+        _movie_index = load_movie_index(MOVIES_FILE, MOVIE_INDEX_FILE)
+    return _movie_index
+
+def get_item_stats():
+    """
+    Open the precomputed item popularity statistics, computing them from the ratings store when stale.
+    Returns:
+        ItemStats instance aligned with the movie index rows, or None when they are not available.
+    """
+    global _item_stats
+    if _item_stats is None:
+        try:
+            _item_stats = load_item_stats(ITEM_STATS_FILE, get_ratings_store(), get_movie_index())
+        except Exception as e:
+            print(f"Item statistics not available: {str(e)}", file=sys.stderr)
+    return _item_stats
+
 ##############################################################################
 # NCF RELATED FUNCTIONS
 ##############################################################################
 
-def create_user_embedding_from_items(model, user_ratings):
+def get_user_embeddings(model):
+    """
+    Open the stored cold-start vectors of app users configured by USER_EMBEDDINGS_DB on first use.
+    Args:
+        model: NCF model whose item tables the vectors are built from.
+    Returns:
+        UserEmbeddingStore instance, or None when disabled.
+    """
+    global _user_embeddings
+    if _user_embeddings is None and USER_EMBEDDINGS_DB:
+        engine = get_scoring_engine(model)
+        try:
+            _user_embeddings = UserEmbeddingStore(
+                USER_EMBEDDINGS_DB, engine.item_gmf, engine.item_mlp, model.item2id,
+                f"{engine.fingerprint}:{engine.precision}"
+            )
+        except sqlite3.Error as e:
+            print(f"Stored user vectors not available: {str(e)}", file=sys.stderr)
+    return _user_embeddings
+
+def create_user_embedding_from_items(model, user_ratings, user_id=None):
     """
     Create user embeddings directly from rated items using the NCF model.
     Args:
         model: NCF model with loaded embeddings.
         user_ratings: Dictionary of {item_id: rating} for the target user.
+        user_id: App user ID; their stored vector is used when USER_EMBEDDINGS_DB is set.
     Returns:
         Tuple of (gmf_embedding, mlp_embedding) for the user.
     """
+    user_embeddings = get_user_embeddings(model) if user_id is not None else None
+    if user_embeddings is not None:
+        try:
+            return user_embeddings.vectors(user_id, user_ratings)
+        except sqlite3.Error as e:
+            print(f"Stored user vector lookup failed: {str(e)}", file=sys.stderr)
+
     print(f"Creating user embedding from {len(user_ratings)} rated items", file=sys.stderr)
 
     # Filter valid items that exist in the model
@@ -74,13 +189,10 @@ def create_user_embedding_from_items(model, user_ratings):
         rating_weights = np.ones_like(rating_weights)
     rating_weights /= rating_weights.sum()
 
-    # Perform batched embedding lookups
-    gmf_item_embeddings = model.sess.run(
-        tf.nn.embedding_lookup(model.embedding_gmf_Q, item_ids)
-    )
-    mlp_item_embeddings = model.sess.run(
-        tf.nn.embedding_lookup(model.embedding_mlp_Q, item_ids)
-    )
+    # Batched lookups in the item tables extracted from the model
+    engine = get_scoring_engine(model)
+    gmf_item_embeddings = engine.item_gmf[item_ids]
+    mlp_item_embeddings = engine.item_mlp[item_ids]
 
     # Compute weighted average of embeddings
     avg_gmf_embedding = np.average(gmf_item_embeddings, axis=0, weights=rating_weights)
@@ -107,74 +219,71 @@ def retrieve_candidates_ncf(genre_preferences=None, decade_preferences=None, k=5
     max_reserved = int(k * 0.3)  # Cap reserved candidates to 30% of k
 
     try:
-        movies_metadata = pd.read_csv(MOVIES_FILE)
-        movies_metadata['release_year'] = movies_metadata['title'].str.extract(r'\((\d{4})\)').astype(float)
-
-        if decade_preferences:
-            year_mask = movies_metadata['release_year'].isin(decade_preferences)
-            movies_metadata = movies_metadata[year_mask]
+        index = get_movie_index()
 
-        if 'genres' not in movies_metadata.columns:
-            raise ValueError("Movies metadata must contain a 'genres' column")
+        # Rows (in movies.csv order) that pass the decade filter
+        rows = np.flatnonzero(index.decade_rows(decade_preferences))
 
         if genre_preferences:
-            genre_set = set(genre_preferences)
+            # Jaccard similarity for genre preferences
+            genre_score = index.jaccard(genre_preferences)[rows]
             
-            # Compute Jaccard similarity for genre preferences
-            def jaccard_score(genres):
-                movie_genres = set(genres.split('|'))
-                intersection = genre_set & movie_genres
-                union = genre_set | movie_genres
-                return len(intersection) / len(union) if union else 0
-
-            movies_metadata['genre_score'] = movies_metadata['genres'].apply(jaccard_score)
-            
-            reserved_candidates = []
+            reserved_rows = []
 
             if len(genre_preferences) > 1:
-                full_matches = movies_metadata[movies_metadata['genres'].apply(
-                    lambda g: genre_set.issubset(set(g.split('|')))
-                )]
-                if not full_matches.empty:
-                    full_match_sample = full_matches.sample(n=min(all_genre_matches_size, len(full_matches)), random_state=42)
-                    reserved_candidates.extend(full_match_sample['movieId'].tolist())
+                full_matches = rows[index.all_genre_rows(genre_preferences)[rows]]
+                if len(full_matches):
+                    reserved_rows.extend(sample_rows(full_matches, min(all_genre_matches_size, len(full_matches))).tolist())
 
+            in_genre = np.zeros(len(index), dtype=bool)
+            reserved_mask = np.zeros(len(index), dtype=bool)
             for genre in genre_preferences:
-                genre_movies = movies_metadata[movies_metadata['genres'].apply(lambda g: genre in g.split('|'))]
-                genre_movies = genre_movies[~genre_movies['movieId'].isin(reserved_candidates)]
-                genre_sample = genre_movies.sample(n=min(genre_sample_size, len(genre_movies)), random_state=42)
-                reserved_candidates.extend(genre_sample['movieId'].tolist())
+                reserved_mask[reserved_rows] = True
+                in_genre[:] = False
+                in_genre[index.genre_rows.get(genre, [])] = True
+                genre_movies = rows[in_genre[rows] & ~reserved_mask[rows]]
+                reserved_rows.extend(sample_rows(genre_movies, min(genre_sample_size, len(genre_movies))).tolist())
 
-            reserved_candidates = reserved_candidates[:max_reserved]
+            reserved_rows = reserved_rows[:max_reserved]
+            reserved_mask[:] = False
+            reserved_mask[reserved_rows] = True
 
-            matching_movies = movies_metadata[movies_metadata['genre_score'] > 0]
-            matching_movies = matching_movies[~matching_movies['movieId'].isin(reserved_candidates)]
-            non_matching_movies = movies_metadata[movies_metadata['genre_score'] == 0]
+            matching = (genre_score > 0) & ~reserved_mask[rows]
+            matching_rows, matching_scores = rows[matching], genre_score[matching]
+            non_matching_rows = rows[genre_score == 0]
         else:
-            movies_metadata['genre_score'] = 1
-            matching_movies = movies_metadata
-            non_matching_movies = pd.DataFrame()
-            reserved_candidates = []
+            reserved_rows = []
+            matching_rows, matching_scores = rows, np.ones(len(rows))
+            non_matching_rows = rows[:0]
 
         exploration_count = int(k * exploration_ratio)
-        reserved_count = len(reserved_candidates)
+        reserved_count = len(reserved_rows)
         main_count = k - exploration_count - reserved_count
 
-        main_candidates = []
-        if not matching_movies.empty and main_count > 0:
-            matching_movies = matching_movies.sort_values('genre_score', ascending=False)
-            for _, group in matching_movies.groupby('genre_score'):
-                shuffled = group.sample(frac=1, random_state=42)
-                main_candidates.append(shuffled)
-            main_candidates = pd.concat(main_candidates)['movieId'].tolist()[:main_count]
-
-        exploration_candidates = []
-        if not non_matching_movies.empty and exploration_count > 0:
-            # Prefer popular ones in exploration
-            if 'popularity' in non_matching_movies.columns:
-                non_matching_movies = non_matching_movies.sort_values('popularity', ascending=False)
-            exploration_candidates = non_matching_movies.sample(n=min(exploration_count, len(non_matching_movies)), random_state=42)['movieId'].tolist()
+        main_rows = []
+        if len(matching_rows) and main_count > 0:
+            # Same ordering as a descending DataFrame.sort_values
+            positions = np.arange(len(matching_scores))[::-1]
+            order = positions[matching_scores[::-1].argsort(kind='quicksort')][::-1]
+            sorted_rows, sorted_scores = matching_rows[order], matching_scores[order]
+            # Groups are visited in ascending score order (groupby sorts its keys),
+            # each one shuffled with the fixed seed
+            for score in np.unique(sorted_scores):
+                main_rows.extend(sample_rows(sorted_rows[sorted_scores == score], None).tolist())
+            main_rows = main_rows[:main_count]
+
+        exploration_rows = []
+        if len(non_matching_rows) and exploration_count > 0:
+            # Prefer popular ones in exploration: a seeded sample of the most popular titles
+            stats = get_item_stats()
+            if stats is not None:
+                non_matching_rows = stats.top_rows(non_matching_rows, EXPLORATION_POOL_FACTOR * exploration_count)
+            exploration_rows = sample_rows(non_matching_rows, min(exploration_count, len(non_matching_rows))).tolist()
 
+        movie_ids = index.movie_ids
+        reserved_candidates = movie_ids[reserved_rows].tolist()
+        main_candidates = movie_ids[main_rows].tolist()
+        exploration_candidates = movie_ids[exploration_rows].tolist()
         candidate_items = reserved_candidates + main_candidates + exploration_candidates
 
         print(f"Retrieved {len(reserved_candidates)} reserved, {len(main_candidates)} preference-based, and {len(exploration_candidates)} exploration items", file=sys.stderr)
@@ -185,84 +294,438 @@ def retrieve_candidates_ncf(genre_preferences=None, decade_preferences=None, k=5
         print(f"Error retrieving candidates: {str(e)}", file=sys.stderr)
         return []
 
+def mips_index_key(engine):
+    """
+    Identity of the MIPS index built from an engine's GMF table.
+
+    Reduced-precision engines keep the fingerprint of the float32 weights, so
+    the precision is added to it, as it is to the index file name.
+    Args:
+        engine: NCFScoringEngine instance.
+    Returns:
+        Key string stored in and checked against the index file.
+    """
+    if engine.precision == 'float32':
+        return engine.fingerprint
+    return f"{engine.fingerprint}:{engine.precision}"
+
+def get_mips_index(model):
+    """
+    Load the MIPS index over the GMF item embeddings, building it in memory when the file is missing or stale.
+    Args:
+        model: NCF model.
+    Returns:
+        MIPSIndex instance.
+    """
+    global _mips_index
+    if _mips_index is None:
+        engine = get_scoring_engine(model)
+        key = mips_index_key(engine)
+        try:
+            _mips_index = MIPSIndex.load(MIPS_INDEX_FILE.format(precision=engine.precision), engine.item_gmf, key)
+        except Exception as e:
+            print(f"MIPS index not usable ({str(e)}), building it in memory", file=sys.stderr)
+            _mips_index = MIPSIndex.build(engine.item_gmf, fingerprint=key)
+    return _mips_index
+
+def preference_item_mask(genre_preferences=None, decade_preferences=None):
+    """
+    Items of the ratings store matching any preferred genre and a preferred year.
+    Args:
+        genre_preferences: List of preferred genres.
+        decade_preferences: List of preferred decades.
+    Returns:
+        Boolean array over item codes, or None when there are no preferences.
+    """
+    if not (genre_preferences or decade_preferences):
+        return None
+    index = get_movie_index()
+    filtered_items = index.movie_ids[index.filter_rows(genre_preferences, decade_preferences)]
+    return np.isin(get_ratings_store().item_ids, filtered_items)
+
+def retrieve_candidates_mips(model, gmf_embed, genre_preferences=None, decade_preferences=None, n=MIPS_CANDIDATES):
+    """
+    Retrieve the items with the largest GMF contribution to the NeuMF score.
+    Args:
+        model: NCF model.
+        gmf_embed: GMF embedding of the cold-start user.
+        genre_preferences: List of preferred genres, applied as a post-filter.
+        decade_preferences: List of preferred decades, applied as a post-filter.
+        n: Number of candidates to retrieve.
+    Returns:
+        List of candidate item IDs, best first.
+    """
+    try:
+        engine = get_scoring_engine(model)
+        store = get_ratings_store()
+        allowed = preference_item_mask(genre_preferences, decade_preferences)
+
+        # The GMF part of the output logit is (user * item) . h, so the query is user * h
+        query = np.asarray(gmf_embed, dtype=np.float32) * engine.final_gmf
+        item_codes, _ = get_mips_index(model).search(query, n=n, allowed=allowed)
+
+        print(f"Retrieved {len(item_codes)} MIPS candidates", file=sys.stderr)
+        return store.item_ids[item_codes].tolist()
+
+    except Exception as e:
+        print(f"Error retrieving MIPS candidates: {str(e)}", file=sys.stderr)
+        return []
+
+def retrieve_request_candidates(genre_preferences=None, decade_preferences=None, k=None):
+    """
+    Shared retrieval stage: the one candidate set of a request that both NCF
+    and UBCF score, so UBCF costs O(k) predictions instead of O(catalogue).
+    Args:
+        genre_preferences: List of preferred genres.
+        decade_preferences: List of preferred decades.
+        k: Candidate budget, CANDIDATE_BUDGET when None.
+    Returns:
+        List of reserved, preference-matched and exploration item IDs.
+    """
+    with stage("retrieval"):
+        candidates = retrieve_candidates_ncf(
+            genre_preferences=genre_preferences,
+            decade_preferences=decade_preferences,
+            exploration_ratio=0.1,
+            k=k or CANDIDATE_BUDGET
+        )
+    count("candidates", len(candidates))
+    return candidates
+
+def retrieve_batch_candidates(preferences):
+    """
+    Shared candidate sets of several requests, retrieved once per distinct preferences.
+    Args:
+        preferences: List of (genre_preferences, decade_preferences) tuples.
+    Returns:
+        List with the candidate set of each entry.
+    """
+    by_key = {}
+    candidates = []
+    for genre_preferences, decade_preferences in preferences:
+        key = (tuple(genre_preferences or ()), tuple(decade_preferences or ()))
+        if key not in by_key:
+            by_key[key] = retrieve_request_candidates(genre_preferences, decade_preferences)
+        candidates.append(by_key[key])
+    return candidates
+
+def retrieve_candidates(model, gmf_embed, genre_preferences=None, decade_preferences=None, candidates=None):
+    """
+    Retrieve NCF candidates with the strategy selected by NCF_RETRIEVAL.
+    Args:
+        model: NCF model.
+        gmf_embed: GMF embedding of the cold-start user.
+        genre_preferences: List of preferred genres.
+        decade_preferences: List of preferred decades.
+        candidates: Shared candidate set of the request, retrieved here when None.
+    Returns:
+        List of candidate item IDs.
+    """
+    print(f"Starting {NCF_RETRIEVAL} retrieval phase...", file=sys.stderr)
+    if NCF_RETRIEVAL == 'mips':
+        return retrieve_candidates_mips(model, gmf_embed, genre_preferences, decade_preferences)
+
+    if NCF_RETRIEVAL == 'hybrid':
+        if candidates is None:
+            candidates = retrieve_candidates_ncf(
+                genre_preferences=genre_preferences,
+                decade_preferences=decade_preferences,
+                exploration_ratio=0.1,
+                k=HYBRID_HEURISTIC_K
+            )
+        mips_candidates = retrieve_candidates_mips(model, gmf_embed, genre_preferences, decade_preferences)
+        return list(dict.fromkeys(list(candidates) + mips_candidates))
+
+    if candidates is not None:
+        return list(candidates)
+    return retrieve_candidates_ncf(
+        genre_preferences=genre_preferences,
+        decade_preferences=decade_preferences, 
+        exploration_ratio=0.1,
+        k=CANDIDATE_BUDGET
+    )
+
+def item_popularity(item_ids):
+    """
+    Recency-weighted popularity of items, used to break ties between equal predictions.
+    Args:
+        item_ids: Array-like of movieIds.
+    Returns:
+        float64 array aligned with item_ids, zeros when no statistics are available.
+    """
+    stats = get_item_stats()
+    if stats is None:
+        return np.zeros(len(item_ids))
+    return stats.lookup(item_ids)
+
+def top_k_recommendations(items_to_score, predictions, user_for_prediction=0):
+    """
+    Keep the TOP_K best scored items.
+    Args:
+        items_to_score: List of item IDs.
+        predictions: Predictions aligned with items_to_score.
+        user_for_prediction: User ID written into every record.
+    Returns:
+        List of {userID, itemID, prediction} records, best first (ties go to the more popular item).
+    """
+    items = np.asarray(items_to_score, dtype=np.int64)
+    predictions = np.asarray(predictions, dtype=np.float64)
+    top = np.lexsort((-item_popularity(items), -predictions))[:TOP_K]
+    return [
+        {"userID": user_for_prediction, "itemID": int(items[i]), "prediction": float(predictions[i])}
+        for i in top
+    ]
+
+def get_popular_recommendations(new_user_ratings, genre_preferences=None, decade_preferences=None, user_for_prediction=0):
+    """
+    Best rated movies matching the preferences, for users the model knows nothing about.
+
+    Movies are ranked by their precomputed Bayesian average, so the fallback
+    costs a mask over the movie index instead of a scan of the ratings.
+    Args:
+        new_user_ratings: Dictionary of {item_id: rating}; rated movies are skipped.
+        genre_preferences: List of preferred genres.
+        decade_preferences: List of preferred decades.
+        user_for_prediction: User ID written into every record.
+    Returns:
+        List of {userID, itemID, prediction} records with the Bayesian average
+        mapped to [0, 1] like NCF scores, best first.
+    """
+    stats = get_item_stats()
+    if stats is None:
+        return []
+    index = get_movie_index()
+    rows = index.filter_rows(genre_preferences, decade_preferences) & (stats.counts > 0)
+    rows[np.isin(index.movie_ids, list(new_user_ratings))] = False
+    rows = np.flatnonzero(rows)
+
+    top = rows[np.lexsort((-stats.popularity[rows], -stats.scores[rows]))[:TOP_K]]
+    return [
+        {
+            "userID": user_for_prediction,
+            "itemID": int(index.movie_ids[row]),
+            "prediction": float((stats.scores[row] - 1) / 4.0)  # Same normalization as the rating weights
+        }
+        for row in top
+    ]
+
+def fuse_recommendations(ranked_lists):
+    """
+    Merge the rankings of the recommenders into the final list by reciprocal rank fusion.
+
+    NCF scores and CF rating predictions are on different scales, so only the
+    ranks count: every list adds 1 / (FUSION_RRF_K + rank) to the items it holds.
+    Args:
+        ranked_lists: Dictionary mapping source names ("ncf", "ubcf", "icf") to
+            recommendation lists, best first.
+    Returns:
+        List of the TOP_K {userID, itemID, prediction, sources} records, best first
+        (ties go to the more popular item).
+    """
+    scores, sources = {}, {}
+    for source, recommendations in ranked_lists.items():
+        for rank, rec in enumerate(recommendations, start=1):
+            item = int(rec["itemID"])
+            scores[item] = scores.get(item, 0.0) + 1.0 / (FUSION_RRF_K + rank)
+            sources.setdefault(item, []).append(source)
+    if not scores:
+        return []
+
+    user_id = next(rec["userID"] for recommendations in ranked_lists.values() for rec in recommendations)
+    items = np.fromiter(scores.keys(), dtype=np.int64, count=len(scores))
+    fused = np.fromiter(scores.values(), dtype=np.float64, count=len(scores))
+    top = np.lexsort((-item_popularity(items), -fused))[:TOP_K]
+    return [
+        {"userID": user_id, "itemID": int(items[i]), "prediction": float(fused[i]), "sources": sources[int(items[i])]}
+        for i in top
+    ]
+
+def get_scoring_engine(model):
+    """
+    Return the vectorized scoring engine for the model, extracting its weights on first use.
+    Args:
+        model: NCF model.
+    Returns:
+        NCFScoringEngine instance.
+    """
+    if getattr(model, 'scoring_engine', None) is None:
+        model.scoring_engine = NCFScoringEngine.from_model(model)
+    return model.scoring_engine
+
 def batch_predict_with_embeddings(model, gmf_embed, mlp_embed, items_to_score, batch_size=500):
     """
-    Make predictions in batches for better performance using embeddings.
+    Make predictions for all candidates at once using embeddings.
     Args:
         model: NCF model.
         gmf_embed: GMF embedding for the user.
         mlp_embed: MLP embedding for the user.
         items_to_score: List of item IDs to score.
-        batch_size: Batch size for predictions.
+        batch_size: Kept for compatibility, candidates are scored in one pass.
     Returns:
         List of predictions for the items.
     """
     try:
-        with tf.compat.v1.variable_scope("", reuse=tf.compat.v1.AUTO_REUSE):
-            # Load weights once
-            mlp_weights1 = model.sess.run(tf.compat.v1.get_variable("mlp/fully_connected/weights"))
-            mlp_biases1 = model.sess.run(tf.compat.v1.get_variable("mlp/fully_connected/biases"))
-            mlp_weights2 = model.sess.run(tf.compat.v1.get_variable("mlp/fully_connected_1/weights"))
-            mlp_biases2 = model.sess.run(tf.compat.v1.get_variable("mlp/fully_connected_1/biases"))
-            final_weights = model.sess.run(tf.compat.v1.get_variable("ncf/fully_connected/weights"))
+        engine = get_scoring_engine(model)
     except Exception as e:
         print(f"Error loading model weights: {str(e)}", file=sys.stderr)
         return [0.5] * len(items_to_score)
 
-    all_predictions = []
-    
-    # Process in batches
-    for i in range(0, len(items_to_score), batch_size):
-        batch_items = items_to_score[i:i+batch_size]
-        batch_predictions = []
-        
-        # Get all item embeddings in one go for this batch
-        item_ids = [model.item2id.get(item, 0) for item in batch_items]
-        item_input_val = np.array([[id] for id in item_ids])
-        
-        gmf_item_embeds = model.sess.run(
-            tf.nn.embedding_lookup(model.embedding_gmf_Q, item_input_val),
-            {model.item_input: item_input_val}
-        )
-        
-        mlp_item_embeds = model.sess.run(
-            tf.nn.embedding_lookup(model.embedding_mlp_Q, item_input_val),
-            {model.item_input: item_input_val}
-        )
-        
-        # Process each item in the batch
-        for j, item_id in enumerate(batch_items):
-            if item_id not in model.item2id:
-                batch_predictions.append(0.0)
-                continue
-                
-            # Get embeddings for this item
-            gmf_item_embed = gmf_item_embeds[j][0]
-            mlp_item_embed = mlp_item_embeds[j][0]
-            
-            # GMF path
-            gmf_vector = np.multiply(gmf_embed, gmf_item_embed)
-            
-            # MLP path
-            mlp_vector = np.concatenate([mlp_embed, mlp_item_embed])
-            mlp_vector = np.maximum(0, np.dot(mlp_vector, mlp_weights1) + mlp_biases1)
-            mlp_vector = np.maximum(0, np.dot(mlp_vector, mlp_weights2) + mlp_biases2)
-            
-            # Final prediction
-            ncf_vector = np.concatenate([gmf_vector, mlp_vector])
-            prediction = 1.0 / (1.0 + np.exp(-np.dot(ncf_vector, final_weights)))
-            batch_predictions.append(float(prediction.item()))
-        
-        all_predictions.extend(batch_predictions)
-        print(f"Processed batch {i//batch_size + 1}/{(len(items_to_score)-1)//batch_size + 1}", file=sys.stderr)
-    
-    return all_predictions
+    # Items unknown to the model keep a prediction of 0
+    item_codes = model.item2id.codes(items_to_score)
+    known = item_codes >= 0
+
+    predictions = np.zeros(len(items_to_score), dtype=np.float64)
+    if known.any():
+        predictions[known] = engine.score(gmf_embed, mlp_embed, item_codes[known])
+
+    print(f"Scored {int(known.sum())} of {len(items_to_score)} items", file=sys.stderr)
+    return predictions.tolist()
 
 ##############################################################################
 # CF RELATED FUNCTIONS
 ##############################################################################
 
-def get_recommendations_ubcf(user_id, new_user_ratings, genre_preferences=None, decade_preferences=None):
+def get_ubcf_index():
+    """
+    Compute the per-user statistics used by UBCF on first use.
+    Returns:
+        UBCFIndex built on the memory-mapped ratings store.
+    """
+    global _ubcf_index
+    if _ubcf_index is None:
+        _ubcf_index = open_ubcf_index(get_ratings_store())
+    return _ubcf_index
+
+def get_shard_executor():
+    """
+    Thread pool scoring row blocks of the exact UBCF similarity scan.
+    Returns:
+        ThreadPoolExecutor instance, or None when the scan is not sharded.
+    """
+    global _shard_executor
+    if _shard_executor is None and UBCF_SIMILARITY_SHARDS > 1:
+        _shard_executor = ProfiledThreadPoolExecutor(UBCF_SIMILARITY_SHARDS, thread_name_prefix="ubcf-shard")
+    return _shard_executor
+
+def get_ubcf_ann_index():
+    """
+    Load the approximate UBCF neighbour index of the current ratings store, if it was built.
+
+    Versions produced by merging the ratings delta keep the training rows
+    unchanged, so they reuse the index of the version they were merged from.
+    Returns:
+        UBCFAnnIndex instance, or None when no index exists for the store version.
+    """
+    global _ubcf_ann_index
+    if _ubcf_ann_index is None:
+        store = get_ratings_store()
+        path = ann_index_path(store)
+        if not os.path.exists(path) and 'base_version' in store.manifest:
+            path = os.path.join(RATINGS_STORE_DIR, store.manifest['base_version'], ANN_INDEX_FILE)
+        if not os.path.exists(path):
+            print(f"UBCF ANN index not found at {path}, using exact search", file=sys.stderr)
+            return None
+        _ubcf_ann_index = UBCFAnnIndex.load(path)
+    return _ubcf_ann_index
+
+def get_icf_index():
+    """
+    Load the item neighbour table of the current ratings store, if it was built.
+
+    Like the ANN index, versions produced by merging the ratings delta reuse
+    the table of the version they were merged from. A missing table is
+    reported once and not looked for again until another store version is
+    loaded, so a table built later is picked up by restarting the worker.
+    Returns:
+        ItemNeighbourIndex instance, or None when no table exists for the store version.
+    """
+    global _icf_index, _icf_index_missing
+    if _icf_index is None and not _icf_index_missing:
+        store = get_ratings_store()
+        path = icf_index_path(store)
+        if not os.path.exists(path) and 'base_version' in store.manifest:
+            path = os.path.join(RATINGS_STORE_DIR, store.manifest['base_version'], ICF_INDEX_FILE)
+        if not os.path.exists(path):
+            print(f"Item neighbour table not found at {path}, run python icf.py", file=sys.stderr)
+            _icf_index_missing = True
+            return None
+        _icf_index = ItemNeighbourIndex.load(path)
+    return _icf_index
+
+def get_ratings_delta():
+    """
+    Open the app user delta segment on top of the current ratings store.
+    Returns:
+        RatingsDelta instance.
+    """
+    global _ratings_delta
+    if _ratings_delta is None:
+        _ratings_delta = RatingsDelta(get_ratings_store(), RATINGS_STORE_DIR)
+    return _ratings_delta
+
+def get_ubcf_data():
+    """
+    Consistent snapshot of the data used by one UBCF request.
+    Returns:
+        Tuple of (RatingsStore, UBCFIndex, RatingsDelta).
+    """
+    refresh_ratings_store()
+    with _store_lock:
+        return get_ratings_store(), get_ubcf_index(), get_ratings_delta()
+
+def _load_store_version(version):
+    """Prepare a new ratings store version in the background and swap it in."""
+    global _ratings_store, _ubcf_index, _ubcf_ann_index, _icf_index, _icf_index_missing, _ratings_delta
+    try:
+        store = open_ratings_store(RATINGS_STORE_DIR, version)
+        ubcf_index = open_ubcf_index(store)
+        delta = RatingsDelta(store, RATINGS_STORE_DIR)
+        with _store_lock:
+            _ratings_store, _ubcf_index, _ubcf_ann_index, _ratings_delta = store, ubcf_index, None, delta
+            _icf_index, _icf_index_missing = None, False
+        print(f"Switched to ratings store {version}", file=sys.stderr)
+    except Exception as e:
+        print(f"Error loading ratings store {version}: {str(e)}", file=sys.stderr)
+
+def refresh_ratings_store():
+    """
+    Start loading a newer ratings store version (e.g. after a delta merge) if CURRENT changed.
+    Requests keep using the loaded version until the new one is ready.
+    """
+    global _store_reload
+    if _ratings_store is None or (_store_reload is not None and _store_reload.is_alive()):
+        return
+    try:
+        with open(os.path.join(RATINGS_STORE_DIR, CURRENT_FILE)) as f:
+            version = f.read().strip()
+    except OSError:
+        return
+    if version != _ratings_store.version:
+        _store_reload = threading.Thread(target=_load_store_version, args=(version,), daemon=True)
+        _store_reload.start()
+
+def fold_in_app_user(delta, user_id, new_user_ratings):
+    """
+    Record an app user's ratings in the delta so they become a neighbour for other users.
+    Starts a background merge once the delta holds UBCF_DELTA_MERGE_THRESHOLD users.
+    Args:
+        delta: RatingsDelta of the current store.
+        user_id: App user ID.
+        new_user_ratings: Dictionary of {item_id: rating}.
+    """
+    global _delta_merge
+    try:
+        if not delta.upsert(user_id, new_user_ratings):
+            return
+        print(f"Folded user {user_id} into the ratings delta ({len(delta)} users)", file=sys.stderr)
+        if UBCF_DELTA_MERGE_THRESHOLD > 0 and len(delta) >= UBCF_DELTA_MERGE_THRESHOLD:
+            if _delta_merge is None or not _delta_merge.is_alive():
+                _delta_merge = threading.Thread(target=try_merge_delta, args=(delta,), daemon=True)
+                _delta_merge.start()
+    except Exception as e:
+        print(f"Error folding user into the ratings delta: {str(e)}", file=sys.stderr)
+
+def get_recommendations_ubcf(user_id, new_user_ratings, genre_preferences=None, decade_preferences=None, candidates=None, exclude_rows=None):
     """
     Generate recommendations using User-Based Collaborative Filtering (UBCF).
     Args:
@@ -270,6 +733,8 @@ def get_recommendations_ubcf(user_id, new_user_ratings, genre_preferences=None,
         new_user_ratings: Dictionary of {item_id: rating} for the new user.
         genre_preferences: List of preferred genres.
         decade_preferences: List of preferred decades.
+        candidates: Shared candidate set of the request, retrieved here when None.
+        exclude_rows: Store rows that must not be neighbours, e.g. users held out by an evaluation.
     Returns:
         List of recommendations with predicted ratings.
     """
@@ -277,165 +742,106 @@ def get_recommendations_ubcf(user_id, new_user_ratings, genre_preferences=None,
         # 1. Load ratings data
         print("Starting User-Based CF recommendation process...", file=sys.stderr)
         
-        # Load ratings data from the training file
-        ratings_df = pd.read_csv(TRAIN_FILE)
+        # Memory-mapped ratings compiled from the training file, plus the app users' delta
+        with stage("data_load"):
+            store, ubcf_index, delta = get_ubcf_data()
+
+        if candidates is None:
+            candidates = retrieve_request_candidates(genre_preferences, decade_preferences)
         
         # Create a new user ID
-        new_user_id = ratings_df['userID'].max() + 1
+        new_user_id = store.next_user_id
         print(f"Created new user with ID {new_user_id} with {len(new_user_ratings)} ratings", file=sys.stderr)
         
-        # Append new user ratings
-        new_rows = pd.DataFrame([
-            {'userID': new_user_id, 'itemID': int(iid), 'rating': r}
-            for iid, r in new_user_ratings.items()
-        ])
-        ratings_df = pd.concat([ratings_df, new_rows], ignore_index=True)
-        
-        # 2. Create mappings for user and item IDs
-        unique_users = ratings_df['userID'].unique()
-        unique_items = ratings_df['itemID'].unique()
-        user_idx_map = {uid: i for i, uid in enumerate(unique_users)}
-        item_idx_map = {iid: i for i, iid in enumerate(unique_items)}
-        
-        # Track mapping back to original IDs
-        idx_to_item = {v: k for k, v in item_idx_map.items()}
-        
-        # Get new user's index
-        new_user_idx = user_idx_map[new_user_id]
-        
-        # 3. Create sparse user-item matrix
-        row_indices = [user_idx_map[uid] for uid in ratings_df['userID']]
-        col_indices = [item_idx_map[iid] for iid in ratings_df['itemID']]
-        data_values = ratings_df['rating'].values
-        
-        user_item_sparse = sparse.csr_matrix(
-            (data_values, (row_indices, col_indices)),
-            shape=(len(unique_users), len(unique_items))
-        )
-        
-        print(f"Created sparse user-item matrix with shape {user_item_sparse.shape}", file=sys.stderr)
+        with stage("ubcf_similarity"):
+            # 2. Express the new user in the matrix's item codes, centered by their mean
+            new_user = ubcf_index.fold_in(new_user_ratings, store.item2id)
         
-        # 4. Calculate user means
-        user_ratings_count = np.diff(user_item_sparse.indptr)
-        user_ratings_sum = np.zeros(user_item_sparse.shape[0])
-        for i in range(user_item_sparse.shape[0]):
-            user_ratings_sum[i] = user_item_sparse[i].sum()
-        
-        user_means = np.zeros(user_item_sparse.shape[0])
-        nonzero_counts = (user_ratings_count > 0)
-        user_means[nonzero_counts] = user_ratings_sum[nonzero_counts] / user_ratings_count[nonzero_counts]
-        
-        # Get new user's mean
-        u_mean = user_means[new_user_idx]
-        
-        # 5. Center the ratings by subtracting user means
-        centered_sparse = user_item_sparse.copy()
-        for i in range(centered_sparse.shape[0]):
-            if user_ratings_count[i] > 0:
-                start_idx = centered_sparse.indptr[i]
-                end_idx = centered_sparse.indptr[i+1]
-                centered_sparse.data[start_idx:end_idx] -= user_means[i]
-        
-        # 6. Compute similarity - an approximation of Pearson using cosine on centered data
-        new_user_vec = centered_sparse[new_user_idx]
-        user_similarities = cosine_similarity(new_user_vec, centered_sparse).flatten()
-        
-        # Get item overlap counts for shrinkage
-        new_user_items = set(new_user_ratings.keys())
-        overlap_counts = np.zeros(len(unique_users))
-        
-        # Calculate overlap more efficiently using sparse matrix properties
-        new_user_nonzero = set(user_item_sparse[new_user_idx].nonzero()[1])
-        for i in range(user_item_sparse.shape[0]):
-            if i != new_user_idx:
-                user_nonzero = set(user_item_sparse[i].nonzero()[1])
-                overlap_counts[i] = len(new_user_nonzero.intersection(user_nonzero))
-        
-        # 7. Apply shrinkage: shrunk = (n / (n + λ)) * ρ
-        λ = 10  # regularization constant
-        shrinkage = overlap_counts / (overlap_counts + λ)
-        user_similarities *= shrinkage
+            # 3. Compute similarity - an approximation of Pearson using cosine on centered data,
+            # shrunk by the number of co-rated items
+            # 4. Select top-K neighbors with a positive similarity
+            # Base rows replaced by the delta, and the user's own merged row, are skipped
+            hidden_rows = delta.hidden_base_rows(exclude_user=user_id)
+            if exclude_rows is not None:
+                hidden_rows = np.union1d(hidden_rows, exclude_rows)
+            ann_index = get_ubcf_ann_index() if UBCF_NEIGHBOUR_SEARCH == 'ann' else None
+            if ann_index is not None:
+                # Exact re-rank of a shortlist taken from the approximate index
+                top_neighbors_idx, top_neighbors_weights = ann_index.search(ubcf_index, new_user, NEIGHBOURS_K + len(hidden_rows))
+                # Merged app users are not in the index, they are few enough to score exactly
+                app_rows = np.arange(store.n_trained_users, store.n_users)
+                if len(app_rows):
+                    app_similarities, _ = ubcf_index.similarities(new_user, rows=app_rows)
+                    top_neighbors_idx = np.concatenate([top_neighbors_idx, app_rows])
+                    top_neighbors_weights = np.concatenate([top_neighbors_weights, app_similarities])
+                keep = (top_neighbors_weights > 0) & ~np.isin(top_neighbors_idx, hidden_rows)
+                top_neighbors_idx, top_neighbors_weights = top_neighbors_idx[keep], top_neighbors_weights[keep]
+                order = np.argsort(-top_neighbors_weights, kind='stable')[:NEIGHBOURS_K]
+                top_neighbors_idx, top_neighbors_weights = top_neighbors_idx[order], top_neighbors_weights[order]
+            else:
+                user_similarities, _ = ubcf_index.similarities(
+                    new_user, executor=get_shard_executor(), shards=UBCF_SIMILARITY_SHARDS
+                )
+                user_similarities[hidden_rows] = 0
+                top_neighbors_idx, top_neighbors_weights = ubcf_index.top_neighbours(user_similarities)
+
+            # App users not merged yet compete for the same K slots
+            delta_keys, delta_index = delta.segment()
+            delta_neighbors_idx = np.zeros(0, dtype=np.int64)
+            delta_neighbors_weights = np.zeros(0)
+            if delta_keys:
+                delta_similarities, _ = delta_index.similarities(new_user)
+                if user_id is not None and str(user_id) in delta_keys:
+                    delta_similarities[delta_keys.index(str(user_id))] = 0
+                delta_neighbors_idx, delta_neighbors_weights = delta_index.top_neighbours(delta_similarities)
+                weights = np.concatenate([top_neighbors_weights, delta_neighbors_weights])
+                selected = np.argsort(-weights, kind='stable')[:NEIGHBOURS_K]
+                from_base = selected[selected < len(top_neighbors_idx)]
+                from_delta = selected[selected >= len(top_neighbors_idx)] - len(top_neighbors_idx)
+                top_neighbors_idx, top_neighbors_weights = top_neighbors_idx[from_base], top_neighbors_weights[from_base]
+                delta_neighbors_idx, delta_neighbors_weights = delta_neighbors_idx[from_delta], delta_neighbors_weights[from_delta]
         
-        # 8. Select top-K neighbors
-        K = 20
-        # Set self-similarity to 0 to exclude from neighbors
-        user_similarities[new_user_idx] = 0
+        print(f"Selected {len(top_neighbors_idx) + len(delta_neighbors_idx)} neighbors for CF "
+              f"({len(delta_neighbors_idx)} app users)", file=sys.stderr)
+        count("ubcf_neighbours", len(top_neighbors_idx) + len(delta_neighbors_idx))
         
-        # Find indices of top K users by similarity
-        top_neighbors_idx = np.argsort(-user_similarities)[:K]
-        # Filter out users with zero similarity
-        top_neighbors_idx = [idx for idx in top_neighbors_idx if user_similarities[idx] > 0]
-        top_neighbors_weights = {idx: user_similarities[idx] for idx in top_neighbors_idx}
+        with stage("ubcf_prediction"):
+            # 5. Predict ratings for the unrated items among the request's candidates
+            unrated = np.zeros(store.n_items, dtype=bool)
+            candidate_codes = store.item2id.codes(candidates)
+            unrated[candidate_codes[candidate_codes >= 0]] = True
+            unrated[new_user.item_codes] = False
         
-        print(f"Selected {len(top_neighbors_idx)} neighbors for CF", file=sys.stderr)
+            unrated_items_idx = np.flatnonzero(unrated)
+            print(f"Predicting ratings for {len(unrated_items_idx)} unrated items", file=sys.stderr)
+            count("ubcf_candidates", len(unrated_items_idx))
         
-        # 9. Predict ratings for unrated items
-        rated_items_idx = set(new_user_vec.nonzero()[1])
-        all_items_idx = set(range(len(unique_items)))
-        unrated_items_idx = all_items_idx - rated_items_idx
-
-        # Add after loading ratings data in get_recommendations_ubcf
-        if genre_preferences or decade_preferences:
-            # Load movie metadata
-            movies_metadata = pd.read_csv(MOVIES_FILE)
-            movies_metadata['release_year'] = movies_metadata['title'].str.extract(r'\((\d{4})\)').astype(float)
-            
-            # Filter by decade if specified
-            filtered_items = set(movies_metadata['movieId'].tolist())
-            if decade_preferences:
-                year_mask = movies_metadata['release_year'].isin(decade_preferences)
-                filtered_items = set(movies_metadata[year_mask]['movieId'].tolist())
-            
-            # Filter by genre if specified
-            if genre_preferences:
-                genre_mask = movies_metadata['genres'].apply(
-                    lambda g: any(genre in g.split('|') for genre in genre_preferences)
+            numerators, denominators = ubcf_index.prediction_terms(
+                top_neighbors_idx, top_neighbors_weights, unrated_items_idx
+            )
+            if len(delta_neighbors_idx):
+                delta_numerators, delta_denominators = delta_index.prediction_terms(
+                    delta_neighbors_idx, delta_neighbors_weights, unrated_items_idx
                 )
-                genre_items = set(movies_metadata[genre_mask]['movieId'].tolist())
-                filtered_items = filtered_items.intersection(genre_items) if decade_preferences else genre_items
-            
-            # Only predict for items that match preferences
-            unrated_items_idx = [idx for idx in unrated_items_idx 
-                                 if idx_to_item[idx] in filtered_items]
-        
-        print(f"Predicting ratings for {len(unrated_items_idx)} unrated items", file=sys.stderr)
-        
-        predictions = {}
-        for item_idx in unrated_items_idx:
-            num, den = 0.0, 0.0
-            for neighbor_idx, weight in top_neighbors_weights.items():
-                # Get the neighbor's original rating for this item
-                rating = user_item_sparse[neighbor_idx, item_idx]
-                if rating != 0:  # If the neighbor rated this item
-                    neigh_mean = user_means[neighbor_idx]
-                    num += weight * (rating - neigh_mean)
-                    den += abs(weight)
-            
-            if den > 0:
-                pred = u_mean + num / den
-                # Map back to original item ID
-                orig_item_id = idx_to_item[item_idx]
-                # Clamp to valid rating range
-                predictions[orig_item_id] = float(max(1.0, min(5.0, pred)))
+                numerators += delta_numerators
+                denominators += delta_denominators
+            predicted_idx, predicted = predict_from_terms(new_user, unrated_items_idx, numerators, denominators)
         
-        # 10. Generate top-N recommendations
-        TOP_N = 10
-        top_N = sorted(
-            predictions.items(),
-            key=lambda x: x[1],
-            reverse=True
-        )[:TOP_N]
-        
-        print(f"Generated {len(top_N)} recommendations using User-Based CF", file=sys.stderr)
+            # 6. Generate top-N recommendations (ties go to the more popular item)
+            TOP_N = 10
+            popularity = item_popularity(store.item_ids[predicted_idx])
+            top_N = np.lexsort((-popularity, -predicted))[:TOP_N]
         
+            print(f"Generated {len(top_N)} recommendations using User-Based CF", file=sys.stderr)
+
         # Format results
         recommendations = [
             {
                 "userID": int(new_user_id),
-                "itemID": int(item_id),
-                "prediction": float(score)
+                "itemID": int(store.item_ids[predicted_idx[i]]),
+                "prediction": float(predicted[i])
             }
-            for item_id, score in top_N
+            for i in top_N
         ]
         
         return recommendations
@@ -445,37 +851,111 @@ def get_recommendations_ubcf(user_id, new_user_ratings, genre_preferences=None,
         traceback.print_exc(file=sys.stderr)
         return []
 
+def get_recommendations_icf(new_user_ratings, genre_preferences=None, decade_preferences=None):
+    """
+    Generate recommendations using Item-Based Collaborative Filtering (ICF).
+
+    Only the neighbour lists of the rated items are read, so the cost depends
+    on the number of ratings rather than on the number of users.
+    Args:
+        new_user_ratings: Dictionary of {item_id: rating} for the new user.
+        genre_preferences: List of preferred genres.
+        decade_preferences: List of preferred decades.
+    Returns:
+        List of recommendations with predicted ratings.
+    """
+    try:
+        print("Starting Item-Based CF recommendation process...", file=sys.stderr)
+
+        with stage("data_load"):
+            store, ubcf_index, _ = get_ubcf_data()
+            icf_index = get_icf_index()
+        if icf_index is None:
+            return []
+
+        with stage("icf_scoring"):
+            # 1. Ratings centered by the user's mean, as the table's adjusted cosine
+            new_user = ubcf_index.fold_in(new_user_ratings, store.item2id)
+            in_table = new_user.item_codes < icf_index.n_items
+            new_user.item_codes, new_user.centered = new_user.item_codes[in_table], new_user.centered[in_table]
+
+            # 2. Weighted deviations accumulated over the neighbours of the rated items
+            numerators, denominators, support = icf_index.prediction_terms(new_user)
+
+            # 3. Candidates are unrated neighbours matching the genre and decade preferences
+            candidates = denominators > 0
+            candidates[new_user.item_codes] = False
+            if genre_preferences or decade_preferences:
+                index = get_movie_index()
+                filtered_items = index.movie_ids[index.filter_rows(genre_preferences, decade_preferences)]
+                candidates &= np.isin(store.item_ids[:icf_index.n_items], filtered_items)
+            candidate_idx = np.flatnonzero(candidates)
+            count("icf_candidates", len(candidate_idx))
+
+            predicted_idx, predicted = predict_from_terms(
+                new_user, candidate_idx, numerators[candidate_idx], denominators[candidate_idx]
+            )
+
+            # 4. Top-N by prediction, items supported by more similarity mass, then more popular ones first on ties
+            popularity = item_popularity(store.item_ids[predicted_idx])
+            top_N = np.lexsort((-popularity, -denominators[predicted_idx], -predicted))[:TOP_K]
+
+            print(f"Generated {len(top_N)} recommendations using Item-Based CF "
+                  f"from {len(candidate_idx)} candidates", file=sys.stderr)
+
+        return [
+            {
+                "userID": int(store.next_user_id),
+                "itemID": int(store.item_ids[predicted_idx[i]]),
+                "prediction": float(predicted[i])
+            }
+            for i in top_N
+        ]
+
+    except Exception as e:
+        print(f"Error in Item-Based CF: {str(e)}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        return []
+
 ###############################################################################
 # MAIN FUNCTION
 ###############################################################################
 
-def get_recommendations(user_id=None, ratings_json=None, genre_preferences=None, decade_preferences=None):
+def load_weights_bundle(n_items):
     """
-    Generate movie recommendations using NCF and UBCF methods.
+    Memory-map the exported weight bundle if it matches the checkpoint and the ratings store.
     Args:
-        user_id: ID of the user requesting recommendations.
-        ratings_json: JSON string with item IDs and ratings.
-        genre_preferences: List of preferred genres.
-        decade_preferences: List of preferred decades.
+        n_items: Number of items in the ratings store.
     Returns:
-        Dictionary containing NCF and UBCF recommendations.
+        NCFScoringEngine instance, or None when the checkpoint has to be restored instead.
     """
-    # Existing code for loading model and data...
-    print(f"Using model path: {MODEL_PATH}", file=sys.stderr)
-    print(f"Using train file: {TRAIN_FILE}", file=sys.stderr)
-    
-    # Verify files exist
-    if not os.path.exists(TRAIN_FILE):
-        raise FileNotFoundError(f"Training data file not found: {TRAIN_FILE}")
-    if not os.path.exists(MODEL_PATH):
-        raise FileNotFoundError(f"Model directory not found: {MODEL_PATH}")
-    
-    
-    data = NCFDataset(train_file=TRAIN_FILE)
+    try:
+        manifest = read_bundle_manifest(WEIGHTS_BUNDLE_DIR)
+    except (OSError, ValueError) as e:
+        print(f"Weight bundle not available ({str(e)}), restoring the TensorFlow checkpoint", file=sys.stderr)
+        return None
+
+    source = checkpoint_fingerprint(MODEL_PATH)
+    if source is not None and manifest['source'] != source:
+        print("Weight bundle is older than the checkpoint, restoring the TensorFlow checkpoint", file=sys.stderr)
+        return None
+    if manifest['n_items'] != n_items:
+        raise ValueError(f"Weight bundle has {manifest['n_items']} items, the ratings store {n_items}")
+    return NCFScoringEngine.load(WEIGHTS_BUNDLE_DIR, NCF_WEIGHTS_PRECISION)
+
+def restore_checkpoint(data):
+    """
+    Restore the NeuMF checkpoint with TensorFlow and extract its weights.
+    Args:
+        data: RatingsStore sizing the model.
+    Returns:
+        NCF model with restored weights and a scoring engine.
+    """
+    # TensorFlow is only imported when there is no usable weight bundle
+    from recommenders.models.ncf.ncf_singlenode import NCF
 
-    # Load model
     model = NCF (
-        n_users=data.n_users, 
+        n_users=data.n_trained_users, 
         n_items=data.n_items,
         model_type="NeuMF",
         n_factors=128,
@@ -488,64 +968,935 @@ def get_recommendations(user_id=None, ratings_json=None, genre_preferences=None,
     )
     
     model.load(neumf_dir=MODEL_PATH)
+
+    # Pull embeddings and dense weights out of the session once
+    model.scoring_engine = NCFScoringEngine.from_model(model)
+    return model
+
+def load_model():
+    """
+    Load the NeuMF model together with the user and item id maps.
+
+    Serves from the exported weight bundle (python ncf_scoring.py) with NumPy
+    only; the TensorFlow checkpoint is restored when the bundle is missing or
+    older than the checkpoint.
+    Returns:
+        Model with a scoring engine and id maps attached.
+    """
+    print(f"Using model path: {MODEL_PATH}", file=sys.stderr)
+    print(f"Using train file: {TRAIN_FILE}", file=sys.stderr)
+    
+    # Verify files exist
+    if not os.path.exists(TRAIN_FILE) and not os.path.exists(RATINGS_STORE_DIR):
+        raise FileNotFoundError(f"Training data file not found: {TRAIN_FILE}")
+    if not os.path.exists(MODEL_PATH):
+        raise FileNotFoundError(f"Model directory not found: {MODEL_PATH}")
+    
+    # The ratings store assigns codes in the same order as NCFDataset,
+    # so its maps can be used directly instead of re-parsing train.csv
+    with stage("data_load"):
+        data = get_ratings_store()
+
+    with stage("model_restore"):
+        engine = load_weights_bundle(data.n_items)
+        if engine is not None:
+            model = ExportedModel(engine, data.n_trained_users)
+        else:
+            model = restore_checkpoint(data)
+            model.scoring_engine = model.scoring_engine.quantized(NCF_WEIGHTS_PRECISION)
+
     model.user2id = data.user2id
     model.item2id = data.item2id
     model.id2user = data.id2user
     model.id2item = data.id2item
-    
-    if ratings_json:
-        # COLD START APPROACH
-        new_user_ratings = json.loads(ratings_json)
-        new_user_ratings = {int(k): float(v) for k, v in new_user_ratings.items()}
-        
-        # 1. RETRIEVAL PHASE - Get candidate items 
-        print("Starting retrieval phase...", file=sys.stderr)
-        ncf_candidates = retrieve_candidates_ncf(
-            genre_preferences=genre_preferences,
-            decade_preferences=decade_preferences, 
-            exploration_ratio=0.1,
-            k=5000
+
+    return model
+
+def get_ncf_shard_executor():
+    """
+    Thread pool scoring item blocks of exhaustive NCF scoring. BLAS is limited
+    to one thread while the shards run, the pool supplies the parallelism.
+    Returns:
+        ThreadPoolExecutor instance, or None when scoring is not sharded.
+    """
+    global _ncf_shard_executor
+    if _ncf_shard_executor is None and NCF_SCORING_SHARDS > 1:
+        if threadpool_limits is None:
+            print("threadpoolctl not installed, BLAS threads are not limited while scoring shards", file=sys.stderr)
+        _ncf_shard_executor = ProfiledThreadPoolExecutor(NCF_SCORING_SHARDS, thread_name_prefix="ncf-shard")
+    return _ncf_shard_executor
+
+def rank_items_sharded(model, gmf_embeds, mlp_embeds, item_codes=None):
+    """
+    NCF recommendations over a very large item set, scored in parallel shards
+    that each keep only their best items.
+    Args:
+        model: NCF model.
+        gmf_embeds: Stacked GMF user embeddings (n_users x n_factors).
+        mlp_embeds: Stacked MLP user embeddings (n_users x mlp_dim).
+        item_codes: Item codes to score, the whole catalogue when None.
+    Returns:
+        List with the TOP_K best scored items of each user.
+    """
+    engine = get_scoring_engine(model)
+    item_ids = get_ratings_store().item_ids
+    ranked = engine.top_k(gmf_embeds, mlp_embeds, TOP_K, item_codes, get_ncf_shard_executor(), NCF_SCORING_SHARDS)
+    return [top_k_recommendations(item_ids[codes], scores) for codes, scores in ranked]
+
+def get_branch_executor():
+    """
+    Thread pool running the NCF and UBCF branches of a request. Tasks run in
+    the submitting request's context, so they record its stage timings and
+    join its slow-request profile.
+    Returns:
+        ThreadPoolExecutor instance.
+    """
+    global _branch_executor
+    if _branch_executor is None:
+        _branch_executor = ProfiledThreadPoolExecutor(BRANCH_WORKERS, thread_name_prefix="branch")
+    return _branch_executor
+
+def get_recommendations_ncf(model, new_user_ratings, genre_preferences=None, decade_preferences=None, candidates=None, user_id=None):
+    """
+    Generate recommendations for a cold-start user with the NCF model.
+    Args:
+        model: NCF model.
+        new_user_ratings: Dictionary of {item_id: rating} for the new user.
+        genre_preferences: List of preferred genres.
+        decade_preferences: List of preferred decades.
+        candidates: Shared candidate set of the request, retrieved here when None.
+        user_id: ID of the app user, for their stored vector.
+    Returns:
+        List of the TOP_K best scored items.
+    """
+    # 1. Cold-start user vector, needed by both retrieval and ranking
+    print("Creating user embedding from rated items...", file=sys.stderr)
+    with stage("embedding"):
+        user_embeddings = create_user_embedding_from_items(model, new_user_ratings, user_id)
+
+    if not user_embeddings:
+        # Not enough signal: none of the rated items is known to the model
+        print("Falling back to popular items", file=sys.stderr)
+        with stage("popular_fallback"):
+            return get_popular_recommendations(new_user_ratings, genre_preferences, decade_preferences)
+
+    avg_gmf_embedding, avg_mlp_embedding = user_embeddings
+
+    if NCF_RETRIEVAL == 'exhaustive':
+        # Every movie matching the preferences is scored, no candidate cap
+        with stage("ncf_scoring"):
+            allowed = preference_item_mask(genre_preferences, decade_preferences)
+            item_codes = None if allowed is None else np.flatnonzero(allowed)
+            count("ncf_candidates", get_scoring_engine(model).n_items if item_codes is None else len(item_codes))
+            return rank_items_sharded(model, [avg_gmf_embedding], [avg_mlp_embedding], item_codes)[0]
+
+    # 2. RETRIEVAL PHASE - Get candidate items 
+    with stage("retrieval"):
+        ncf_candidates = retrieve_candidates(model, avg_gmf_embedding, genre_preferences, decade_preferences, candidates)
+    print(f"Retrieved {len(ncf_candidates)} ncf candidate items", file=sys.stderr)
+    count("ncf_candidates", len(ncf_candidates))
+
+    # 3. NCF RANKING PHASE
+    print("Making batch predictions with embeddings...", file=sys.stderr)
+    with stage("ncf_scoring"):
+        if len(ncf_candidates) >= SHARDED_SCORING_MIN_ITEMS:
+            item_codes = model.item2id.codes(ncf_candidates)
+            return rank_items_sharded(model, [avg_gmf_embedding], [avg_mlp_embedding], item_codes[item_codes >= 0])[0]
+        predictions = batch_predict_with_embeddings(
+            model, 
+            avg_gmf_embedding, 
+            avg_mlp_embedding, 
+            ncf_candidates,
+            batch_size=100
         )
+        return top_k_recommendations(ncf_candidates, predictions)
 
-        print(f"Retrieved {len(ncf_candidates)} ncf candidate items", file=sys.stderr)
+def parse_ratings(ratings_json):
+    """
+    Decode the ratings of a request.
+    Args:
+        ratings_json: JSON string (or already decoded dictionary) with item IDs and ratings.
+    Returns:
+        Dictionary of {item_id: rating}.
+    """
+    if not ratings_json:
+        raise ValueError("Ratings are required for cold-start recommendations")
+    new_user_ratings = json.loads(ratings_json) if isinstance(ratings_json, str) else ratings_json
+    return {int(k): float(v) for k, v in new_user_ratings.items()}
 
-        
-        # 2A NCF PHASE
-        print("Creating user embedding from rated items...", file=sys.stderr)
-        user_embeddings = create_user_embedding_from_items(model, new_user_ratings)
-    
-        if not user_embeddings:
-            raise ValueError("Could not create user embedding from rated items")
-    
-        avg_gmf_embedding, avg_mlp_embedding = user_embeddings
+def submit_branches(user_id, new_user_ratings, genre_preferences, decade_preferences, model, ncf_future=None, candidates=None):
+    """
+    Start the recommenders selected by RECOMMENDATION_SOURCES on the branch pool.
+    They share no mutable state, so they run side by side and the request
+    takes as long as the slower one. NCF and UBCF score the same candidate set.
+    Args:
+        user_id: ID of the user requesting recommendations.
+        new_user_ratings: Dictionary of {item_id: rating}.
+        genre_preferences: List of preferred genres.
+        decade_preferences: List of preferred decades.
+        model: NCF model.
+        ncf_future: Future of NCF recommendations computed elsewhere (e.g. for a whole batch).
+        candidates: Shared candidate set, retrieved here when None.
+    Returns:
+        Dictionary mapping response keys to (future, timeout) tuples.
+    """
+    executor = get_branch_executor()
+    branches = {}
+    needs_candidates = (ncf_future is None and "ncf" in RECOMMENDATION_SOURCES) or "ubcf" in RECOMMENDATION_SOURCES
+    if candidates is None and needs_candidates:
+        candidates = retrieve_request_candidates(genre_preferences, decade_preferences)
+    if "ncf" in RECOMMENDATION_SOURCES:
+        branches["ncf_recommendations"] = (
+            ncf_future if ncf_future is not None else
+            executor.submit(get_recommendations_ncf, model, new_user_ratings, genre_preferences, decade_preferences, candidates, user_id),
+            NCF_BRANCH_TIMEOUT
+        )
+    if "ubcf" in RECOMMENDATION_SOURCES:
+        branches["cf_recommendations"] = (
+            executor.submit(get_recommendations_ubcf, user_id, new_user_ratings, genre_preferences, decade_preferences, candidates),
+            UBCF_BRANCH_TIMEOUT
+        )
+    if "icf" in RECOMMENDATION_SOURCES:
+        branches["icf_recommendations"] = (
+            executor.submit(get_recommendations_icf, new_user_ratings, genre_preferences, decade_preferences),
+            ICF_BRANCH_TIMEOUT
+        )
+    if not branches:
+        raise ValueError(f"No known recommender in RECOMMENDATION_SOURCES: {RECOMMENDATION_SOURCES}")
+    return branches
+
+def collect_branches(branches, started_at):
+    """
+    Wait for the branches of a request and assemble the response.
+    Args:
+        branches: Result of submit_branches().
+        started_at: time.monotonic() when the branches were submitted.
+    Returns:
+        Dictionary with one recommendation list per source and their fusion in
+        "fused_recommendations". "partial" is true when a branch failed or
+        timed out; "failed_branches" then holds the reasons.
+    """
+    results, failures = {}, {}
+    for name, (future, timeout) in branches.items():
         try:
-            print("Making batch predictions with embeddings...", file=sys.stderr)
-            predictions = batch_predict_with_embeddings(
-                model, 
-                avg_gmf_embedding, 
-                avg_mlp_embedding, 
-                ncf_candidates,
-                batch_size=100
+            results[name] = future.result(timeout=max(timeout - (time.monotonic() - started_at), 0))
+        except FutureTimeoutError:
+            # The thread cannot be stopped; it finishes in the background and its result is dropped
+            failures[name] = TimeoutError(f"{name} did not finish within {timeout:g}s")
+        except Exception as e:
+            failures[name] = e
+            traceback.print_exc(file=sys.stderr)
+
+    if not results:
+        raise next(iter(failures.values()))
+
+    response = {name: results.get(name, []) for name in branches}
+    with stage("fusion"):
+        response["fused_recommendations"] = fuse_recommendations(
+            {source: response[key] for source, key in SOURCE_KEYS.items() if key in response}
+        )
+    response["partial"] = bool(failures)
+    if failures:
+        response["failed_branches"] = {name: str(e) for name, e in failures.items()}
+        print(f"Returning partial recommendations: {response['failed_branches']}", file=sys.stderr)
+    count("partial", response["partial"])
+    return response
+
+def get_recommendations(user_id=None, ratings_json=None, genre_preferences=None, decade_preferences=None, model=None):
+    """
+    Generate movie recommendations using the NCF, UBCF and ICF methods selected by RECOMMENDATION_SOURCES.
+    Args:
+        user_id: ID of the user requesting recommendations.
+        ratings_json: JSON string (or already decoded dictionary) with item IDs and ratings.
+        genre_preferences: List of preferred genres.
+        decade_preferences: List of preferred decades.
+        model: Already loaded NCF model. Loaded from disk when omitted.
+    Returns:
+        Dictionary with one recommendation list per source. "partial" is true when
+        a branch failed or timed out; "failed_branches" then holds the reasons.
+    """
+    if model is None:
+        with stage("model_restore"):
+            model = load_model()
+
+    # COLD START APPROACH
+    new_user_ratings = parse_ratings(ratings_json)
+    count("rated_items", len(new_user_ratings))
+
+    started_at = time.monotonic()
+    branches = submit_branches(user_id, new_user_ratings, genre_preferences, decade_preferences, model)
+    return collect_branches(branches, started_at)
+
+def get_result_cache():
+    """
+    Create the result cache configured by the RECOMMENDATION_CACHE_* settings on first use.
+    Returns:
+        RecommendationCache instance, or None when caching is disabled.
+    """
+    global _result_cache
+    if _result_cache is None and RECOMMENDATION_CACHE_SIZE > 0:
+        _result_cache = RecommendationCache(RECOMMENDATION_CACHE_SIZE, RECOMMENDATION_CACHE_TTL, RECOMMENDATION_CACHE_DB)
+    return _result_cache
+
+def get_data_version(model):
+    """
+    Version of everything that affects results: model weights, ratings store and serving modes.
+    Args:
+        model: NCF model.
+    Returns:
+        Version string.
+    """
+    if getattr(model, 'data_version', None) is None:
+        model.data_version = ":".join([
+            get_scoring_engine(model).fingerprint,
+            get_scoring_engine(model).precision,
+            NCF_RETRIEVAL,
+            UBCF_NEIGHBOUR_SEARCH,
+            ",".join(RECOMMENDATION_SOURCES),
+        ])
+    # The store changes when a delta merge swaps in a new version, so it is read every time;
+    # checking CURRENT here also lets a worker that only serves cache hits notice a merge
+    refresh_ratings_store()
+    return f"{model.data_version}:{get_ratings_store().version}"
+
+def get_recommendations_batch(jobs, model):
+    """
+    Serve several requests of the resident worker together.
+
+    Cached results are returned directly. For the others the NCF branch of
+    all users is scored in one pass by score_ncf_batch(), while the UBCF/ICF
+    branches run per request with the same timeouts as in get_recommendations().
+    Args:
+        jobs: List of (request, RequestTimings) tuples; stages are recorded per request.
+        model: Loaded NCF model.
+    Returns:
+        List with the result dictionary, or the exception raised, of each job.
+    """
+    cache = get_result_cache()
+    results = [None] * len(jobs)
+    prepared = []  # (position, timings, user_id, ratings, genres, decades, cache key)
+    generations = {}  # position -> cache generation of the user when the request started
+
+    for position, (request, timings) in enumerate(jobs):
+        with request_timings(timings):
+            try:
+                user_id, genres, decades = request.get("user_id"), request.get("genres") or None, request.get("decades") or None
+                if not user_id and not request.get("ratings"):
+                    raise ValueError("Either user_id or ratings must be provided")
+                new_user_ratings = parse_ratings(request.get("ratings"))
+                count("rated_items", len(new_user_ratings))
+
+                key = None
+                if cache is not None:
+                    key = cache_key(user_id, new_user_ratings, genres, decades, get_data_version(model))
+                    generations[position] = cache.generation(user_id)
+                    with stage("cache"):
+                        results[position] = cache.get(key)
+                    count("cache_hit", results[position] is not None)
+                    if results[position] is not None:
+                        continue
+                prepared.append((position, timings, user_id, new_user_ratings, genres, decades, key))
+            except Exception as e:
+                results[position] = e
+
+    # One shared candidate set per distinct preferences, scored by NCF and UBCF
+    shared_candidates = [None] * len(prepared)
+    if prepared and ("ncf" in RECOMMENDATION_SOURCES or "ubcf" in RECOMMENDATION_SOURCES):
+        start = time.perf_counter()
+        shared_candidates = retrieve_batch_candidates([(genres, decades) for _, _, _, _, genres, decades, _ in prepared])
+        for _, timings, *_ in prepared:
+            timings.record("retrieval", time.perf_counter() - start)
+
+    # The NCF batch goes first so it does not queue behind the per-request branches
+    ncf_futures = [Future() if "ncf" in RECOMMENDATION_SOURCES else None for _ in prepared]
+    if prepared and "ncf" in RECOMMENDATION_SOURCES:
+        records = [
+            (ratings, genres, decades, candidates)
+            for (_, _, _, ratings, genres, decades, _), candidates in zip(prepared, shared_candidates)
+        ]
+
+        def score_batch():
+            start = time.perf_counter()
+            try:
+                batch_results = score_ncf_batch(model, records, [user_id for _, _, user_id, *_ in prepared])
+            except Exception as e:
+                batch_results = [e] * len(records)
+            seconds = time.perf_counter() - start
+            for future, job, result in zip(ncf_futures, prepared, batch_results):
+                job[1].record("ncf_batch", seconds)
+                job[1].count("ncf_batch_size", len(records))
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+        get_branch_executor().submit(score_batch)
+
+    pending = []
+    for (position, timings, user_id, ratings, genres, decades, key), ncf_future, candidates in zip(prepared, ncf_futures, shared_candidates):
+        with request_timings(timings):
+            try:
+                started_at = time.monotonic()
+                branches = submit_branches(user_id, ratings, genres, decades, model, ncf_future, candidates)
+                pending.append((position, timings, user_id, key, branches, started_at))
+            except Exception as e:
+                results[position] = e
+
+    for position, timings, user_id, key, branches, started_at in pending:
+        with request_timings(timings):
+            try:
+                results[position] = collect_branches(branches, started_at)
+                # Partial results are not cached so the next request gets another chance
+                if key is not None and not results[position].get("partial"):
+                    with stage("cache"):
+                        cache.put(key, results[position], user_id, generations[position])
+            except Exception as e:
+                results[position] = e
+
+    return results
+
+###############################################################################
+# WORKER MODE
+###############################################################################
+
+def handle_worker_request(request, model, state):
+    """
+    Handle a single control request received by the resident worker.
+    Recommendation requests never come here, serve() queues them on the
+    MicroBatcher, which applies their deadlines and back-pressure.
+    Args:
+        request: Decoded request dictionary with an "op" field.
+        model: Loaded NCF model shared by all requests.
+        state: Dictionary with worker state (start time, served requests, histograms, profiler).
+    Returns:
+        Result dictionary for the request.
+    """
+    op = request.get("op")
+
+    if op == "health":
+        anonymous = anonymous_rss_mb()
+        return {
+            "status": "ready",
+            "pid": os.getpid(),
+            "uptime": time.time() - state["started_at"],
+            "requests_served": state["requests_served"],
+            "cache": get_result_cache().stats() if get_result_cache() is not None else None,
+            "startup": state["startup"],
+            "rss_mb": round(current_rss_mb(), 1),
+            # Excludes the memory-mapped store, weights and indexes shared by all workers
+            "anonymous_rss_mb": round(anonymous, 1) if anonymous is not None else None,
+            "profiles_dumped": state["profiler"].dumped,
+            "scheduler": state["scheduler"].stats() if "scheduler" in state else None,
+            "user_embeddings": get_user_embeddings(model).stats() if get_user_embeddings(model) else None,
+        }
+
+    if op == "invalidate":
+        cache = get_result_cache()
+        if cache is None:
+            return {"removed": 0}
+        if request.get("user_id") is None:
+            cache.clear()
+            return {"removed": "all"}
+        return {"removed": cache.invalidate_user(request["user_id"])}
+
+    if op == "update_ratings":
+        # Ratings added, changed (a rating) or removed (null) through the app, applied as deltas
+        if request.get("user_id") is None:
+            raise ValueError("user_id is required to update ratings")
+        # All current ratings of the user make them a UBCF neighbour for other users
+        if request.get("all_ratings"):
+            _, _, delta = get_ubcf_data()
+            fold_in_app_user(delta, request["user_id"], parse_ratings(request["all_ratings"]))
+        user_embeddings = get_user_embeddings(model)
+        if user_embeddings is None:
+            return {"enabled": False}
+        rated = user_embeddings.update(request["user_id"], request.get("ratings") or {})
+        return {"enabled": True, "rated_items": rated}
+
+    if op == "cache_stats":
+        cache = get_result_cache()
+        return cache.stats() if cache is not None else {"enabled": False}
+
+    if op == "metrics":
+        gauges = scheduler_metrics(state["scheduler"]) if "scheduler" in state else None
+        return {"prometheus": state["histograms"].render({"pid": os.getpid()}, gauges)}
+
+    raise ValueError(f"Unknown worker operation: {op}")
+
+def prepare_artifacts():
+    """
+    Compile everything the workers memory-map: the ratings store, the per-user
+    UBCF statistics, the movie index and the item statistics. Workers started afterwards only attach
+    to these files, and share their pages through the page cache.
+    Returns:
+        Dictionary with the load timings and the state of the optional artifacts.
+    """
+    with request_timings() as timings:
+        model = load_model()
+        with stage("data_load"):
+            store = get_ratings_store()
+            get_ubcf_index()
+            get_movie_index()
+            get_item_stats()
+
+    return {
+        "timings": timings.as_dict(),
+        "ratings_store": store.path,
+        # False means the checkpoint was restored with TensorFlow, see python ncf_scoring.py
+        "weights_bundle": isinstance(model, ExportedModel),
+        "mips_index": os.path.exists(MIPS_INDEX_FILE.format(precision=get_scoring_engine(model).precision)),
+        "ubcf_ann_index": os.path.exists(ann_index_path(store)),
+        "icf_index": os.path.exists(icf_index_path(store)),
+    }
+
+def scheduler_metrics(batcher):
+    """
+    Prometheus samples of the worker scheduler.
+    Args:
+        batcher: MicroBatcher of the worker.
+    Returns:
+        List of (name, type, help, value) tuples for StageHistograms.render().
+    """
+    stats = batcher.stats()
+    return [
+        ("recommendation_queue_depth", "gauge", "Recommend requests waiting for a batch.", stats["queue_depth"]),
+        ("recommendation_queue_depth_max", "gauge", "Largest number of waiting requests seen.", stats["max_queue_depth"]),
+        ("recommendation_batches_total", "counter", "Batches of recommend requests served.", stats["batches"]),
+        ("recommendation_batched_requests_total", "counter", "Recommend requests served in batches.", stats["batched_requests"]),
+        ("recommendation_rejected_total", "counter", "Requests rejected because the queue was full.", stats["rejected"]),
+        ("recommendation_expired_total", "counter", "Requests whose deadline passed while queued.", stats["expired"]),
+    ]
+
+def run_worker():
+    """
+    Serve recommendation requests over a stdin/stdout JSON-lines protocol.
+
+    The model and id maps are loaded once. Every input line is a JSON object
+    {"id": ..., "op": "recommend" | "health" | "invalidate" | "update_ratings" | "cache_stats" | "metrics" | "shutdown", ...}
+    and every output line is {"id": ..., "ok": bool, "result" | "error": ...}.
+    Answers to "recommend" also carry a "timings" block with the wall time of
+    every stage, candidate counts and memory use. A {"type": "ready"} line is
+    written once loading has finished.
+
+    Several requests may be in flight; answers come back in completion order.
+    Recommend requests are micro-batched (see get_recommendations_batch()),
+    other operations are answered right away. A recommend request may carry
+    "deadline_ms"; rejected requests have "code": "overloaded" in their answer.
+    """
+    # Keep stdout reserved for protocol messages, diagnostics go to stderr
+    protocol_out = sys.stdout
+    sys.stdout = sys.stderr
+
+    def send(message):
+        protocol_out.write(json.dumps(message) + "\n")
+        protocol_out.flush()
+
+    def send_result(request_id, body, timings=None):
+        # The result is serialized beforehand so its cost shows up in the timings
+        extra = f', "timings": {json.dumps(timings)}' if timings is not None else ""
+        protocol_out.write(f'{{"id": {json.dumps(request_id)}, "ok": true, "result": {body}{extra}}}\n')
+        protocol_out.flush()
+
+    # kill -USR1 <pid> dumps the stack of every thread to stderr
+    if hasattr(signal, 'SIGUSR1'):
+        faulthandler.register(signal.SIGUSR1, file=sys.__stderr__, all_threads=True)
+
+    try:
+        with request_timings() as startup:
+            model = load_model()
+            with stage("data_load"):
+                get_ubcf_index()
+                get_movie_index()
+            if NCF_RETRIEVAL in ('mips', 'hybrid'):
+                with stage("retrieval_index"):
+                    get_mips_index(model)
+            if get_result_cache() is not None:
+                get_data_version(model)
+    except Exception as e:
+        traceback.print_exc(file=sys.stderr)
+        send({"type": "error", "error": str(e)})
+        sys.exit(1)
+
+    if RECOMMENDATION_TRACE_MEMORY:
+        tracemalloc.start()
+
+    state = {
+        "started_at": time.time(),
+        "requests_served": 0,
+        "startup": startup.as_dict(),
+        "histograms": StageHistograms(),
+        "profiler": SlowRequestProfiler(RECOMMENDATION_PROFILE_SLOW_MS, RECOMMENDATION_PROFILE_DIR),
+    }
+    print(f"Worker startup timings: {json.dumps(state['startup'])}", file=sys.stderr)
+    send({"type": "ready", "pid": os.getpid()})
+
+    def process_batch(jobs):
+        # Runs on the batch thread; answers are serialized here so the event loop only writes them
+        for _, timings in jobs:
+            timings.record("queue_wait", timings.total)
+        with state["profiler"].profile(f"batch-{jobs[0][0].get('id')}"):
+            results = get_recommendations_batch(jobs, model)
+        bodies = []
+        for (_, timings), result in zip(jobs, results):
+            if isinstance(result, Exception):
+                bodies.append(result)
+                continue
+            with timings.stage("serialization"):
+                bodies.append(json.dumps(result))
+        return bodies
+
+    batcher = MicroBatcher(
+        process_batch, RECOMMENDATION_BATCH_WINDOW_MS, RECOMMENDATION_BATCH_SIZE, RECOMMENDATION_QUEUE_LIMIT,
+        ThreadPoolExecutor(1, thread_name_prefix="batch")
+    )
+    state["scheduler"] = batcher
+
+    async def recommend(request):
+        request_id = request.get("id")
+        timings = RequestTimings()
+        deadline_ms = float(request.get("deadline_ms") or RECOMMENDATION_DEADLINE_MS)
+        try:
+            future = batcher.submit((request, timings), time.monotonic() + deadline_ms / 1000)
+            body = await asyncio.wait_for(future, deadline_ms / 1000)
+        except QueueFullError as e:
+            send({"id": request_id, "ok": False, "error": str(e), "code": "overloaded"})
+            return
+        except asyncio.TimeoutError as e:
+            send({"id": request_id, "ok": False, "error": str(e) or f"Request exceeded its deadline of {deadline_ms:g} ms"})
+            return
+        except Exception as e:
+            send({"id": request_id, "ok": False, "error": str(e)})
+            return
+
+        state["requests_served"] += 1
+        state["histograms"].observe(timings)
+        send_result(request_id, body, timings.as_dict())
+        if RECOMMENDATION_METRICS_DIR:
+            state["histograms"].write(RECOMMENDATION_METRICS_DIR, {"pid": os.getpid()}, gauges=scheduler_metrics(batcher))
+
+    async def serve():
+        loop = asyncio.get_running_loop()
+        batches = asyncio.create_task(batcher.run())
+        in_flight = set()
+        # Blocking reads stay off the event loop, which works for pipes and files alike
+        reader = ThreadPoolExecutor(1, thread_name_prefix="stdin")
+
+        while True:
+            line = await loop.run_in_executor(reader, sys.stdin.readline)
+            if not line:
+                break
+            line = line.strip()
+            if not line:
+                continue
+
+            request_id = None
+            try:
+                request = json.loads(line)
+                request_id = request.get("id")
+                op = request.get("op", "recommend")
+                if op == "shutdown":
+                    send({"id": request_id, "ok": True, "result": {"status": "stopping"}})
+                    break
+                if op != "recommend":
+                    send({"id": request_id, "ok": True, "result": handle_worker_request(request, model, state)})
+                    continue
+                task = asyncio.create_task(recommend(request))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+            except Exception as e:
+                traceback.print_exc(file=sys.stderr)
+                send({"id": request_id, "ok": False, "error": str(e)})
+
+        # Answer everything that was accepted before exiting
+        batcher.stop()
+        await batches
+        if in_flight:
+            await asyncio.gather(*in_flight)
+        reader.shutdown(wait=False)
+
+    asyncio.run(serve())
+
+###############################################################################
+# BATCH MODE
+###############################################################################
+
+def _init_ubcf_process():
+    """Prepare the UBCF and ICF data once in every batch pool process."""
+    get_ubcf_index()
+    get_movie_index()
+    if "icf" in RECOMMENDATION_SOURCES:
+        get_icf_index()
+
+def _ubcf_batch_task(task):
+    """Run UBCF for one batch record inside a pool process."""
+    user_id, ratings, genre_preferences, decade_preferences, candidates = task
+    return get_recommendations_ubcf(user_id, ratings, genre_preferences, decade_preferences, candidates)
+
+def _icf_batch_task(task):
+    """Run ICF for one batch record inside a pool process."""
+    _, ratings, genre_preferences, decade_preferences, _ = task
+    return get_recommendations_icf(ratings, genre_preferences, decade_preferences)
+
+def read_completed_keys(output_file):
+    """
+    Collect the record keys already written to a batch output file.
+
+    A trailing line cut off by a crash is removed from the file, so that
+    record is computed again when the job is resumed.
+    Args:
+        output_file: Path of the JSONL output.
+    Returns:
+        Set of completed record keys.
+    """
+    completed = set()
+    if not os.path.exists(output_file):
+        return completed
+
+    good_bytes = 0
+    with open(output_file, 'rb') as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                completed.add(json.loads(line)["key"])
+            except (ValueError, KeyError):
+                break
+            good_bytes += len(line)
+
+    if good_bytes < os.path.getsize(output_file):
+        print(f"Dropping incomplete output after byte {good_bytes}", file=sys.stderr)
+        with open(output_file, 'r+b') as f:
+            f.truncate(good_bytes)
+    return completed
+
+def score_ncf_batch(model, records, user_ids=None):
+    """
+    NCF recommendations for several cold-start users at once.
+
+    Users are stacked into embedding matrices. When their candidate lists
+    overlap enough, the union of candidates is scored for all of them in one
+    pass; otherwise each user's list is scored on its own to avoid scoring
+    pairs nobody needs.
+    Args:
+        model: NCF model.
+        records: List of (ratings, genres, decades, candidates) tuples; candidates is the
+            shared candidate set of the record, or None to retrieve it here.
+        user_ids: App user ID of every record, for their stored vectors.
+    Returns:
+        List with the NCF recommendations of each record, or the exception raised for it.
+    """
+    engine = get_scoring_engine(model)
+    results = [None] * len(records)
+    users = []
+    heuristic_candidates = {}
+    exhaustive_groups = {}
+
+    for position, (ratings, genre_preferences, decade_preferences, shared) in enumerate(records):
+        try:
+            user_embeddings = create_user_embedding_from_items(model, ratings, user_ids[position] if user_ids else None)
+            if not user_embeddings:
+                # Not enough signal: none of the rated items is known to the model
+                results[position] = get_popular_recommendations(ratings, genre_preferences, decade_preferences)
+                continue
+            gmf_embed, mlp_embed = user_embeddings
+
+            if NCF_RETRIEVAL == 'exhaustive':
+                # Users with the same preferences score the same items in one sharded pass
+                key = (tuple(genre_preferences or ()), tuple(decade_preferences or ()))
+                exhaustive_groups.setdefault(key, []).append((position, gmf_embed, mlp_embed))
+                continue
+
+            # Heuristic retrieval depends only on the preferences
+            if NCF_RETRIEVAL == 'heuristic':
+                key = (tuple(genre_preferences or ()), tuple(decade_preferences or ()))
+                if key not in heuristic_candidates:
+                    heuristic_candidates[key] = retrieve_candidates(model, gmf_embed, genre_preferences, decade_preferences, shared)
+                candidates = heuristic_candidates[key]
+            else:
+                candidates = retrieve_candidates(model, gmf_embed, genre_preferences, decade_preferences, shared)
+
+            item_codes = model.item2id.codes(candidates)
+            users.append((position, gmf_embed, mlp_embed, candidates, item_codes))
+        except Exception as e:
+            results[position] = e
+
+    for (genre_preferences, decade_preferences), group in exhaustive_groups.items():
+        try:
+            allowed = preference_item_mask(list(genre_preferences), list(decade_preferences))
+            ranked = rank_items_sharded(
+                model,
+                np.stack([user[1] for user in group]),
+                np.stack([user[2] for user in group]),
+                None if allowed is None else np.flatnonzero(allowed)
             )
+            for (position, *_), recommendations in zip(group, ranked):
+                results[position] = recommendations
         except Exception as e:
-            print(f"Error in batch prediction: {str(e)}", file=sys.stderr)
-        
-        user_for_prediction = 0  # Placeholder for cold start user
-        items_to_score = ncf_candidates
-    
-    # Create recommendation dataframe
-    recs_df = pd.DataFrame({
-        "userID": [user_for_prediction] * len(items_to_score),
-        "itemID": items_to_score,
-        "prediction": predictions
-    }).sort_values(by="prediction", ascending=False).head(TOP_K)
+            for position, *_ in group:
+                results[position] = e
 
-    #2B USER-BASED CF PHASE
-    ubcf_recs = get_recommendations_ubcf(user_id, new_user_ratings, genre_preferences, decade_preferences)
+    if not users:
+        return results
 
-    
-    return{"ncf_recommendations": recs_df.to_dict(orient='records'),
-            "cf_recommendations": ubcf_recs}
+    known_codes = [item_codes[item_codes >= 0] for *_, item_codes in users]
+    union = np.unique(np.concatenate(known_codes))
+    needed_pairs = sum(len(codes) for codes in known_codes)
+    if needed_pairs * 2 >= len(union) * len(users):
+        gmf_embeds = np.stack([user[1] for user in users])
+        mlp_embeds = np.stack([user[2] for user in users])
+        union_scores = engine.score_many(gmf_embeds, mlp_embeds, union)
+    else:
+        union_scores = None
+
+    for row, (position, gmf_embed, mlp_embed, candidates, item_codes) in enumerate(users):
+        known = item_codes >= 0
+        predictions = np.zeros(len(candidates), dtype=np.float64)
+        if known.any():
+            if union_scores is not None:
+                predictions[known] = union_scores[row, np.searchsorted(union, item_codes[known])]
+            else:
+                predictions[known] = engine.score(gmf_embed, mlp_embed, item_codes[known])
+        results[position] = top_k_recommendations(candidates, predictions.tolist())
+
+    return results
+
+def run_batch(input_file, output_file, processes=None, chunk_size=BATCH_CHUNK_SIZE):
+    """
+    Score a JSONL stream of {user_id, ratings, genres, decades} records.
+
+    Every output line is {"key", "user_id", "ok", "result" | "error"} where
+    key is the user_id, or "line:<n>" for records without one. Output is
+    appended and flushed per chunk, so an interrupted job continues where it
+    stopped when started again with the same output file.
+    Args:
+        input_file: JSONL input path, or "-" for stdin.
+        output_file: JSONL output path, or "-" for stdout (no resume).
+        processes: UBCF and ICF pool size, 1 runs them in this process. Defaults to the CPU count.
+        chunk_size: Records scored together by NCF.
+    """
+    sources = [source for source in SOURCE_KEYS if source in RECOMMENDATION_SOURCES]
+    if not sources:
+        raise ValueError(f"No known recommender in RECOMMENDATION_SOURCES: {RECOMMENDATION_SOURCES}")
+
+    # Keep stdout reserved for results, diagnostics go to stderr
+    results_out = sys.stdout
+    sys.stdout = sys.stderr
+
+    processes = processes or os.cpu_count() or 1
+    executor = None
+    if processes > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        # Fork before the model session exists; the memory-mapped ratings are shared
+        executor = ProcessPoolExecutor(
+            processes, mp_context=multiprocessing.get_context('fork'), initializer=_init_ubcf_process
+        )
+        for future in [executor.submit(os.getpid) for _ in range(processes)]:
+            future.result()
+    else:
+        _init_ubcf_process()
+
+    model = load_model() if "ncf" in sources else None
+    if model is not None and NCF_RETRIEVAL in ('mips', 'hybrid'):
+        get_mips_index(model)
+
+    completed = set()
+    if output_file != '-':
+        completed = read_completed_keys(output_file)
+        if completed:
+            print(f"Resuming batch: {len(completed)} records already done", file=sys.stderr)
+
+    total = None
+    if input_file != '-':
+        with open(input_file) as f:
+            total = sum(1 for line in f if line.strip())
+
+    source = sys.stdin if input_file == '-' else open(input_file)
+    out = results_out if output_file == '-' else open(output_file, 'a')
+    started_at = time.time()
+    state = {"seen": 0, "written": 0, "failed": 0}
+
+    def flush_chunk(chunk):
+        keys, user_ids, tasks = zip(*chunk)
+        if "ncf" in sources or "ubcf" in sources:
+            shared_candidates = retrieve_batch_candidates([task[2:] for task in tasks])
+        else:
+            shared_candidates = [None] * len(tasks)
+        tasks = [task + (candidates,) for task, candidates in zip(tasks, shared_candidates)]
+
+        # UBCF and ICF run in the pool while NCF scores the chunk here
+        run = executor.map if executor is not None else map
+        source_results = {}
+        if "ubcf" in sources:
+            source_results["ubcf"] = run(_ubcf_batch_task, tasks)
+        if "icf" in sources:
+            source_results["icf"] = run(_icf_batch_task, tasks)
+        if "ncf" in sources:
+            source_results["ncf"] = score_ncf_batch(model, [task[1:] for task in tasks])
+        source_results = {source: list(results) for source, results in source_results.items()}
+
+        for position, (key, user_id) in enumerate(zip(keys, user_ids)):
+            recommendations = {source: source_results[source][position] for source in sources}
+            error = next((r for r in recommendations.values() if isinstance(r, Exception)), None)
+            if error is not None:
+                line = {"key": key, "user_id": user_id, "ok": False, "error": str(error)}
+                state["failed"] += 1
+            else:
+                result = {SOURCE_KEYS[source]: recommendations[source] for source in sources}
+                result["fused_recommendations"] = fuse_recommendations(recommendations)
+                line = {"key": key, "user_id": user_id, "ok": True, "result": result}
+            out.write(json.dumps(line) + "\n")
+        out.flush()
+        if out is not results_out:
+            os.fsync(out.fileno())
+
+        state["written"] += len(chunk)
+        elapsed = time.time() - started_at
+        rate = state["written"] / elapsed if elapsed > 0 else 0.0
+        progress = f"{state['seen']}/{total}" if total is not None else f"{state['seen']}"
+        eta = f", ETA {(total - state['seen']) / rate:.0f}s" if total is not None and rate > 0 else ""
+        print(f"Batch progress: {progress} records, {rate:.1f} users/s{eta}", file=sys.stderr)
+
+    try:
+        chunk = []
+        for line_number, line in enumerate(source, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            state["seen"] += 1
+
+            try:
+                record = json.loads(line)
+                user_id = record.get("user_id")
+                key = str(user_id) if user_id is not None else f"line:{line_number}"
+                if key in completed:
+                    continue
+                ratings = record.get("ratings")
+                if not ratings:
+                    raise ValueError("Batch records must contain ratings")
+                ratings = json.loads(ratings) if isinstance(ratings, str) else ratings
+                ratings = {int(k): float(v) for k, v in ratings.items()}
+            except Exception as e:
+                if f"line:{line_number}" not in completed:
+                    out.write(json.dumps({"key": f"line:{line_number}", "user_id": None, "ok": False, "error": str(e)}) + "\n")
+                    state["failed"] += 1
+                continue
+
+            chunk.append((key, user_id, (user_id, ratings, record.get("genres") or None, record.get("decades") or None)))
+            if len(chunk) >= chunk_size:
+                flush_chunk(chunk)
+                chunk = []
+
+        if chunk:
+            flush_chunk(chunk)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if source is not sys.stdin:
+            source.close()
+        if out is not results_out:
+            out.close()
+
+    print(f"Batch finished: {state['written']} records written, {state['failed']} failed, "
+          f"{len(completed)} skipped in {time.time() - started_at:.1f}s", file=sys.stderr)
 
 ###############################################################################
 # MAIN EXEC
@@ -558,8 +1909,26 @@ if __name__ == "__main__":
     parser.add_argument('--ratings', type=str, help='JSON string with item IDs and ratings')
     parser.add_argument('--genres', type=str, help='JSON string with genre preferences')
     parser.add_argument('--decade', type=str, help='JSON string with decade preferences')
+    parser.add_argument('--worker', action='store_true', help='Run as a resident worker reading JSON-lines requests from stdin')
+    parser.add_argument('--prepare', action='store_true', help='Compile the memory-mapped artifacts shared by the workers and exit')
+    parser.add_argument('--batch', type=str, help='JSONL file ("-" for stdin) of {user_id, ratings, genres, decades} records')
+    parser.add_argument('--output', type=str, default='-', help='JSONL file for batch results, appended to and resumed from')
+    parser.add_argument('--processes', type=int, default=None, help='Processes used for UBCF and ICF in batch mode')
+    parser.add_argument('--chunk_size', type=int, default=BATCH_CHUNK_SIZE, help='Users scored together in batch mode')
     
     args = parser.parse_args()
+
+    if args.worker:
+        run_worker()
+        sys.exit(0)
+
+    if args.batch:
+        run_batch(args.batch, args.output, args.processes, args.chunk_size)
+        sys.exit(0)
+
+    if args.prepare:
+        print(json.dumps(prepare_artifacts()), flush=True)
+        sys.exit(0)
     
     # Ensure either user_id or ratings are provided
     if not args.user_id and not args.ratings:
@@ -575,10 +1944,16 @@ if __name__ == "__main__":
     if args.decade:
         decade_preferences = json.loads(args.decade)
 
+    if RECOMMENDATION_TRACE_MEMORY:
+        tracemalloc.start()
+
     try:
-        # Generate recommendations and output as JSON
-        recommendations = get_recommendations(args.user_id, args.ratings, genre_preferences, decade_preferences)
-        print(json.dumps(recommendations), flush=True)
+        # Generate recommendations and output as JSON, followed by the timings of every stage
+        with request_timings() as timings:
+            recommendations = get_recommendations(args.user_id, args.ratings, genre_preferences, decade_preferences)
+            with stage("serialization"):
+                body = json.dumps(recommendations)
+        print(f'{body[:-1]}, "timings": {json.dumps(timings.as_dict())}}}', flush=True)
     except Exception as e:
         traceback.print_exc(file=sys.stderr)
         print(json.dumps({"error": str(e)}), flush=True)
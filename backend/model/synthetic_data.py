@@ -0,0 +1,218 @@
+import json
+import sys
+import os
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from config import PROJECT_ROOT
+
+##############################################################################
+# INITIALIZATION
+##############################################################################
+
+# Dataset shapes modelled on the MovieLens releases: (users, movies, ratings)
+SCALES = {
+    '100k': (610, 9_742, 100_836),
+    '1m': (6_040, 3_706, 1_000_209),
+    '32m': (200_948, 87_585, 32_000_204),
+}
+
+# Genre vocabulary of movies.csv
+GENRES = [
+    'Action', 'Adventure', 'Animation', 'Children', 'Comedy', 'Crime', 'Documentary', 'Drama',
+    'Fantasy', 'Film-Noir', 'Horror', 'IMAX', 'Musical', 'Mystery', 'Romance', 'Sci-Fi',
+    'Thriller', 'War', 'Western'
+]
+
+# Default location of generated datasets
+SYNTHETIC_DIR = os.path.join(PROJECT_ROOT, "model_training/synthetic/")
+
+# Users written to the CSV at once
+USER_BLOCK = 20_000
+
+# Draws per planned rating, repeated (user, movie) pairs are dropped afterwards
+OVERSAMPLING = 2.5
+
+##############################################################################
+# GENERATOR
+##############################################################################
+
+def generate_movies(n_movies, rng):
+    """
+    MovieLens-shaped movie metadata.
+    Args:
+        n_movies: Number of movies.
+        rng: numpy Generator.
+    Returns:
+        DataFrame with movieId, title and genres columns.
+    """
+    # Sparse, increasing IDs like the real catalogue
+    movie_ids = np.sort(rng.choice(np.arange(1, 3 * n_movies + 1), n_movies, replace=False))
+
+    # Release years skewed towards recent decades; a few titles have no year
+    years = np.clip(np.round(2023 - rng.gamma(2.0, 9.0, n_movies)), 1902, 2023).astype(int)
+    has_year = rng.random(n_movies) > 0.01
+
+    genre_weights = rng.dirichlet(np.full(len(GENRES), 0.8))
+    genre_counts = np.clip(rng.poisson(1.3, n_movies) + 1, 1, 5)
+    genres = [
+        '|'.join(sorted(rng.choice(GENRES, count, replace=False, p=genre_weights)))
+        for count in genre_counts
+    ]
+    genres = [g if rng.random() > 0.005 else '(no genres listed)' for g in genres]
+
+    titles = [
+        f"Synthetic Movie {movie_id} ({year})" if dated else f"Synthetic Movie {movie_id}"
+        for movie_id, year, dated in zip(movie_ids, years, has_year)
+    ]
+    return pd.DataFrame({'movieId': movie_ids, 'title': titles, 'genres': genres})
+
+def generate_ratings(train_file, movie_ids, n_users, n_ratings, rng):
+    """
+    Stream MovieLens-shaped ratings to a CSV.
+
+    Activity per user and popularity per movie follow power laws, every user
+    has at least 20 ratings, and ratings are half stars built from user and
+    movie biases plus noise.
+    Args:
+        train_file: Destination CSV (userID, itemID, rating, timestamp).
+        movie_ids: Movie IDs to rate.
+        n_users: Number of users.
+        n_ratings: Approximate number of ratings.
+        rng: numpy Generator.
+    Returns:
+        Number of ratings written.
+    """
+    n_movies = len(movie_ids)
+
+    activity = rng.pareto(1.2, n_users) + 1
+    counts = 20 + np.floor(activity / activity.sum() * max(n_ratings - 20 * n_users, 0)).astype(np.int64)
+    counts = np.minimum(counts, n_movies)
+
+    popularity = 1.0 / np.arange(1, n_movies + 1) ** 0.9
+    popularity = popularity[rng.permutation(n_movies)]
+    cumulative = np.cumsum(popularity / popularity.sum())
+    movie_bias = rng.normal(0, 0.5, n_movies)
+
+    written = 0
+    with open(train_file, 'w') as f:
+        f.write('userID,itemID,rating,timestamp\n')
+        for lo in range(0, n_users, USER_BLOCK):
+            block_counts = counts[lo:lo + USER_BLOCK]
+            block_users = np.arange(lo, lo + len(block_counts), dtype=np.int64)
+
+            # Oversample popular movies, then drop repeated (user, movie) pairs
+            owners = np.repeat(block_users, np.ceil(block_counts * OVERSAMPLING).astype(np.int64))
+            draws = np.minimum(np.searchsorted(cumulative, rng.random(len(owners))), n_movies - 1)
+            pairs = np.unique(owners * n_movies + draws)
+            pair_users, pair_movies = pairs // n_movies, pairs % n_movies
+
+            # Keep a random subset of the planned size per user
+            order = np.lexsort((rng.random(len(pairs)), pair_users))
+            pair_users, pair_movies = pair_users[order], pair_movies[order]
+            starts = np.searchsorted(pair_users, block_users)
+            ranks = np.arange(len(pair_users)) - starts[pair_users - lo]
+            keep = ranks < counts[pair_users]
+            pair_users, pair_movies = pair_users[keep], pair_movies[keep]
+
+            user_bias = rng.normal(3.5, 0.45, len(block_counts))
+            scores = user_bias[pair_users - lo] + movie_bias[pair_movies] + rng.normal(0, 0.8, len(pair_users))
+            ratings = np.clip(np.round(scores * 2) / 2, 0.5, 5.0)
+            timestamps = rng.integers(946_684_800, 1_697_000_000, len(pair_users))
+
+            block = pd.DataFrame({
+                'userID': pair_users + 1,
+                'itemID': movie_ids[pair_movies],
+                'rating': ratings,
+                'timestamp': timestamps,
+            })
+            block.to_csv(f, header=False, index=False)
+            written += len(block)
+            print(f"Generated {written} ratings", file=sys.stderr)
+    return written
+
+def save_random_checkpoint(model_dir, n_users, n_items, seed=42):
+    """
+    Save a randomly initialised NeuMF checkpoint with the serving architecture.
+    Args:
+        model_dir: Destination directory.
+        n_users: Number of users in the training data.
+        n_items: Number of items in the training data.
+        seed: Initialisation seed.
+    """
+    from recommenders.models.ncf.ncf_singlenode import NCF
+
+    model = NCF(
+        n_users=n_users,
+        n_items=n_items,
+        model_type="NeuMF",
+        n_factors=128,
+        layer_sizes=[256, 128, 64],
+        n_epochs=1,
+        batch_size=8192,
+        learning_rate=0.001,
+        verbose=1,
+        seed=seed
+    )
+    os.makedirs(model_dir, exist_ok=True)
+    model.save(dir_name=model_dir)
+
+def generate_dataset(scale, output_dir, seed=42, checkpoint=True):
+    """
+    Generate movies.csv, train.csv and optionally a NeuMF checkpoint for a scale.
+    Args:
+        scale: Key of SCALES.
+        output_dir: Directory receiving the files.
+        seed: Random seed.
+        checkpoint: Also write a random checkpoint into output_dir/ncf_neuMF.
+    Returns:
+        Dictionary describing the generated dataset.
+    """
+    start = time.time()
+    n_users, n_movies, n_ratings = SCALES[scale]
+    rng = np.random.default_rng(seed)
+    os.makedirs(output_dir, exist_ok=True)
+
+    movies = generate_movies(n_movies, rng)
+    movies.to_csv(os.path.join(output_dir, 'movies.csv'), index=False)
+
+    train_file = os.path.join(output_dir, 'train.csv')
+    written = generate_ratings(train_file, movies['movieId'].to_numpy(), n_users, n_ratings, rng)
+
+    # The model is sized by the codes actually present in the ratings
+    header = pd.read_csv(train_file, usecols=['userID', 'itemID'])
+    n_users_seen, n_items_seen = header['userID'].nunique(), header['itemID'].nunique()
+    del header
+
+    if checkpoint:
+        save_random_checkpoint(os.path.join(output_dir, 'ncf_neuMF'), n_users_seen, n_items_seen, seed)
+
+    info = {
+        'scale': scale,
+        'seed': seed,
+        'users': int(n_users_seen),
+        'items': int(n_items_seen),
+        'movies': int(n_movies),
+        'ratings': int(written),
+        'checkpoint': checkpoint,
+    }
+    with open(os.path.join(output_dir, 'dataset.json'), 'w') as f:
+        json.dump(info, f, indent=2)
+    print(f"Generated {scale} dataset in {time.time() - start:.1f}s: {output_dir}", file=sys.stderr)
+    return info
+
+###############################################################################
+# MAIN EXEC
+###############################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate a synthetic MovieLens-shaped dataset')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='100k', help='Dataset size')
+    parser.add_argument('--output_dir', type=str, default=None, help='Output directory (default: model_training/synthetic/<scale>)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed')
+    parser.add_argument('--no_checkpoint', action='store_true', help='Skip the random NeuMF checkpoint (no TensorFlow needed)')
+
+    args = parser.parse_args()
+    output_dir = args.output_dir or os.path.join(SYNTHETIC_DIR, args.scale)
+    print(json.dumps(generate_dataset(args.scale, output_dir, args.seed, not args.no_checkpoint)))
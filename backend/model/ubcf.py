@@ -0,0 +1,271 @@
+import sys
+import os
+import zipfile
+import numpy as np
+from scipy import sparse
+from ratings_store import open_npz
+
+##############################################################################
+# INITIALIZATION
+##############################################################################
+
+# Neighbourhood settings for User-Based CF
+NEIGHBOURS_K = 20  # Number of neighbours used for prediction
+SHRINKAGE_LAMBDA = 10  # Regularization constant for similarity shrinkage
+MIN_SHARD_ROWS = 20000  # Smallest row block worth scoring on its own thread
+
+# File name of the per-user statistics inside a ratings store version directory
+UBCF_STATS_FILE = 'ubcf_stats.npz'
+
+##############################################################################
+# UBCF INDEX
+##############################################################################
+
+def row_sums(indptr, values):
+    """
+    Sum values per CSR row in float64.
+    Args:
+        indptr: CSR row pointer.
+        values: Per-entry values aligned with the CSR data.
+    Returns:
+        float64 array with one sum per row (0 for empty rows).
+    """
+    counts = np.diff(indptr)
+    sums = np.zeros(len(counts), dtype=np.float64)
+    nonempty = counts > 0
+    if nonempty.any():
+        sums[nonempty] = np.add.reduceat(values, indptr[:-1][nonempty], dtype=np.float64)
+    return sums
+
+class FoldedUser:
+    """
+    A user that is not part of the ratings matrix, expressed in its item codes.
+    Attributes:
+        item_codes: Codes of rated items known to the matrix.
+        centered: Mean-centered ratings for item_codes (float64).
+        mean: Mean over all of the user's ratings, unknown items included.
+        norm: L2 norm of the full mean-centered rating vector.
+    """
+
+    def __init__(self, item_codes, centered, mean, norm):
+        self.item_codes = item_codes
+        self.centered = centered
+        self.mean = mean
+        self.norm = norm
+
+class UBCFIndex:
+    """
+    Per-user statistics of the ratings matrix needed by User-Based CF.
+
+    Means and the norms of the mean-centered rows are computed once from
+    indptr/data, so a request only touches the columns the new user rated
+    and the rows of the selected neighbours.
+    """
+
+    def __init__(self, matrix, means=None, norms=None):
+        """
+        Args:
+            matrix: CSR users x items ratings matrix (may be memory-mapped).
+            means: Precomputed per-user means (see save_stats()), computed when omitted.
+            norms: Precomputed norms of the centered rows, computed when omitted.
+        """
+        self.matrix = matrix
+        self.n_users, self.n_items = matrix.shape
+        self.counts = np.diff(matrix.indptr)
+
+        if means is not None and norms is not None:
+            self.means, self.norms = means, norms
+            return
+
+        self.means = np.zeros(self.n_users, dtype=np.float64)
+        rated = self.counts > 0
+        self.means[rated] = row_sums(matrix.indptr, matrix.data)[rated] / self.counts[rated]
+
+        centered = matrix.data - np.repeat(self.means, self.counts)
+        self.norms = np.sqrt(row_sums(matrix.indptr, centered * centered))
+
+    def save_stats(self, path):
+        """
+        Atomically write the per-user means and norms as an uncompressed .npz file.
+        Args:
+            path: Destination file.
+        """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, means=self.means, norms=self.norms)
+        os.replace(tmp_path, path)
+
+    def fold_in(self, new_user_ratings, item2id):
+        """
+        Express a new user's ratings against the matrix.
+        Args:
+            new_user_ratings: Dictionary of {item_id: rating}.
+            item2id: Dictionary mapping item IDs to item codes.
+        Returns:
+            FoldedUser instance.
+        """
+        ratings = np.array(list(new_user_ratings.values()), dtype=np.float64)
+        mean = ratings.mean() if len(ratings) else 0.0
+        centered = ratings - mean
+
+        codes = np.array([item2id.get(int(iid), -1) for iid in new_user_ratings], dtype=np.int64)
+        known = codes >= 0
+        order = np.argsort(codes[known])
+        return FoldedUser(codes[known][order], centered[known][order], mean, np.sqrt(np.sum(centered * centered)))
+
+    def similarities(self, user, rows=None, executor=None, shards=1):
+        """
+        Shrunk cosine similarity on centered ratings between the user and every row.
+
+        Only the columns the user rated contribute to the dot products, so the
+        rated columns are sliced out once and yield both the dot products and
+        the number of co-rated items per row. A full scan can be split into
+        contiguous row blocks scored in parallel; scipy and numpy release the
+        GIL, so threads use several cores and the result is identical.
+        Args:
+            user: FoldedUser instance.
+            rows: Optional subset of rows to score (e.g. an ANN shortlist).
+            executor: Optional thread pool used to score row blocks of a full scan.
+            shards: Number of row blocks when an executor is given.
+        Returns:
+            Tuple of (float64 similarities, overlap counts), one entry per scored row.
+        """
+        if rows is not None:
+            return self._similarities(user, self.matrix[rows], self.means[rows], self.norms[rows])
+
+        shards = min(shards, self.n_users // MIN_SHARD_ROWS)
+        if executor is None or shards <= 1 or not len(user.item_codes):
+            return self._similarities(user, self.matrix, self.means, self.norms)
+
+        bounds = np.linspace(0, self.n_users, shards + 1).astype(np.int64)
+        blocks = executor.map(lambda block: self._block_similarities(user, *block), zip(bounds[:-1], bounds[1:]))
+        sims, overlaps = zip(*blocks)
+        return np.concatenate(sims), np.concatenate(overlaps)
+
+    def _block_similarities(self, user, lo, hi):
+        """Similarities of the rows lo..hi, viewing the CSR arrays without copying them."""
+        indptr = self.matrix.indptr
+        start, end = indptr[lo], indptr[hi]
+        block = sparse.csr_matrix(
+            (self.matrix.data[start:end], self.matrix.indices[start:end], indptr[lo:hi + 1] - start),
+            shape=(hi - lo, self.n_items), copy=False
+        )
+        return self._similarities(user, block, self.means[lo:hi], self.norms[lo:hi])
+
+    def _similarities(self, user, matrix, means, norms):
+        n_rows = matrix.shape[0]
+
+        sims = np.zeros(n_rows, dtype=np.float64)
+        if not len(user.item_codes):
+            return sims, np.zeros(n_rows, dtype=np.int64)
+
+        sub = matrix[:, user.item_codes].tocsr()
+        overlaps = np.diff(sub.indptr)
+        sub_rows = np.repeat(np.arange(n_rows), overlaps)
+        centered = (sub.data - means[sub_rows]) * user.centered[sub.indices]
+        dots = np.bincount(sub_rows, weights=centered, minlength=n_rows)
+
+        denominators = norms * user.norm
+        np.divide(dots, denominators, out=sims, where=denominators > 0)
+
+        # Apply shrinkage: shrunk = (n / (n + λ)) * ρ
+        sims *= overlaps / (overlaps + SHRINKAGE_LAMBDA)
+        return sims, overlaps
+
+    def top_neighbours(self, sims, k=NEIGHBOURS_K):
+        """
+        Select the k most similar rows with a positive similarity.
+        Args:
+            sims: Similarities of every row.
+            k: Number of neighbours.
+        Returns:
+            Tuple of (neighbour rows, neighbour weights).
+        """
+        # A trailing zero stands for the new user itself, as in the full-matrix version
+        candidates = np.argsort(-np.append(sims, 0.0))[:k]
+        candidates = candidates[candidates < self.n_users]
+        neighbours = candidates[sims[candidates] > 0]
+        return neighbours, sims[neighbours]
+
+    def prediction_terms(self, neighbours, weights, item_codes):
+        """
+        Numerators and denominators of the weighted average for a set of neighbours.
+
+        Terms of neighbours taken from different matrices can be added up
+        before calling predict_from_terms().
+        Args:
+            neighbours: Neighbour rows.
+            weights: Neighbour similarities.
+            item_codes: Item codes to predict.
+        Returns:
+            Tuple of (numerators, denominators), one entry per item.
+        """
+        item_codes = np.asarray(item_codes, dtype=np.int64)
+        if not len(neighbours) or not len(item_codes):
+            return np.zeros(len(item_codes)), np.zeros(len(item_codes))
+
+        # Dense K x items block of the neighbours' ratings
+        block = self.matrix[neighbours][:, item_codes].toarray().astype(np.float64)
+        rated = block != 0
+        deviations = np.where(rated, block - self.means[neighbours][:, None], 0.0)
+
+        return weights @ deviations, np.abs(weights) @ rated
+
+    def predict(self, user, neighbours, weights, item_codes):
+        """
+        Mean-centered weighted average of the neighbours' ratings.
+        Args:
+            user: FoldedUser instance.
+            neighbours: Neighbour rows.
+            weights: Neighbour similarities.
+            item_codes: Item codes to predict.
+        Returns:
+            Tuple of (item codes with a prediction, predictions clamped to [1, 5]).
+        """
+        numerators, denominators = self.prediction_terms(neighbours, weights, item_codes)
+        return predict_from_terms(user, item_codes, numerators, denominators)
+
+def predict_from_terms(user, item_codes, numerators, denominators):
+    """
+    Turn accumulated prediction terms into ratings.
+    Args:
+        user: FoldedUser instance.
+        item_codes: Item codes the terms belong to.
+        numerators: Sum of weighted deviations per item.
+        denominators: Sum of absolute weights of the neighbours who rated each item.
+    Returns:
+        Tuple of (item codes with a prediction, predictions clamped to [1, 5]).
+    """
+    item_codes = np.asarray(item_codes, dtype=np.int64)
+    has_prediction = denominators > 0
+    predictions = user.mean + numerators[has_prediction] / denominators[has_prediction]
+    return item_codes[has_prediction], np.clip(predictions, 1.0, 5.0)
+
+def ubcf_stats_path(store):
+    """Location of the per-user statistics of a ratings store version."""
+    return os.path.join(store.path, UBCF_STATS_FILE)
+
+def open_ubcf_index(store):
+    """
+    UBCFIndex of a ratings store with its per-user statistics memory-mapped
+    from the version directory, so workers share them instead of each
+    scanning the ratings. They are computed and saved on first use.
+    Args:
+        store: RatingsStore instance.
+    Returns:
+        UBCFIndex instance.
+    """
+    path = ubcf_stats_path(store)
+    try:
+        stats = open_npz(path)
+        if stats['means'].shape == (store.n_users,) and stats['norms'].shape == (store.n_users,):
+            return UBCFIndex(store.csr(), stats['means'], stats['norms'])
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        pass
+
+    index = UBCFIndex(store.csr())
+    try:
+        index.save_stats(path)
+    except OSError as e:
+        print(f"Error saving UBCF statistics: {str(e)}", file=sys.stderr)
+    return index
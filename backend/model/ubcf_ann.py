@@ -0,0 +1,238 @@
+import json
+import sys
+import os
+import argparse
+import time
+import numpy as np
+from ubcf import NEIGHBOURS_K, FoldedUser
+from ratings_store import open_npz
+
+##############################################################################
+# INITIALIZATION
+##############################################################################
+
+# File name of the index inside a ratings store version directory
+ANN_INDEX_FILE = 'ubcf_ann.npz'
+
+# Postings kept per item and sign of the centered rating
+DEFAULT_POSTINGS = 500
+
+##############################################################################
+# APPROXIMATE NEIGHBOUR INDEX
+##############################################################################
+
+class UBCFAnnIndex:
+    """
+    Impact-ordered inverted file over mean-centered, normalized user rows.
+
+    For every item it keeps the users whose normalized centered rating
+    contributes most to a positive cosine: the top postings with the largest
+    values (used when the query liked the item) and the ones with the most
+    negative values (used when the query disliked it). A query takes those
+    truncated lists for its rated items as a shortlist, which is then
+    re-ranked exactly with shrinkage by UBCFIndex. Work per query depends on
+    the number of rated items and the list length, not on the corpus size.
+    """
+
+    def __init__(self, positive_offsets, positive_users, negative_offsets, negative_users, store_version=None):
+        self.positive_offsets = positive_offsets
+        self.positive_users = positive_users
+        self.negative_offsets = negative_offsets
+        self.negative_users = negative_users
+        self.store_version = store_version
+
+    @classmethod
+    def build(cls, ubcf_index, postings=DEFAULT_POSTINGS, store_version=None):
+        """
+        Build the index from every row of a UBCFIndex.
+        Args:
+            ubcf_index: UBCFIndex with means and norms of the ratings matrix.
+            postings: Users kept per item for each sign.
+            store_version: Version of the ratings store the index belongs to.
+        Returns:
+            UBCFAnnIndex instance.
+        """
+        matrix = ubcf_index.matrix
+        rows = np.repeat(np.arange(ubcf_index.n_users, dtype=np.int32), ubcf_index.counts)
+        scale = np.divide(1.0, ubcf_index.norms, out=np.zeros(ubcf_index.n_users), where=ubcf_index.norms > 0)
+        impact = ((matrix.data - ubcf_index.means[rows]) * scale[rows]).astype(np.float32)
+
+        # Postings grouped by item, strongest positive impact first
+        order = np.lexsort((-impact, matrix.indices))
+        items = np.asarray(matrix.indices)[order]
+        users = rows[order]
+        impact = impact[order]
+        del rows, order
+
+        item_offsets = np.zeros(ubcf_index.n_items + 1, dtype=np.int64)
+        np.cumsum(np.bincount(items, minlength=ubcf_index.n_items), out=item_offsets[1:])
+        starts, ends = item_offsets[:-1], item_offsets[1:]
+
+        def keep(lo, hi, signs):
+            lengths = np.clip(hi - lo, 0, None)
+            offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=offsets[1:])
+            positions = np.repeat(lo - offsets[:-1], lengths) + np.arange(offsets[-1])
+            selected = signs(impact[positions])
+            kept = np.bincount(np.repeat(np.arange(len(lengths)), lengths)[selected], minlength=len(lengths))
+            offsets[1:] = np.cumsum(kept)
+            return offsets, users[positions[selected]].astype(np.int32)
+
+        positive_offsets, positive_users = keep(starts, np.minimum(ends, starts + postings), lambda v: v > 0)
+        negative_offsets, negative_users = keep(np.maximum(starts, ends - postings), ends, lambda v: v < 0)
+        return cls(positive_offsets, positive_users, negative_offsets, negative_users, store_version)
+
+    def save(self, path):
+        """
+        Atomically write the index as an uncompressed .npz file.
+        Args:
+            path: Destination file.
+        """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                positive_offsets=self.positive_offsets,
+                positive_users=self.positive_users,
+                negative_offsets=self.negative_offsets,
+                negative_users=self.negative_users,
+                store_version=np.array(self.store_version or '')
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Memory-map an index written by save().
+        Args:
+            path: Index file.
+        Returns:
+            UBCFAnnIndex instance.
+        """
+        f = open_npz(path)
+        return cls(
+            f['positive_offsets'], f['positive_users'], f['negative_offsets'], f['negative_users'],
+            str(f['store_version']) or None
+        )
+
+    def shortlist(self, user):
+        """
+        Candidate neighbours taken from the postings of the user's rated items.
+        Args:
+            user: FoldedUser instance.
+        Returns:
+            Sorted array of unique candidate rows.
+        """
+        lists = []
+        for code, value in zip(user.item_codes, user.centered):
+            if value > 0:
+                lists.append(self.positive_users[self.positive_offsets[code]:self.positive_offsets[code + 1]])
+            elif value < 0:
+                lists.append(self.negative_users[self.negative_offsets[code]:self.negative_offsets[code + 1]])
+        if not lists:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(lists)).astype(np.int64)
+
+    def search(self, ubcf_index, user, k=NEIGHBOURS_K):
+        """
+        Approximate top-k neighbours with an exact re-rank of the shortlist.
+        Args:
+            ubcf_index: UBCFIndex the index was built from.
+            user: FoldedUser instance.
+            k: Number of neighbours.
+        Returns:
+            Tuple of (neighbour rows, neighbour weights).
+        """
+        candidates = self.shortlist(user)
+        if not len(candidates):
+            return candidates, np.zeros(0)
+        sims, _ = ubcf_index.similarities(user, rows=candidates)
+        order = np.argsort(-sims, kind='stable')[:k]
+        order = order[sims[order] > 0]
+        return candidates[order], sims[order]
+
+def measure_recall(ann_index, ubcf_index, n_queries=200, n_seed_ratings=10, k=NEIGHBOURS_K, seed=42):
+    """
+    Compare ANN neighbours against the exact search for simulated cold-start users.
+
+    Each query takes a few ratings of a random existing user. That user is
+    excluded from both result lists.
+    Args:
+        ann_index: UBCFAnnIndex instance.
+        ubcf_index: UBCFIndex instance.
+        n_queries: Number of simulated users.
+        n_seed_ratings: Ratings kept per simulated user.
+        k: Number of neighbours.
+        seed: Random seed.
+    Returns:
+        Dictionary with mean recall@k, shortlist size and latencies.
+    """
+    rng = np.random.default_rng(seed)
+    matrix = ubcf_index.matrix
+    eligible = np.flatnonzero(ubcf_index.counts >= n_seed_ratings)
+    recalls, shortlist_sizes, exact_times, ann_times = [], [], [], []
+
+    for row in rng.choice(eligible, min(n_queries, len(eligible)), replace=False):
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        picked = np.sort(rng.choice(np.arange(start, end), n_seed_ratings, replace=False))
+        ratings = np.asarray(matrix.data[picked], dtype=np.float64)
+        centered = ratings - ratings.mean()
+        user = FoldedUser(np.asarray(matrix.indices[picked], dtype=np.int64), centered, ratings.mean(), np.sqrt(np.sum(centered * centered)))
+
+        t0 = time.perf_counter()
+        sims, _ = ubcf_index.similarities(user)
+        sims[row] = 0
+        exact, _ = ubcf_index.top_neighbours(sims, k + 1)
+        exact = exact[exact != row][:k]
+        t1 = time.perf_counter()
+        approx, _ = ann_index.search(ubcf_index, user, k + 1)
+        approx = approx[approx != row][:k]
+        t2 = time.perf_counter()
+
+        if len(exact):
+            recalls.append(len(np.intersect1d(exact, approx)) / len(exact))
+        shortlist_sizes.append(len(ann_index.shortlist(user)))
+        exact_times.append(t1 - t0)
+        ann_times.append(t2 - t1)
+
+    return {
+        "queries": len(exact_times),
+        "k": k,
+        "recall": float(np.mean(recalls)) if recalls else None,
+        "mean_shortlist": float(np.mean(shortlist_sizes)) if shortlist_sizes else 0.0,
+        "exact_ms": 1000 * float(np.mean(exact_times)) if exact_times else None,
+        "ann_ms": 1000 * float(np.mean(ann_times)) if ann_times else None,
+    }
+
+def ann_index_path(store):
+    """Location of the ANN index for a ratings store version."""
+    return os.path.join(store.path, ANN_INDEX_FILE)
+
+###############################################################################
+# MAIN EXEC
+###############################################################################
+
+if __name__ == "__main__":
+    from config import TRAIN_FILE, RATINGS_STORE_DIR
+    from ratings_store import load_ratings_store
+    from ubcf import UBCFIndex
+
+    parser = argparse.ArgumentParser(description='Build or evaluate the UBCF neighbour index')
+    parser.add_argument('command', choices=['build', 'recall'], help='Build the index or measure its recall')
+    parser.add_argument('--postings', type=int, default=DEFAULT_POSTINGS, help='Users kept per item and sign')
+    parser.add_argument('--queries', type=int, default=200, help='Simulated users for the recall check')
+
+    args = parser.parse_args()
+
+    store = load_ratings_store(TRAIN_FILE, RATINGS_STORE_DIR)
+    ubcf_index = UBCFIndex(store.csr())
+    path = ann_index_path(store)
+
+    if args.command == 'build':
+        start = time.time()
+        index = UBCFAnnIndex.build(ubcf_index, postings=args.postings, store_version=store.version)
+        index.save(path)
+        print(f"Built UBCF ANN index with {len(index.positive_users) + len(index.negative_users)} postings in {time.time() - start:.1f}s: {path}", file=sys.stderr)
+    else:
+        index = UBCFAnnIndex.load(path)
+        print(json.dumps(measure_recall(index, ubcf_index, n_queries=args.queries)))
@@ -0,0 +1,349 @@
+import sys
+import os
+import argparse
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+
+##############################################################################
+# INITIALIZATION
+##############################################################################
+
+# Digests are sums modulo 2**63 so they fit a signed SQLite integer
+_DIGEST_MODULUS = 1 << 63
+
+def rating_weight(rating):
+    """Weight of a rating in the user vector: ratings from 1 to 5 mapped to [0, 1]."""
+    return (float(rating) - 1) / 4.0
+
+def _rating_hash(item_id, rating):
+    """Hash of one (item, rating) pair."""
+    key = f"{int(item_id)}:{float(rating)!r}".encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little') % _DIGEST_MODULUS
+
+def ratings_digest(ratings):
+    """
+    Order-independent digest of a set of ratings.
+
+    It is a sum of per-rating hashes, so a stored digest is updated in O(1)
+    when a single rating changes.
+    Args:
+        ratings: Dictionary of {item_id: rating}.
+    Returns:
+        Integer digest.
+    """
+    return sum(_rating_hash(item, rating) for item, rating in ratings.items()) % _DIGEST_MODULUS
+
+##############################################################################
+# USER EMBEDDING STORE
+##############################################################################
+
+class UserEmbeddingStore:
+    """
+    Persisted sums behind the cold-start user vectors of app users.
+
+    A user vector is the rating-weighted average of the GMF and MLP embeddings
+    of the rated items known to the model. Per user the store keeps the
+    weighted sums and the weight total, plus plain sums for users whose
+    weights cancel out, so adding, changing or removing a rating costs one
+    embedding row instead of a pass over all of the user's ratings.
+
+    The ratings themselves are kept too: vectors are dropped when the model
+    version changes and rebuilt from them on first use.
+    """
+
+    def __init__(self, path, item_gmf, item_mlp, item2id, model_version):
+        """
+        Args:
+            path: SQLite file shared by the workers.
+            item_gmf: GMF item embedding table indexed by item code.
+            item_mlp: MLP item embedding table indexed by item code.
+            item2id: Mapping of item IDs to item codes (with a vectorized codes() lookup).
+            model_version: Version of the embedding tables; stored vectors of other versions are dropped.
+        """
+        self.item_gmf = item_gmf
+        self.item_mlp = item_mlp
+        self.item2id = item2id
+        self.model_version = model_version
+        self.counters = {"hits": 0, "synced": 0, "rebuilt": 0, "updates": 0}
+
+        # One connection is shared by the branch threads; a user's update is one transaction
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS user_ratings ("
+            "user_id TEXT NOT NULL, item_id INTEGER NOT NULL, rating REAL NOT NULL, PRIMARY KEY (user_id, item_id))"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS user_vectors ("
+            "user_id TEXT PRIMARY KEY, digest INTEGER NOT NULL, n INTEGER NOT NULL, weight REAL NOT NULL, "
+            "gmf_sum BLOB NOT NULL, mlp_sum BLOB NOT NULL, gmf_wsum BLOB NOT NULL, mlp_wsum BLOB NOT NULL)"
+        )
+
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute("SELECT value FROM meta WHERE key = 'model_version'").fetchone()
+                if row is None or row[0] != model_version:
+                    removed = self.db.execute("DELETE FROM user_vectors").rowcount
+                    self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('model_version', ?)", (model_version,))
+                    if row is not None:
+                        print(f"Model version changed, dropped {removed} stored user vectors", file=sys.stderr)
+                self.db.execute("COMMIT")
+            except sqlite3.Error:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def _empty_state(self):
+        gmf_dim, mlp_dim = self.item_gmf.shape[1], self.item_mlp.shape[1]
+        return {
+            "digest": 0, "n": 0, "weight": 0.0,
+            "gmf_sum": np.zeros(gmf_dim), "mlp_sum": np.zeros(mlp_dim),
+            "gmf_wsum": np.zeros(gmf_dim), "mlp_wsum": np.zeros(mlp_dim),
+        }
+
+    def build_state(self, ratings):
+        """
+        Compute a user's sums from scratch.
+        Args:
+            ratings: Dictionary of {item_id: rating}.
+        Returns:
+            State dictionary (digest, n, weight and the four sums).
+        """
+        state = self._empty_state()
+        state["digest"] = ratings_digest(ratings)
+        if not ratings:
+            return state
+        items = np.fromiter(ratings.keys(), dtype=np.int64, count=len(ratings))
+        weights = (np.fromiter(ratings.values(), dtype=np.float64, count=len(ratings)) - 1) / 4.0
+        codes = self.item2id.codes(items)
+        known = codes >= 0
+        codes, weights = codes[known], weights[known]
+
+        gmf = np.asarray(self.item_gmf[codes], dtype=np.float64)
+        mlp = np.asarray(self.item_mlp[codes], dtype=np.float64)
+        state.update({
+            "n": int(len(codes)), "weight": float(weights.sum()),
+            "gmf_sum": gmf.sum(axis=0), "mlp_sum": mlp.sum(axis=0),
+            "gmf_wsum": weights @ gmf, "mlp_wsum": weights @ mlp,
+        })
+        return state
+
+    def _add(self, state, item_id, rating, sign):
+        """Add (sign=1) or remove (sign=-1) one rating from a state."""
+        state["digest"] = (state["digest"] + sign * _rating_hash(item_id, rating)) % _DIGEST_MODULUS
+        code = int(self.item2id.codes([item_id])[0])
+        if code < 0:
+            return  # Items unknown to the model do not contribute to the vector
+        weight = rating_weight(rating)
+        gmf = np.asarray(self.item_gmf[code], dtype=np.float64)
+        mlp = np.asarray(self.item_mlp[code], dtype=np.float64)
+        state["n"] += sign
+        state["weight"] += sign * weight
+        state["gmf_sum"] += sign * gmf
+        state["mlp_sum"] += sign * mlp
+        state["gmf_wsum"] += sign * weight * gmf
+        state["mlp_wsum"] += sign * weight * mlp
+
+    @staticmethod
+    def vectors_from_state(state):
+        """
+        Turn stored sums into the user vector.
+        Args:
+            state: State dictionary.
+        Returns:
+            Tuple of (gmf_embedding, mlp_embedding), or None when no rated item is known to the model.
+        """
+        if state["n"] <= 0:
+            return None
+        # Same rule as the request-time computation: uniform weights when the ratings weigh nothing
+        if state["weight"] == 0:
+            return state["gmf_sum"] / state["n"], state["mlp_sum"] / state["n"]
+        return state["gmf_wsum"] / state["weight"], state["mlp_wsum"] / state["weight"]
+
+    def _load_state(self, user_id):
+        row = self.db.execute(
+            "SELECT digest, n, weight, gmf_sum, mlp_sum, gmf_wsum, mlp_wsum FROM user_vectors WHERE user_id = ?",
+            (user_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        digest, n, weight, *sums = row
+        state = {"digest": digest, "n": n, "weight": weight}
+        for name, blob in zip(("gmf_sum", "mlp_sum", "gmf_wsum", "mlp_wsum"), sums):
+            state[name] = np.frombuffer(blob, dtype=np.float64).copy()
+        return state
+
+    def _save_state(self, user_id, state):
+        self.db.execute(
+            "INSERT OR REPLACE INTO user_vectors (user_id, digest, n, weight, gmf_sum, mlp_sum, gmf_wsum, mlp_wsum) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (user_id, state["digest"], state["n"], state["weight"],
+             state["gmf_sum"].tobytes(), state["mlp_sum"].tobytes(),
+             state["gmf_wsum"].tobytes(), state["mlp_wsum"].tobytes())
+        )
+
+    def _stored_ratings(self, user_id):
+        rows = self.db.execute("SELECT item_id, rating FROM user_ratings WHERE user_id = ?", (user_id,))
+        return {item: rating for item, rating in rows}
+
+    def _current_state(self, user_id):
+        """Stored state of a user, rebuilt from their stored ratings when missing."""
+        state = self._load_state(user_id)
+        if state is None:
+            state = self.build_state(self._stored_ratings(user_id))
+            self.counters["rebuilt"] += 1
+        return state
+
+    def _apply(self, user_id, changes):
+        """Apply rating changes inside an open transaction and return the new state."""
+        state = self._current_state(user_id)
+        for item_id, rating in changes.items():
+            row = self.db.execute(
+                "SELECT rating FROM user_ratings WHERE user_id = ? AND item_id = ?", (user_id, item_id)
+            ).fetchone()
+            if row is not None:
+                self._add(state, item_id, row[0], -1)
+            if rating is None:
+                self.db.execute("DELETE FROM user_ratings WHERE user_id = ? AND item_id = ?", (user_id, item_id))
+            else:
+                self._add(state, item_id, rating, 1)
+                self.db.execute(
+                    "INSERT OR REPLACE INTO user_ratings (user_id, item_id, rating) VALUES (?, ?, ?)",
+                    (user_id, item_id, rating)
+                )
+        self._save_state(user_id, state)
+        return state
+
+    def _transaction(self, work):
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                result = work()
+                self.db.execute("COMMIT")
+                return result
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def update(self, user_id, changes):
+        """
+        Apply added, changed and removed ratings of a user as deltas.
+        Args:
+            user_id: App user ID.
+            changes: Dictionary of {item_id: rating}, None as rating removes it.
+        Returns:
+            Number of ratings the user has afterwards among the items known to the model.
+        """
+        user_id = str(user_id)
+        changes = {int(item): None if rating is None else float(rating) for item, rating in changes.items()}
+        state = self._transaction(lambda: self._apply(user_id, changes))
+        self.counters["updates"] += len(changes)
+        return state["n"]
+
+    def vectors(self, user_id, ratings):
+        """
+        User vector for the ratings of a request.
+
+        When the stored ratings differ from the request (e.g. an update was
+        missed), only the differing ratings are applied before answering.
+        Args:
+            user_id: App user ID.
+            ratings: Dictionary of {item_id: rating} sent with the request.
+        Returns:
+            Tuple of (gmf_embedding, mlp_embedding), or None when no rated item is known to the model.
+        """
+        user_id = str(user_id)
+        with self.lock:
+            state = self._load_state(user_id)
+        if state is not None and state["digest"] == ratings_digest(ratings):
+            self.counters["hits"] += 1
+            return self.vectors_from_state(state)
+
+        def sync():
+            stored = self._stored_ratings(user_id)
+            changes = {item: rating for item, rating in ratings.items() if stored.get(item) != rating}
+            changes.update({item: None for item in stored if item not in ratings})
+            return self._apply(user_id, changes)
+
+        self.counters["synced"] += 1
+        return self.vectors_from_state(self._transaction(sync))
+
+    def check(self, user_id, tolerance=1e-6):
+        """
+        Rebuild a user from their stored ratings and compare with the stored vector.
+        An inconsistent state is replaced by the rebuilt one.
+        Args:
+            user_id: App user ID.
+            tolerance: Largest accepted absolute difference per vector component.
+        Returns:
+            Dictionary with the number of ratings, the largest difference and whether it was consistent.
+        """
+        user_id = str(user_id)
+
+        def compare():
+            stored = self._load_state(user_id)
+            ratings = self._stored_ratings(user_id)
+            rebuilt = self.build_state(ratings)
+            if stored is None:
+                difference = None
+            else:
+                expected, actual = self.vectors_from_state(rebuilt), self.vectors_from_state(stored)
+                if expected is None or actual is None:
+                    difference = 0.0 if expected is None and actual is None else float('inf')
+                else:
+                    difference = max(float(np.abs(e - a).max()) for e, a in zip(expected, actual))
+                if stored["digest"] != rebuilt["digest"] or stored["n"] != rebuilt["n"]:
+                    difference = float('inf')
+            consistent = difference is not None and difference <= tolerance
+            if not consistent:
+                self._save_state(user_id, rebuilt)
+            return {"user_id": user_id, "ratings": len(ratings), "max_difference": difference, "consistent": consistent}
+
+        return self._transaction(compare)
+
+    def user_ids(self):
+        """IDs of all users with stored ratings."""
+        with self.lock:
+            return [row[0] for row in self.db.execute("SELECT DISTINCT user_id FROM user_ratings")]
+
+    def stats(self):
+        """
+        Counters of the store.
+        Returns:
+            Dictionary with request hits, syncs, rebuilds, applied updates and the number of stored vectors.
+        """
+        with self.lock:
+            stored = self.db.execute("SELECT COUNT(*) FROM user_vectors").fetchone()[0]
+        return {**self.counters, "vectors": stored, "model_version": self.model_version}
+
+###############################################################################
+# MAIN EXEC
+###############################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check stored cold-start user vectors against a rebuild from their ratings')
+    parser.add_argument('user_ids', nargs='*', help='Users to check, all stored users when omitted')
+    parser.add_argument('--tolerance', type=float, default=1e-6, help='Largest accepted difference per component')
+
+    args = parser.parse_args()
+
+    from recommendations import load_model, get_user_embeddings
+
+    store = get_user_embeddings(load_model())
+    if store is None:
+        print("USER_EMBEDDINGS_DB is not set", file=sys.stderr)
+        sys.exit(1)
+
+    inconsistent = 0
+    for user_id in args.user_ids or store.user_ids():
+        result = store.check(user_id, args.tolerance)
+        if not result["consistent"]:
+            inconsistent += 1
+            print(f"Rebuilt user {user_id}: {result['ratings']} ratings, difference {result['max_difference']}", file=sys.stderr)
+    print(f"{inconsistent} inconsistent user vectors rebuilt", file=sys.stderr)
+    sys.exit(1 if inconsistent else 0)
@@ -14,6 +14,7 @@ import moviesRouter from './routes/movies.js'; // Routes for movie-related opera
 import recommendationRouter from './routes/recommendation.js'; // Routes for recommendations
 import feedbackRouter from './routes/feedback.js'; // Routes for feedback submission
 import pool from './config/dbConn.js'; // Database connection pool
+import recommendationService from './services/recommendationService.js'; // Resident recommendation workers
 
 
 // Initialize the Express application
@@ -55,5 +56,14 @@ app.use('/feedback', feedbackRouter); // Feedback submission
 // Start the server
 app.listen(port, () => {
   console.log(`Server is running on ${port}`); // Log server start message
+  recommendationService.startWorkers(); // Load the recommendation model in the background
+});
+
+// Stop the recommendation workers when the server shuts down
+['SIGINT', 'SIGTERM'].forEach((signal) => {
+  process.on(signal, () => {
+    recommendationService.stopWorkers();
+    process.exit(0);
+  });
 });
 
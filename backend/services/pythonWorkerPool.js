@@ -0,0 +1,390 @@
+import { spawn } from 'child_process'; // Import spawn to execute child processes
+import readline from 'readline'; // Import readline to split worker output into lines
+
+/**
+ * Keeps a small pool of resident Python recommendation workers.
+ * Every worker loads the model once and then serves JSON-lines requests
+ * ({"id", "op", ...}) over stdin/stdout. Up to maxInFlight requests are
+ * pipelined to a worker, which micro-batches them and answers by id.
+ */
+export class PythonWorkerPool {
+  /**
+   * @param {string} script - Path to the Python recommendation script.
+   * @param {Object} options - Pool options.
+   * @param {number} options.size - Number of workers to keep alive.
+   * @param {string} options.python - Python executable.
+   * @param {number} options.maxInFlight - Requests sent to one worker before it gets no more.
+   * @param {number} options.requestTimeoutMs - Timeout for a single request, also sent to the worker as its deadline.
+   * @param {number} options.deadlineGraceMs - Extra time given to a worker to report a missed deadline before it is killed.
+   * @param {number} options.healthIntervalMs - Interval between health checks.
+   * @param {number} options.restartDelayMs - Delay before restarting a crashed worker.
+   * @param {number} options.maxRestartDelayMs - Upper bound of the delay when workers keep failing to load.
+   */
+  constructor(script, options = {}) {
+    this.script = script;
+    this.size = options.size || 2;
+    this.python = options.python || 'python';
+    this.maxInFlight = options.maxInFlight || 8;
+    this.requestTimeoutMs = options.requestTimeoutMs || 120000;
+    this.deadlineGraceMs = options.deadlineGraceMs || 5000;
+    this.healthIntervalMs = options.healthIntervalMs || 30000;
+    this.restartDelayMs = options.restartDelayMs || 5000;
+    this.maxRestartDelayMs = options.maxRestartDelayMs || 300000;
+
+    this.workers = []; // Running worker records
+    this.queue = []; // Requests waiting for a worker with free capacity
+    this.undelivered = []; // Broadcasts no running worker has received yet
+    this.loadError = null; // Last load error while no worker is ready
+    this.restartFailures = 0; // Workers in a row that exited before they were ready
+    this.nextRequestId = 1;
+    this.started = false;
+    this.stopping = false;
+    this.healthTimer = null;
+  }
+
+  /**
+   * Starts the workers. Calling it again is a no-op.
+   */
+  start() {
+    if (this.started) {
+      return;
+    }
+    this.started = true;
+    this.stopping = false;
+
+    for (let i = 0; i < this.size; i++) {
+      this.spawnWorker();
+    }
+
+    // Periodically ping idle workers so hung processes get replaced
+    this.healthTimer = setInterval(() => this.checkHealth(), this.healthIntervalMs);
+    this.healthTimer.unref();
+  }
+
+  /**
+   * Stops all workers and rejects pending requests.
+   */
+  stop() {
+    this.stopping = true;
+    this.started = false;
+    clearInterval(this.healthTimer);
+
+    this.rejectWaiting(this.queue, new Error('Recommendation worker pool stopped'));
+    this.queue = [];
+    this.rejectWaiting(this.undelivered, new Error('Recommendation worker pool stopped'));
+    this.undelivered = [];
+
+    this.workers.forEach((worker) => {
+      this.rejectWaiting(worker.pending, new Error('Recommendation worker pool stopped'));
+      worker.pending = [];
+      this.failInFlight(worker, new Error('Recommendation worker pool stopped'));
+      worker.process.stdin.end(JSON.stringify({ op: 'shutdown' }) + '\n');
+    });
+  }
+
+  /**
+   * Returns readiness information about the pool.
+   * @returns {Object} Number of ready, busy and queued entries and in-flight requests.
+   */
+  status() {
+    return {
+      workers: this.workers.length,
+      ready: this.workers.filter((worker) => worker.ready).length,
+      busy: this.workers.filter((worker) => worker.inFlight.size).length,
+      inFlight: this.workers.reduce((total, worker) => total + worker.inFlight.size, 0),
+      queued: this.queue.length,
+    };
+  }
+
+  /**
+   * Sends a request to the least loaded worker.
+   * @param {Object} payload - Request body, e.g. { op: 'recommend', ratings: {...} }.
+   * @returns {Promise<Object>} Result returned by the worker.
+   */
+  request(payload) {
+    this.start();
+    if (this.loadError && !this.workers.some((worker) => worker.ready)) {
+      // Workers cannot load the model, fail fast instead of queueing until the timeout
+      return Promise.reject(new Error(`Recommendation worker failed to load: ${this.loadError}`));
+    }
+    return new Promise((resolve, reject) => {
+      this.queue.push(this.createJob(payload, resolve, reject));
+      this.dispatch();
+    });
+  }
+
+  /**
+   * Sends a request to every worker, e.g. to invalidate cached results.
+   * Workers that are still loading receive it once they are ready. When no
+   * worker is running, every worker started later receives it until one
+   * answers, so none of them serves results the request was meant to drop.
+   * @param {Object} payload - Request body, e.g. { op: 'invalidate', user_id: '42' }.
+   * @returns {Promise<Array>} Results returned by the workers.
+   */
+  broadcast(payload) {
+    this.start();
+    if (!this.workers.length) {
+      return new Promise((resolve, reject) => {
+        this.undelivered.push(this.createJob(payload, (result) => resolve([result]), reject));
+      });
+    }
+    const requests = this.workers.map((worker) => new Promise((resolve, reject) => {
+      const job = this.createJob(payload, resolve, reject);
+      job.broadcast = true;
+      worker.pending.push(job);
+    }));
+    this.dispatch();
+    return Promise.all(requests);
+  }
+
+  /**
+   * Creates a request record that times out while it waits for a worker, too.
+   * @param {Object} payload - Request body.
+   * @param {Function} resolve - Called with the result.
+   * @param {Function} reject - Called with the error.
+   * @returns {Object} Request record.
+   */
+  createJob(payload, resolve, reject) {
+    const job = { payload, resolve, reject, expiresAt: Date.now() + this.requestTimeoutMs };
+    job.waitTimer = setTimeout(() => {
+      this.queue = this.queue.filter((queued) => queued !== job);
+      this.undelivered = this.undelivered.filter((queued) => queued !== job);
+      this.workers.forEach((worker) => {
+        worker.pending = worker.pending.filter((queued) => queued !== job);
+      });
+      reject(new Error('Recommendation request timed out'));
+    }, this.requestTimeoutMs);
+    return job;
+  }
+
+  /**
+   * Rejects requests that are not assigned to a worker yet.
+   * @param {Array} jobs - Request records.
+   * @param {Error} error - Error to reject with.
+   */
+  rejectWaiting(jobs, error) {
+    jobs.forEach((job) => {
+      clearTimeout(job.waitTimer);
+      job.reject(error);
+    });
+  }
+
+  /**
+   * Wraps an undelivered broadcast for one new worker; the first answer settles it.
+   * @param {Object} job - Undelivered broadcast record.
+   * @returns {Object} Request record for the worker.
+   */
+  deliver(job) {
+    return {
+      payload: job.payload,
+      resolve: (result) => {
+        if (this.undelivered.includes(job)) {
+          this.undelivered = this.undelivered.filter((queued) => queued !== job);
+          clearTimeout(job.waitTimer);
+          job.resolve(result);
+        }
+      },
+      reject: () => {}, // Another worker may still deliver it, the broadcast times out otherwise
+      delivery: true,
+    };
+  }
+
+  /**
+   * Spawns a single worker process and wires up its output.
+   */
+  spawnWorker() {
+    const child = spawn(this.python, [this.script, '--worker']);
+    // inFlight: requests written to the worker by id, pending: requests for this worker only
+    const worker = {
+      process: child,
+      ready: false,
+      inFlight: new Map(),
+      pending: this.undelivered.map((job) => this.deliver(job)),
+    };
+    this.workers.push(worker);
+
+    // Parse protocol messages line by line
+    const lines = readline.createInterface({ input: child.stdout });
+    lines.on('line', (line) => this.handleMessage(worker, line));
+
+    // Forward diagnostics without treating them as errors
+    const logs = readline.createInterface({ input: child.stderr });
+    logs.on('line', (line) => console.log(`[recommendations:${child.pid}] ${line}`));
+
+    child.on('error', (err) => {
+      console.error('Failed to start recommendation worker:', err);
+    });
+
+    child.on('close', (code) => {
+      this.workers = this.workers.filter((w) => w !== worker);
+      this.failInFlight(worker, new Error(`Recommendation worker exited with code ${code}`));
+      const broadcasts = worker.pending.filter((job) => job.broadcast);
+      worker.pending = [];
+
+      if (this.stopping) {
+        this.rejectWaiting(broadcasts, new Error(`Recommendation worker exited with code ${code}`));
+        return;
+      }
+      // Broadcasts the worker never received go to its replacement
+      this.undelivered.push(...broadcasts);
+
+      // Replace crashed workers, backing off while they keep failing before they are ready
+      this.restartFailures = worker.ready ? 0 : this.restartFailures + 1;
+      const delay = Math.min(this.restartDelayMs * 2 ** Math.min(this.restartFailures, 16), this.maxRestartDelayMs);
+      console.error(`Recommendation worker ${child.pid} exited with code ${code}, restarting in ${delay} ms`);
+      setTimeout(() => {
+        if (!this.stopping) {
+          this.spawnWorker();
+        }
+      }, delay);
+    });
+  }
+
+  /**
+   * Handles a protocol line written by a worker.
+   * @param {Object} worker - Worker record.
+   * @param {string} line - Raw JSON line.
+   */
+  handleMessage(worker, line) {
+    let message;
+    try {
+      message = JSON.parse(line);
+    } catch (err) {
+      console.error('Invalid message from recommendation worker:', line);
+      return;
+    }
+
+    if (message.type === 'ready') {
+      worker.ready = true;
+      this.loadError = null;
+      this.restartFailures = 0;
+      this.dispatch();
+      return;
+    }
+
+    if (message.type === 'error') {
+      console.error('Recommendation worker failed to load:', message.error);
+      this.loadError = message.error;
+      if (!this.workers.some((candidate) => candidate.ready)) {
+        // Nothing can serve the queued requests until a restarted worker loads
+        this.rejectWaiting(this.queue, new Error(`Recommendation worker failed to load: ${message.error}`));
+        this.queue = [];
+      }
+      return;
+    }
+
+    if (!worker.inFlight.has(message.id)) {
+      return; // Late answer for a request that already timed out
+    }
+
+    if (message.ok) {
+      // Recommendation answers carry per-stage timings next to the result
+      const result = message.timings ? { ...message.result, timings: message.timings } : message.result;
+      this.finishJob(worker, message.id, null, result);
+    } else {
+      // Overloaded workers reject requests instead of queueing them without bound
+      const error = new Error(message.error);
+      if (message.code) {
+        error.code = message.code;
+      }
+      this.finishJob(worker, message.id, error);
+    }
+    this.dispatch();
+  }
+
+  /**
+   * Assigns queued requests to ready workers with free capacity.
+   */
+  dispatch() {
+    const ready = this.workers.filter((worker) => worker.ready);
+
+    // Requests addressed to a worker go before the shared queue
+    ready.forEach((worker) => {
+      while (worker.pending.length && worker.inFlight.size < this.maxInFlight) {
+        this.assign(worker, worker.pending.shift());
+      }
+    });
+
+    // Spread shared requests over the least loaded workers so they can batch them
+    while (this.queue.length) {
+      const worker = ready.reduce((best, candidate) => (
+        !best || candidate.inFlight.size < best.inFlight.size ? candidate : best
+      ), null);
+      if (!worker || worker.inFlight.size >= this.maxInFlight) {
+        return;
+      }
+      this.assign(worker, this.queue.shift());
+    }
+  }
+
+  /**
+   * Writes a request to a specific worker.
+   * @param {Object} worker - Ready worker record.
+   * @param {Object} job - Queued request.
+   */
+  assign(worker, job) {
+    job.id = this.nextRequestId++;
+    clearTimeout(job.waitTimer);
+    // Time spent waiting for a worker counts against the request timeout
+    const timeoutMs = job.expiresAt ? Math.max(job.expiresAt - Date.now(), 0) : this.requestTimeoutMs;
+    job.timer = setTimeout(() => {
+      // A worker that misses even the deadline it was given cannot be trusted with further requests
+      this.finishJob(worker, job.id, new Error('Recommendation request timed out'));
+      worker.process.kill();
+    }, timeoutMs + this.deadlineGraceMs);
+
+    worker.inFlight.set(job.id, job);
+    const message = { ...job.payload, id: job.id };
+    if (message.op === 'recommend') {
+      message.deadline_ms = timeoutMs; // The worker drops requests that waited too long
+    }
+    worker.process.stdin.write(JSON.stringify(message) + '\n');
+  }
+
+  /**
+   * Settles a request a worker is processing.
+   * @param {Object} worker - Worker record.
+   * @param {number} id - Request ID.
+   * @param {Error|null} error - Error to reject with.
+   * @param {Object} result - Result to resolve with.
+   */
+  finishJob(worker, id, error, result) {
+    const job = worker.inFlight.get(id);
+    if (!job) {
+      return;
+    }
+    worker.inFlight.delete(id);
+    clearTimeout(job.timer);
+    if (error) {
+      job.reject(error);
+    } else {
+      job.resolve(result);
+    }
+  }
+
+  /**
+   * Rejects every request a worker is processing.
+   * @param {Object} worker - Worker record.
+   * @param {Error} error - Error to reject with.
+   */
+  failInFlight(worker, error) {
+    [...worker.inFlight.keys()].forEach((id) => this.finishJob(worker, id, error));
+  }
+
+  /**
+   * Sends a health request to every ready worker, busy ones included.
+   */
+  checkHealth() {
+    this.workers
+      .filter((worker) => worker.ready)
+      .forEach((worker) => {
+        this.assign(worker, {
+          payload: { op: 'health' },
+          resolve: () => {},
+          reject: (err) => console.error('Recommendation worker health check failed:', err.message),
+        });
+      });
+  }
+}
+
+export default PythonWorkerPool; // Export the worker pool
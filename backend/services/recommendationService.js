@@ -1,7 +1,7 @@
-import { spawn } from 'child_process'; // Import spawn to execute child processes
 import path from 'path'; // Import path for file path manipulation
 import { fileURLToPath } from 'url'; // Import fileURLToPath for URL handling
 import pool from "../config/dbConn.js"; // Import the database connection pool
+import PythonWorkerPool from './pythonWorkerPool.js'; // Import the resident Python worker pool
 
 // Get the current file and directory paths
 const __filename = fileURLToPath(import.meta.url);
@@ -10,6 +10,13 @@ const __dirname = path.dirname(__filename);
 // Path to the Python recommendation script
 const PYTHON_SCRIPT = path.join(__dirname, '../model/recommendations.py');
 
+// Pool of resident Python workers that keep the model loaded between requests
+const workerPool = new PythonWorkerPool(PYTHON_SCRIPT, {
+  size: parseInt(process.env.RECOMMENDATION_WORKERS || '2', 10),
+  maxInFlight: parseInt(process.env.RECOMMENDATION_WORKER_CONCURRENCY || '8', 10),
+  python: process.env.PYTHON || 'python',
+});
+
 /**
  * Converts a decade range string into an array of individual years.
  * @param {string} decade - The decade range (e.g., "before 1990s", "1990s", "2000s", "2010s").
@@ -81,71 +88,87 @@ export const getRecommendations = async (userId) => {
 };
 
 /**
- * Runs the Python recommendation script.
+ * Runs the Python recommendation script on a resident worker.
  * @param {string} userId - User ID.
  * @param {Object} userRatings - Optional ratings object.
  * @param {Array} genrePreferences - Optional genre preferences.
  * @param {Array} decadePreferences - Optional decade preferences.
  * @returns {Promise<Array>} Recommendations.
  */
-const runPythonRecommendations = (userId, userRatings = {}, genrePreferences = [], decadePreferences = []) => {
-  return new Promise((resolve, reject) => {
-    const args = [PYTHON_SCRIPT]; // Initialize arguments with the script path
-
-    // Add user ratings or user ID to the arguments
-    if (Object.keys(userRatings).length > 0) {
-      args.push('--ratings', JSON.stringify(userRatings));
-    } else if (userId) {
-      args.push('--user_id', userId.toString());
-    } else {
-      return reject(new Error('No user ID or ratings available')); // Reject if neither is provided
-    }
-
-    // Add genre preferences to the arguments
-    if (genrePreferences.length > 0) {
-      args.push('--genres', JSON.stringify(genrePreferences));
-    }
+const runPythonRecommendations = async (userId, userRatings = {}, genrePreferences = [], decadePreferences = []) => {
+  const payload = { op: 'recommend' }; // Initialize the worker request
+
+  // Add user ratings and user ID to the request (the ID also tags cached results)
+  if (Object.keys(userRatings).length > 0) {
+    payload.ratings = userRatings;
+  } else if (!userId) {
+    throw new Error('No user ID or ratings available'); // Reject if neither is provided
+  }
+  if (userId) {
+    payload.user_id = userId.toString();
+  }
 
-    // Add decade preferences to the arguments
-    if (decadePreferences.length > 0) {
-      args.push('--decade', JSON.stringify(decadePreferences));
-    }
+  // Add genre preferences to the request
+  if (genrePreferences.length > 0) {
+    payload.genres = genrePreferences;
+  }
 
-    // Spawn the Python process
-    const pythonProcess = spawn('python', args);
+  // Add decade preferences to the request
+  if (decadePreferences.length > 0) {
+    payload.decades = decadePreferences;
+  }
 
-    let result = ''; // Variable to store stdout data
-    let error = ''; // Variable to store stderr data
+  return workerPool.request(payload); // Resolve with recommendations
+};
 
-    // Collect stdout data
-    pythonProcess.stdout.on('data', (data) => {
-      result += data.toString();
-    });
+/**
+ * Drops cached recommendations of a user after their ratings or preferences changed.
+ * Failures are logged only, a stale entry still expires after its TTL.
+ * @param {string} userId - User ID.
+ * @returns {Promise<void>}
+ */
+export const invalidateUser = async (userId) => {
+  try {
+    await workerPool.broadcast({ op: 'invalidate', user_id: userId.toString() });
+  } catch (error) {
+    console.error('Error invalidating cached recommendations:', error); // Log error for debugging
+  }
+};
 
-    // Collect stderr data and log errors
-    pythonProcess.stderr.on('data', (data) => {
-      error += data.toString();
-      console.error('Python error:', error);
+/**
+ * Applies added, changed or removed ratings to the stored user vector, so the next
+ * request does not rebuild it from all ratings, and records all of the user's
+ * ratings so they become a UBCF neighbour for other users. Failures are logged
+ * only, the vector is reconciled with the ratings sent by the next request.
+ * @param {string} userId - User ID.
+ * @param {Object} ratings - Map of movie ID to rating, null for a removed rating.
+ * @returns {Promise<void>}
+ */
+export const updateUserRatings = async (userId, ratings) => {
+  try {
+    const userMovieRatings = await pool.query(
+      "SELECT movieid, rating FROM user_survey_ratings WHERE userid = $1",
+      [userId]
+    );
+    const allRatings = {};
+    userMovieRatings.rows.forEach(row => {
+      allRatings[row.movieid] = row.rating; // Map movie IDs to ratings
     });
 
-    // Handle process close event
-    pythonProcess.on('close', (code) => {
-      if (code !== 0) {
-        return reject(new Error(`Python process exited with code ${code}: ${error}`)); // Reject if process fails
-      }
-
-      try {
-        const cleanedResult = result.trim(); // Trim the result
-        const recommendations = JSON.parse(cleanedResult); // Parse JSON output
-        if (recommendations.error) {
-          return reject(new Error(recommendations.error)); // Reject if error exists in output
-        }
-        resolve(recommendations); // Resolve with recommendations
-      } catch (err) {
-        reject(new Error(`Failed to parse Python output: ${err.message}`)); // Reject if parsing fails
-      }
-    });
-  });
+    await workerPool.request({ op: 'update_ratings', user_id: userId.toString(), ratings, all_ratings: allRatings });
+  } catch (error) {
+    console.error('Error updating stored user vector:', error); // Log error for debugging
+  }
 };
 
-export default { getRecommendations }; // Export the recommendation service
\ No newline at end of file
+/**
+ * Starts the recommendation workers so the model is loaded before the first request.
+ */
+export const startWorkers = () => workerPool.start();
+
+/**
+ * Stops the recommendation workers.
+ */
+export const stopWorkers = () => workerPool.stop();
+
+export default { getRecommendations, invalidateUser, updateUserRatings, startWorkers, stopWorkers }; // Export the recommendation service
\ No newline at end of file